@@ -0,0 +1,13 @@
+"""
+Shared infrastructure for the Sigma rule lint suites (test_rules.py, test_logsource.py)
+"""
+
+from .cache import DocumentCache, Finding, FindingsCache
+from .corpus import Rule, RuleCorpus
+from .engine import CheckEngine, CheckRegistry
+from .fingerprint import canonical_detection, detection_fingerprint, group_by_fingerprint, rule_fingerprint
+from .index import RuleIndex
+from .testcase import CorpusTestCase
+
+__all__ = ["CheckEngine", "CheckRegistry", "CorpusTestCase", "DocumentCache", "Finding", "FindingsCache", "Rule", "RuleCorpus", "RuleIndex",
+           "canonical_detection", "detection_fingerprint", "group_by_fingerprint", "rule_fingerprint"]
@@ -0,0 +1,195 @@
+"""
+Precompiled MITRE ATT&CK tag index
+
+Rule tags are validated against the techniques, tactics, groups and software of the ATT&CK
+data in the tests/cti submodule (https://github.com/mitre/cti). Walking that STIX bundle
+through attackcti/stix2 takes longer than the rest of the lint run, so it is compiled once
+into tests/attack-tags.json together with the CTI commit it was built from. The lint suite
+only loads that file, and rebuilds it when the checked out submodule is at another commit.
+
+The index is a local build product, ignored by git and not stored in the repository: the
+lint suite needs the submodule checked out (git submodule update --init tests/cti) to build
+it on its first run. CI builds it once per CTI commit and restores it from its cache, without
+checking out the submodule.
+
+Build or refresh the index, e.g. after updating the submodule:
+# python -m sigmalint.attack
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from .changes import _git
+from .paths import TESTS_DIR
+
+INDEX_FORMAT = 1
+
+CTI_DIR = os.path.join(TESTS_DIR, "cti")
+
+INDEX_PATH = os.path.join(TESTS_DIR, "attack-tags.json")
+
+# STIX object types and the tags they contribute
+TECHNIQUE_TYPE = "attack-pattern"
+SOFTWARE_TYPES = ("tool", "malware")
+GROUP_TYPE = "intrusion-set"
+
+
+class AttackIndex:
+    """
+    Valid 'attack.*' tags and the tactics of every technique, for one CTI commit
+    """
+
+    def __init__(self, tags, technique_tactics: dict, cti_commit: str = None):
+        self.tags = frozenset(tags)
+        self.technique_tactics = {technique: tuple(tactics) for technique, tactics in technique_tactics.items()}
+        self.tactic_techniques = {}
+        for technique, tactics in sorted(self.technique_tactics.items()):
+            for tactic in tactics:
+                self.tactic_techniques.setdefault(tactic, []).append(technique)
+        self.tactic_techniques = {tactic: tuple(techniques) for tactic, techniques in self.tactic_techniques.items()}
+        self.cti_commit = cti_commit
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["tags"], data["technique_tactics"], data.get("cti_commit"))
+
+    def to_json(self) -> dict:
+        return {
+            "format": INDEX_FORMAT,
+            "cti_commit": self.cti_commit,
+            "tags": sorted(self.tags),
+            "technique_tactics": {technique: list(tactics) for technique, tactics in sorted(self.technique_tactics.items())},
+        }
+
+    def tactics_of(self, technique: str) -> tuple:
+        """
+        Tactics of a technique id such as 't1059.001' (with or without the 'attack.' prefix)
+        """
+        return self.technique_tactics.get(technique.lower().replace("attack.", "", 1), ())
+
+    def techniques_of(self, tactic: str) -> tuple:
+        return self.tactic_techniques.get(tactic.lower().replace("attack.", "", 1).replace("-", "_"), ())
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.tags
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+
+def cti_commit(cti_dir: str = CTI_DIR) -> str:
+    """
+    Commit the submodule is checked out at, None if it is not checked out
+    """
+    if not os.path.exists(os.path.join(cti_dir, ".git")):
+        return None
+    return _git(["rev-parse", "HEAD"], cti_dir)[0]
+
+
+def _is_current(obj: dict) -> bool:
+    return not obj.get("revoked", False) and not obj.get("x_mitre_deprecated", False)
+
+
+def _external_ids(obj: dict) -> list:
+    return [reference["external_id"].lower() for reference in obj.get("external_references", [])
+            if "external_id" in reference]
+
+
+def build_attack_index(cti_dir: str = CTI_DIR) -> AttackIndex:
+    """
+    Compile the Enterprise ATT&CK bundle of a mitre/cti checkout, revoked and deprecated objects are left out
+    """
+    bundle_path = os.path.join(cti_dir, "enterprise-attack", "enterprise-attack.json")
+    with open(bundle_path, encoding="utf-8") as f:
+        bundle = json.load(f)
+
+    techniques = []
+    technique_names = []
+    tactics = set()
+    groups = []
+    software = []
+    technique_tactics = {}
+    for obj in bundle.get("objects", []):
+        if not _is_current(obj):
+            continue
+        if obj.get("type") == TECHNIQUE_TYPE:
+            technique_names.append(obj["name"].lower().replace(' ', '_').replace('-', '_'))
+            technique_ids = _external_ids(obj)
+            techniques += technique_ids
+            phases = [phase["phase_name"].replace('-', '_') for phase in obj.get("kill_chain_phases", [])
+                      if "phase_name" in phase]
+            tactics.update(phases)
+            for reference in obj.get("external_references", []):
+                if reference.get("source_name") == "mitre-attack" and "external_id" in reference:
+                    technique_tactics[reference["external_id"].lower()] = sorted(set(phases))
+        elif obj.get("type") in SOFTWARE_TYPES:
+            software += _external_ids(obj)
+        elif obj.get("type") == GROUP_TYPE:
+            groups += _external_ids(obj)
+
+    print("MITRE ATT&CK LIST LENGTHS: %d %d %d %d %d" % (len(techniques), len(technique_names), len(tactics),
+                                                         len(groups), len(software)))
+    tags = ["attack." + item for item in techniques + technique_names + sorted(tactics) + groups + software]
+    return AttackIndex(tags, technique_tactics, cti_commit(cti_dir))
+
+
+def write_attack_index(index: AttackIndex, path: str = INDEX_PATH) -> None:
+    directory = os.path.dirname(path)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix=".attack-tags-")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as f:
+            json.dump(index.to_json(), f, indent=1, sort_keys=True)
+            f.write("\n")
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_attack_index(path: str = INDEX_PATH) -> AttackIndex:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("format") != INDEX_FORMAT:
+        return None
+    return AttackIndex.from_json(data)
+
+
+def load_attack_index(path: str = INDEX_PATH, cti_dir: str = CTI_DIR) -> AttackIndex:
+    """
+    Return the tag index, built first if there is none or the checked out submodule is at
+    another commit than the one it was built from. Without a checkout an index built earlier
+    is used as it is, with neither RuntimeError is raised.
+    """
+    commit = cti_commit(cti_dir)
+    index = read_attack_index(path)
+    if index is not None and (commit is None or index.cti_commit == commit):
+        return index
+    if commit is None:
+        raise RuntimeError("No ATT&CK tag index at {} and no CTI checkout to build it from. The index is not stored "
+                           "in the repository: check out the CTI data (git submodule update --init tests/cti, or "
+                           "git clone https://github.com/mitre/cti.git tests/cti) and run the tests again.".format(path))
+    index = build_attack_index(cti_dir)
+    write_attack_index(index, path)
+    return index
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.attack",
+                                     description="Compile the ATT&CK data of a mitre/cti checkout into the tag index")
+    parser.add_argument("cti", nargs="?", default=CTI_DIR, help="mitre/cti checkout (default: the tests/cti submodule)")
+    parser.add_argument("-o", "--output", default=INDEX_PATH, help="index file (default: {})".format(INDEX_PATH))
+    args = parser.parse_args(argv)
+    index = build_attack_index(args.cti)
+    write_attack_index(index, args.output)
+    print("Wrote {} tags of CTI commit {} to {}".format(len(index), index.cti_commit, args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,543 @@
+"""
+Cost analysis of '|re' values: catastrophic backtracking
+
+Backends turn '|re' values into regular expressions that run against every event, in a SIEM
+or in THOR, whose engines backtrack like Python's. analyze_pattern() compiles a value once
+(memoized by value and flags, shared by all rules) and looks for the shapes whose matching
+time explodes on unlucky input:
+
+    nested quantifier       an unbounded repeat inside another one that can hand the same
+                            characters back and forth, e.g. (a+)+, (\\w+\\s*)+     exponential
+    ambiguous alternation   alternatives of a repeated group starting with the same
+                            characters, e.g. (a|ab)*, (\\w|\\d)+                  exponential
+    leading .*              '.*' at the start of an unanchored pattern, tried again at every
+                            position of a failing search                         polynomial
+    overlapping quantifiers unbounded repeats in sequence that can match the same characters,
+                            e.g. .*a.*a.*, each adds a degree                    polynomial
+
+This static pass works on the parsed pattern with the first-character sets of its parts
+(over ASCII). Suspicious patterns are then run against generated adversarial inputs:
+the pattern's literal prefix, a pumped run of the characters the repeats fight over and a
+character that makes the match fail. Input lengths grow while the next run is predicted to
+stay within the time budget of the pattern, the growth of the measured times gives the
+estimated cost of one search over REFERENCE_LENGTH characters.
+
+To report the estimated cost of the '|re' values of rules, run from the tests directory:
+# python -m sigmalint.backtracking [rule files or directories]
+"""
+
+import argparse
+import functools
+import math
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Length of the event field the estimated cost refers to
+REFERENCE_LENGTH = 4096
+
+# Estimated seconds for one search over REFERENCE_LENGTH characters above which a value is too slow
+COST_BUDGET = 2.0
+
+# Seconds of matching one pattern may take while it is confirmed
+MEASURE_BUDGET = 0.2
+
+# Times below this are timer noise, they do not count for the growth
+MEASURABLE = 2e-4
+
+# Per-character growth factor from which the cost counts as exponential
+EXPONENTIAL_GROWTH = 1.2
+
+ALPHABET = frozenset(range(128))
+NEWLINE = ord("\n")
+
+# Characters preferred as pump or breaking character, in this order
+PREFERRED = [ord(c) for c in "a0 _-.\\/:=x9Z,;!\"'`$%&()[]{}<>|~^@#+*?\t"]
+BREAKERS = ["\x00", "!", "\n"]
+
+REPEATS = frozenset(op for op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                                  getattr(sre_constants, "POSSESSIVE_REPEAT", None)) if op is not None)
+
+_CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: r"\d",
+    sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+    sre_constants.CATEGORY_SPACE: r"\s",
+    sre_constants.CATEGORY_NOT_SPACE: r"\S",
+    sre_constants.CATEGORY_WORD: r"\w",
+    sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+CATEGORIES = {category: frozenset(code for code in ALPHABET if re.match(pattern, chr(code)))
+              for category, pattern in _CATEGORY_PATTERNS.items()}
+
+# Sigma '|re' sub-modifiers
+FLAG_MODIFIERS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL}
+
+# 'prefix' leads to the repeat the issue is in, 'unit' is one iteration of it, both may be empty
+Issue = namedtuple("Issue", ["kind", "detail", "characters", "prefix", "unit"])
+Measurement = namedtuple("Measurement", ["length", "seconds"])
+PatternReport = namedtuple("PatternReport", ["pattern", "flags", "error", "issues", "measurements", "growth",
+                                             "estimate"])
+PatternReport.__doc__ = """
+Analysis of one regular expression. 'growth' is 'linear', 'polynomial', 'exponential' or None
+when it was not measured, 'estimate' the estimated seconds of one search over REFERENCE_LENGTH
+characters (None when not measured).
+"""
+
+
+def _render(node) -> str:
+    # Short text of a parsed node for messages
+    op, av = node
+    if op is sre_constants.ANY:
+        return "."
+    if op in REPEATS:
+        low, high, _ = av
+        inner = "(...)" if len(av[2]) > 1 else _render(av[2][0])
+        if (low, high) == (0, sre_constants.MAXREPEAT):
+            return inner + "*"
+        if (low, high) == (1, sre_constants.MAXREPEAT):
+            return inner + "+"
+        return inner + "{{{},{}}}".format(low, "" if high == sre_constants.MAXREPEAT else high)
+    if op is sre_constants.LITERAL:
+        return re.escape(chr(av))
+    if op is sre_constants.IN:
+        return "[...]"
+    if op is sre_constants.SUBPATTERN:
+        return "(...)"
+    return str(op).lower()
+
+
+class _Analyzer:
+    """
+    First-character sets and hot spots of one parsed pattern
+    """
+
+    def __init__(self, parsed, flags: int):
+        self.parsed = parsed
+        self.ignore_case = bool(flags & re.IGNORECASE)
+        self.dot = ALPHABET if flags & re.DOTALL else ALPHABET - {NEWLINE}
+        self.issues = []
+        self.degree = 0
+
+    def _case(self, characters):
+        if not self.ignore_case:
+            return frozenset(characters)
+        return frozenset(characters) | frozenset(ord(chr(code).swapcase()[0]) for code in characters if code < 128)
+
+    def _class(self, items) -> frozenset:
+        negate = False
+        characters = set()
+        for op, av in items:
+            if op is sre_constants.NEGATE:
+                negate = True
+            elif op is sre_constants.LITERAL:
+                characters.add(av)
+            elif op is sre_constants.RANGE:
+                characters.update(range(av[0], min(av[1], 127) + 1))
+            elif op is sre_constants.CATEGORY:
+                characters.update(CATEGORIES.get(av, ALPHABET))
+            else:
+                characters.update(ALPHABET)
+        characters = self._case(characters)
+        return ALPHABET - characters if negate else characters
+
+    def first(self, items) -> tuple:
+        """
+        (characters a match of the sequence can start with, whether it can match the empty string)
+        """
+        first = set()
+        for op, av in items:
+            item_first, nullable = self._first_item(op, av)
+            first |= item_first
+            if not nullable:
+                return frozenset(first), False
+        return frozenset(first), True
+
+    def _first_item(self, op, av) -> tuple:
+        if op is sre_constants.LITERAL:
+            return self._case([av]), False
+        if op is sre_constants.NOT_LITERAL:
+            return ALPHABET - self._case([av]), False
+        if op is sre_constants.ANY:
+            return self.dot, False
+        if op is sre_constants.IN:
+            return self._class(av), False
+        if op is sre_constants.BRANCH:
+            first = set()
+            nullable = False
+            for alternative in av[1]:
+                alternative_first, alternative_nullable = self.first(alternative)
+                first |= alternative_first
+                nullable = nullable or alternative_nullable
+            return frozenset(first), nullable
+        if op is sre_constants.SUBPATTERN:
+            return self.first(av[-1])
+        if op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            return self.first(av)
+        if op in REPEATS:
+            low, _, body = av
+            first, nullable = self.first(body)
+            return first, nullable or low == 0
+        if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            return frozenset(), True
+        # Back references and anything else: assume the worst
+        return ALPHABET, True
+
+    def sample(self, items) -> str:
+        """
+        A short text matched by a sequence, every repeat taken at least once
+        """
+        text = []
+        for op, av in items:
+            if op is sre_constants.LITERAL:
+                text.append(chr(av))
+            elif op is sre_constants.NOT_LITERAL:
+                text.append("b" if chr(av) == "a" else "a")
+            elif op is sre_constants.ANY:
+                text.append("a")
+            elif op is sre_constants.IN:
+                text += _pick(self._class(av), 1)
+            elif op is sre_constants.BRANCH:
+                text.append(self.sample(av[1][0]))
+            elif op is sre_constants.SUBPATTERN:
+                text.append(self.sample(av[-1]))
+            elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+                text.append(self.sample(av))
+            elif op in REPEATS:
+                text.append(self.sample(av[2]) * max(av[0], 1))
+        return "".join(text)
+
+    def _issue(self, kind: str, detail: str, characters, prefix: str = "", unit: str = "") -> None:
+        if not any(issue.kind == kind and issue.detail == detail for issue in self.issues):
+            self.issues.append(Issue(kind, detail, frozenset(characters), prefix, unit))
+
+    def scan(self, items, follow: frozenset, outer=None, before: str = "") -> None:
+        """
+        Walk a sequence knowing the characters that may come after it, the (text before, one iteration)
+        samples of the unbounded repeat it is in and a text that leads to it
+        """
+        items = list(items)
+        for position, (op, av) in enumerate(items):
+            rest_first, rest_nullable = self.first(items[position + 1:])
+            after = rest_first | follow if rest_nullable else rest_first
+            here = before + self.sample(items[:position])
+            if op in REPEATS:
+                low, high, body = av
+                body_first, _ = self.first(body)
+                if high == sre_constants.MAXREPEAT or high > 100:
+                    overlap = body_first & after
+                    if overlap and outer is not None:
+                        self._issue("nested quantifier", _render((op, av)), overlap, *outer)
+                    elif overlap and op is not getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+                        self.degree += 1
+                    iteration = self.sample(body)
+                    self._alternations(body, body_first | after, here)
+                    # The body may be followed by itself
+                    self.scan(body, after | body_first, (here, iteration), here)
+                else:
+                    self.scan(body, after, outer, here)
+            elif op is sre_constants.SUBPATTERN:
+                self.scan(av[-1], after, outer, here)
+            elif op is sre_constants.BRANCH:
+                for alternative in av[1]:
+                    self.scan(alternative, after, outer, here)
+            elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+                self.scan(av, after, None, here)
+
+    def _alternations(self, body, follow: frozenset, before: str) -> None:
+        # Alternatives of a repeated group that can start the same way match the same text in several ways
+        for op, av in body:
+            if op is sre_constants.SUBPATTERN:
+                self._alternations(av[-1], follow, before)
+            elif op is sre_constants.BRANCH:
+                seen = []
+                for alternative in av[1]:
+                    first, nullable = self.first(alternative)
+                    first = first | follow if nullable else first
+                    for other in seen:
+                        if first & other:
+                            self._issue("ambiguous alternation", "(" + "|".join(
+                                "".join(_render(item) for item in alternative) for alternative in av[1]) + ")",
+                                first & other, before, self.sample(alternative))
+                    seen.append(first)
+
+    def analyze(self) -> None:
+        items = list(self.parsed)
+        anchored = bool(items) and items[0][0] is sre_constants.AT and items[0][1] in (
+            sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING)
+        if not anchored:
+            # A search tries the pattern at every position
+            self.degree += 1
+            leading = items[0] if items else None
+            while leading is not None and leading[0] is sre_constants.SUBPATTERN and leading[1][-1]:
+                leading = list(leading[1][-1])[0]
+            if leading is not None and leading[0] in REPEATS and leading[1][1] == sre_constants.MAXREPEAT:
+                body = list(leading[1][2])
+                if len(body) == 1 and body[0][0] is sre_constants.ANY:
+                    self._issue("leading .*", _render(leading), self.dot)
+        self.scan(items, frozenset())
+
+
+def _pick(characters, count: int) -> list:
+    preferred = [code for code in PREFERRED if code in characters]
+    rest = sorted(code for code in characters if code not in preferred and 32 <= code < 127)
+    return [chr(code) for code in (preferred + rest)[:count]]
+
+
+def _literal_prefix(parsed) -> str:
+    prefix = []
+    for op, av in parsed:
+        if op is sre_constants.AT:
+            continue
+        if op is not sre_constants.LITERAL:
+            break
+        prefix.append(chr(av))
+    return "".join(prefix)
+
+
+def _literals(parsed) -> str:
+    found = []
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_constants.LITERAL and chr(av) not in found:
+                found.append(chr(av))
+            elif op is sre_constants.SUBPATTERN:
+                walk(av[-1])
+            elif op is sre_constants.BRANCH:
+                for alternative in av[1]:
+                    walk(alternative)
+            elif op in REPEATS:
+                walk(av[2])
+    walk(parsed)
+    return "".join(found[:8])
+
+
+def adversarial_inputs(parsed, issues, length: int) -> list:
+    """
+    Inputs of about 'length' characters meant to make the pattern backtrack before it fails
+    """
+    prefix = _literal_prefix(parsed)
+    pumps = []
+    for issue in issues:
+        for character in _pick(issue.characters, 2):
+            if character not in pumps:
+                pumps.append(character)
+    pumps = pumps[:4] or ["a"]
+    inputs = []
+    for issue in issues:
+        if issue.unit:
+            # Iterations of the repeat the issue is in, after a text that leads to it
+            for breaker in BREAKERS:
+                inputs.append(issue.prefix + issue.unit * max(length // len(issue.unit), 1) + breaker)
+    for pump in pumps:
+        for breaker in BREAKERS:
+            if breaker != pump:
+                inputs.append(prefix + pump * length + breaker)
+    literals = _literals(parsed)
+    if literals:
+        unit = "".join(literal + pumps[0] for literal in literals[:-1]) or pumps[0]
+        inputs.append(prefix + (unit * (length // len(unit) + 1))[:length] + BREAKERS[0])
+    return inputs
+
+
+def _timed_search(compiled, inputs) -> float:
+    worst = 0.0
+    for text in inputs:
+        best = None
+        # The fastest of a few runs, unless one run is already long enough to measure
+        for _ in range(3):
+            started = time.perf_counter()
+            compiled.search(text)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+            if elapsed > MEASURABLE * 10:
+                break
+        worst = max(worst, best)
+    return worst
+
+
+def measure(compiled, parsed, issues, exponential: bool, budget: float = MEASURE_BUDGET) -> list:
+    """
+    Measurements of the worst adversarial input per length, grown while the next run is predicted to fit the budget
+    """
+    if exponential:
+        lengths = range(8, 129, 2)
+    else:
+        lengths = [64 * 2 ** power for power in range(int(math.log2(REFERENCE_LENGTH // 64)) + 1)]
+    measurements = []
+    spent = 0.0
+    for length in lengths:
+        seconds = _timed_search(compiled, adversarial_inputs(parsed, issues, length))
+        measurements.append(Measurement(length, seconds))
+        spent += seconds
+        if len(measurements) >= 2 and seconds > MEASURABLE:
+            previous = measurements[-2].seconds
+            predicted = seconds * (seconds / previous if previous > MEASURABLE else 2.0)
+        else:
+            predicted = seconds * 4
+        if seconds > budget or spent + predicted > budget:
+            break
+    return measurements
+
+
+def _slope(points: list) -> tuple:
+    # Least squares line through (x, y) points: (slope, y at the mean x, mean x)
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread if spread else 0.0
+    return slope, mean_y, mean_x
+
+
+def estimate(measurements: list) -> tuple:
+    """
+    (growth, estimated seconds over REFERENCE_LENGTH characters) from the measurements, the growth
+    fitted through all measurable times so that one noisy run does not decide it
+    """
+    last = measurements[-1]
+    if last.length >= REFERENCE_LENGTH:
+        return ("polynomial" if last.seconds > MEASURABLE else "linear"), last.seconds
+    usable = [measurement for measurement in measurements if measurement.seconds > MEASURABLE]
+    if len(usable) < 2:
+        # Too fast to tell: assume linear growth
+        return "linear", last.seconds * REFERENCE_LENGTH / last.length
+    slope, mean, middle = _slope([(measurement.length, math.log10(measurement.seconds)) for measurement in usable])
+    per_character = 10 ** max(slope, 0.0)
+    if per_character >= EXPONENTIAL_GROWTH:
+        # Capped: beyond a few days the number means nothing
+        exponent = mean + (REFERENCE_LENGTH - middle) * math.log10(per_character)
+        return "exponential", 10 ** min(exponent, 6)
+    slope, mean, middle = _slope([(math.log10(measurement.length), math.log10(measurement.seconds))
+                                  for measurement in usable])
+    degree = max(slope, 1.0)
+    growth = "polynomial" if degree >= 1.5 else "linear"
+    return growth, 10 ** (mean + (math.log10(REFERENCE_LENGTH) - middle) * degree)
+
+
+@functools.lru_cache(maxsize=None)
+def analyze_pattern(pattern: str, flags: int = 0) -> PatternReport:
+    """
+    Compile a '|re' value and judge its worst-case cost, memoized
+    """
+    try:
+        compiled = re.compile(pattern, flags)
+        parsed = sre_parse.parse(pattern, flags)
+    except (re.error, RecursionError, OverflowError) as error:
+        return PatternReport(pattern, flags, str(error), (), (), None, None)
+    analyzer = _Analyzer(parsed, flags)
+    analyzer.analyze()
+    issues = list(analyzer.issues)
+    if analyzer.degree >= 3:
+        issues.append(Issue("overlapping quantifiers", "{} unbounded repeats".format(analyzer.degree - 1), ALPHABET,
+                            "", ""))
+    if not issues:
+        return PatternReport(pattern, flags, None, (), (), None, None)
+    exponential = any(issue.kind in ("nested quantifier", "ambiguous alternation") for issue in issues)
+    measurements = measure(compiled, parsed, issues, exponential)
+    growth, seconds = estimate(measurements)
+    return PatternReport(pattern, flags, None, tuple(issues), tuple(measurements), growth, seconds)
+
+
+def is_too_slow(report: PatternReport) -> bool:
+    return report.estimate is not None and (report.growth == "exponential" or report.estimate > COST_BUDGET)
+
+
+def regex_values(detection) -> list:
+    """
+    (selection, field, value, flags) of every '|re' value of a detection
+    """
+    found = []
+    if not isinstance(detection, dict):
+        return found
+
+    def visit(selection, fields):
+        for field, values in fields.items():
+            name, *modifiers = str(field).split("|")
+            if "re" not in modifiers:
+                continue
+            flags = 0
+            for modifier in modifiers:
+                flags |= FLAG_MODIFIERS.get(modifier, 0)
+            for value in (values if isinstance(values, list) else [values]):
+                if isinstance(value, str):
+                    found.append((selection, field, value, flags))
+
+    for selection, value in detection.items():
+        if isinstance(value, dict):
+            visit(selection, value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    visit(selection, item)
+    return found
+
+
+def rule_cost(rule) -> tuple:
+    """
+    (estimated seconds of all analyzed '|re' values of a rule over REFERENCE_LENGTH characters, reports)
+    """
+    reports = []
+    for selection, field, value, flags in regex_values(rule.get_part("detection")):
+        reports.append((selection, field, analyze_pattern(value, flags)))
+    return sum(report.estimate or 0.0 for _, _, report in reports), reports
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds >= 86400:
+        return "> 1 day"
+    if seconds >= 1:
+        return "{:.1f} s".format(seconds)
+    return "{:.2f} ms".format(seconds * 1000)
+
+
+def main(argv: list = None) -> int:
+    from .corpus import RuleCorpus
+    from .paths import REPO_ROOT, RULE_DIRECTORIES
+
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.backtracking",
+                                     description="Estimate the worst-case cost of the '|re' values of rules")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="rule files or directories relative to the repository (default: all rule directories)")
+    parser.add_argument("--all", action="store_true", help="list rules without suspicious values too")
+    args = parser.parse_args(argv)
+
+    paths = [os.path.relpath(os.path.abspath(path), REPO_ROOT) for path in args.paths]
+    files = [path for path in paths if path.endswith(".yml")]
+    directories = [path for path in paths if not path.endswith(".yml")] or ([] if paths else RULE_DIRECTORIES)
+    rules = list(RuleCorpus.load(directories)) if directories else []
+    rules += list(RuleCorpus.load(only=files)) if files else []
+    slow = 0
+    rows = []
+    for rule in rules:
+        total, reports = rule_cost(rule)
+        analyzed = [report for _, _, report in reports if report.issues or report.error]
+        if analyzed or (args.all and reports):
+            rows.append((total, rule, reports))
+    for total, rule, reports in sorted(rows, key=lambda row: -row[0]):
+        print("{:>10}  {}".format(format_seconds(total), rule.path))
+        for selection, field, report in reports:
+            if not (report.issues or report.error):
+                continue
+            if report.error:
+                print("            {}: invalid: {}".format(field, report.error))
+                continue
+            slow += is_too_slow(report)
+            print("            {} {:>10} {:<11} {!r}: {}".format(
+                "!" if is_too_slow(report) else " ", format_seconds(report.estimate), report.growth, report.pattern,
+                ", ".join("{} {}".format(issue.kind, issue.detail) for issue in report.issues)))
+    print("{} rule(s) with suspicious '|re' values, {} value(s) over the budget of {} per {} characters".format(
+        len(rows), slow, format_seconds(COST_BUDGET), REFERENCE_LENGTH))
+    return 1 if slow else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
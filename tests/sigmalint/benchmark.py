@@ -0,0 +1,315 @@
+"""
+Benchmarks of the rule lint pipeline
+
+Times the lint modules over the real rule corpus (scale 1) and over synthetic corpora of
+'scale' same-shaped copies of every rule (see sigmalint.synthetic). For every scale it
+records the wall and CPU time of the pipeline stages (YAML parsing, the rule index and each
+lint module), of every test method and of every per-file check. Per-file checks run in one
+traversal per rule, their times are summed over all rules; they need -j 1 (the default),
+with worker processes only the stages and tests are timed.
+
+All caches are bypassed, every run is a cold run. Results are written as JSON, by default
+to .sigma-cache/benchmarks/<commit>.json, and compared against an earlier result with
+--compare. The run fails when a time grew by more than the --threshold fraction.
+
+Run from the tests directory:
+# python -m sigmalint.benchmark --scales 1 10 100
+# python -m sigmalint.benchmark --scales 1 10 --compare origin/master --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import signal
+import sys
+import time
+import unittest
+
+from .cache import CACHE_DIR
+from .changes import _git
+from .corpus import RuleCorpus, yield_rule_file_paths
+from .index import RuleIndex
+from .instrument import Measurement, timed_registry
+from .options import OPTIONS
+from .paths import REPO_ROOT, RULE_DIRECTORIES
+from .synthetic import RuleSynthesizer, synthesize_corpus
+from .testcase import LINT_MODULES, load_lint_module
+
+RESULT_FORMAT = 1
+
+RESULTS_DIR = os.path.join(CACHE_DIR, "benchmarks")
+
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_THRESHOLD = 0.25
+# Times below this many seconds are too noisy to compare
+DEFAULT_MIN_SECONDS = 0.05
+# Per test, 0 disables the limit. Quadratic tests do not finish on large corpora.
+DEFAULT_TIMEOUT = 600
+
+
+class TestTimeout(Exception):
+    pass
+
+
+class TimingResult(unittest.TestResult):
+    """
+    Records the time and outcome of every test, optionally aborting tests after 'timeout' seconds
+    """
+
+    def __init__(self, timeout: float = 0):
+        super().__init__()
+        self.timeout = timeout if hasattr(signal, "setitimer") else 0
+        self.tests = {}
+        self._started = None
+
+    def _abort(self, signum, frame):
+        raise TestTimeout()
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = (time.perf_counter(), time.process_time())
+        self.tests[test.id()] = {"status": "ok"}
+        if self.timeout:
+            signal.signal(signal.SIGALRM, self._abort)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+
+    def stopTest(self, test):
+        if self.timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        wall, cpu = self._started
+        self.tests[test.id()].update(wall=round(time.perf_counter() - wall, 6), cpu=round(time.process_time() - cpu, 6))
+        super().stopTest(test)
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self.tests[test.id()]["status"] = "fail"
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        if test.id() in self.tests:
+            timed_out = issubclass(err[0], TestTimeout)
+            self.tests[test.id()]["status"] = "timeout" if timed_out else "error"
+            if not timed_out:
+                self.tests[test.id()]["error"] = "{}: {}".format(err[0].__name__, err[1])
+
+
+def benchmark_case(case, corpus, records: dict):
+    """
+    Subclass of a CorpusTestCase that checks 'corpus' with timed per-file checks
+    """
+    prefix = "{}.".format(case.__module__)
+
+    class BenchmarkCase(case):
+        lint_corpus = corpus
+
+        def registered_checks(self):
+            return timed_registry(super().registered_checks(), records, prefix)
+
+    BenchmarkCase.__name__ = BenchmarkCase.__qualname__ = case.__name__
+    BenchmarkCase.__module__ = case.__module__
+    return BenchmarkCase
+
+
+def run_lint_module(module, corpus, records: dict, timeout: float) -> dict:
+    cases = {}
+    for test in unittest.TestLoader().loadTestsFromModule(module):
+        for single in test:
+            cases.setdefault(type(single), []).append(single._testMethodName)
+    suite = unittest.TestSuite()
+    for case, methods in cases.items():
+        timed_case = benchmark_case(case, corpus, records)
+        suite.addTests(timed_case(method) for method in methods)
+    result = TimingResult(timeout)
+    timer = Measurement()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), timer.measure():
+        suite.run(result)
+    return {"timer": timer, "tests": result.tests}
+
+
+def benchmark_scale(source, scale: int, modules: list, jobs: int, timeout: float) -> dict:
+    """
+    Time the pipeline on the real corpus (scale 1) or 'scale' synthetic copies of it
+    """
+    if scale == 1:
+        files = []
+        for path, abspath in yield_rule_file_paths(RULE_DIRECTORIES, REPO_ROOT):
+            with open(abspath, encoding="utf-8") as f:
+                files.append((path, f.read()))
+    else:
+        files = synthesize_corpus(source, scale, RuleSynthesizer(), jobs)
+
+    stages = {}
+    checks = {}
+    tests = {}
+    pipeline = Measurement()
+    with pipeline.measure():
+        stages["parse"] = Measurement()
+        with stages["parse"].measure():
+            corpus = RuleCorpus.from_texts(files, REPO_ROOT, jobs)
+        del files
+        stages["index"] = Measurement()
+        with stages["index"].measure():
+            RuleIndex.from_corpus(corpus)
+        for module in modules:
+            run = run_lint_module(module, corpus, checks, timeout)
+            stages[module.__name__] = run["timer"]
+            tests.update(run["tests"])
+    return {
+        "rules": len(corpus),
+        "pipeline": pipeline.to_json(),
+        "stages": {name: timer.to_json() for name, timer in stages.items()},
+        "tests": tests,
+        "checks": {name: timer.to_json() for name, timer in sorted(checks.items())},
+    }
+
+
+def current_commit() -> str:
+    try:
+        return _git(["rev-parse", "HEAD"], REPO_ROOT)[0]
+    except Exception:
+        return None
+
+
+def run_benchmarks(scales, jobs: int = 1, timeout: float = DEFAULT_TIMEOUT) -> dict:
+    # Cold runs only, and no benchmark data in the caches of the lint suite
+    os.environ["SIGMA_LINT_NO_CACHE"] = "1"
+    OPTIONS.jobs = jobs
+    OPTIONS.changed_since = None
+    modules = [load_lint_module(name) for name in LINT_MODULES]
+    source = None
+    results = {}
+    for scale in scales:
+        if scale != 1 and source is None:
+            source = RuleCorpus.load(RULE_DIRECTORIES, REPO_ROOT, jobs=jobs)
+        print("Benchmarking scale {}...".format(scale), flush=True)
+        results[str(scale)] = benchmark_scale(source, scale, modules, jobs, timeout)
+        print("  {} rules in {:.2f}s".format(results[str(scale)]["rules"], results[str(scale)]["pipeline"]["wall"]),
+              flush=True)
+    return {
+        "format": RESULT_FORMAT,
+        "commit": current_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "jobs": jobs,
+        "timeout": timeout,
+        "scales": results,
+    }
+
+
+def flatten(results: dict) -> dict:
+    """
+    'scale/kind/name' -> wall time (None for a timed out test) of a benchmark result
+    """
+    times = {}
+    for scale, result in results["scales"].items():
+        times["{}/pipeline".format(scale)] = result["pipeline"]["wall"]
+        for kind in ("stages", "checks", "tests"):
+            for name, measured in result[kind].items():
+                timed_out = measured.get("status") == "timeout"
+                times["{}/{}/{}".format(scale, kind, name)] = None if timed_out else measured["wall"]
+    return times
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD,
+            min_seconds: float = DEFAULT_MIN_SECONDS) -> list:
+    """
+    (name, baseline seconds, current seconds) of every time that grew by more than 'threshold'
+    and at least 'min_seconds'. A test that newly timed out is reported with None.
+    """
+    before = flatten(baseline)
+    after = flatten(current)
+    regressions = []
+    for name, seconds in after.items():
+        if name not in before:
+            continue
+        previous = before[name]
+        if seconds is None:
+            if previous is not None:
+                regressions.append((name, previous, None))
+        elif previous is not None and seconds - previous >= min_seconds and seconds > previous * (1 + threshold):
+            regressions.append((name, previous, seconds))
+    return regressions
+
+
+def result_path(revision: str) -> str:
+    """
+    Path of a result file, or of the stored result of a git revision
+    """
+    if os.path.exists(revision):
+        return revision
+    return os.path.join(RESULTS_DIR, "{}.json".format(_git(["rev-parse", revision], REPO_ROOT)[0]))
+
+
+def write_results(results: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def print_summary(results: dict, top: int = 10) -> None:
+    for scale, result in results["scales"].items():
+        print("Scale {}: {} rules, pipeline {:.2f}s wall / {:.2f}s CPU".format(
+            scale, result["rules"], result["pipeline"]["wall"], result["pipeline"]["cpu"]))
+        for name, measured in result["stages"].items():
+            print("    {:<64} {:>9.3f}s".format(name, measured["wall"]))
+        slowest = sorted(result["tests"].items(), key=lambda item: -item[1]["wall"])[:top]
+        for name, measured in slowest:
+            status = "" if measured["status"] == "ok" else " ({})".format(measured["status"])
+            print("    {:<64} {:>9.3f}s{}".format(name, measured["wall"], status))
+        slowest = sorted(result["checks"].items(), key=lambda item: -item[1]["wall"])[:top]
+        for name, measured in slowest:
+            print("    {:<64} {:>9.3f}s".format(name, measured["wall"]))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.benchmark",
+                                     description="Time the rule lint pipeline on the real and synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES), metavar="N",
+                        help="corpus sizes as multiples of the rule count, 1 is the real corpus (default: 1 10 100)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="parse and check in N worker processes, per-file checks are only timed with 1")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, metavar="SECONDS",
+                        help="abort single tests after SECONDS, 0: no limit (default: {})".format(DEFAULT_TIMEOUT))
+    parser.add_argument("-o", "--output", metavar="PATH",
+                        help="result file (default: {})".format(os.path.join(RESULTS_DIR, "<commit>.json")))
+    parser.add_argument("--compare", metavar="PATH|REV", help="earlier result file or git revision to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown as a fraction (default: {})".format(DEFAULT_THRESHOLD))
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                        help="ignore slowdowns below this many seconds (default: {})".format(DEFAULT_MIN_SECONDS))
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(result_path(args.compare), encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(args.scales, args.jobs, args.timeout)
+    output = args.output or os.path.join(RESULTS_DIR, "{}.json".format(results["commit"] or "worktree"))
+    write_results(results, output)
+    print_summary(results)
+    print("Results written to {}".format(output))
+
+    if baseline is None:
+        return 0
+    regressions = compare(baseline, results, args.threshold, args.min_seconds)
+    for name, before, after in regressions:
+        if after is None:
+            print("REGRESSION {}: {:.3f}s before, timed out now".format(name, before))
+        else:
+            print("REGRESSION {}: {:.3f}s -> {:.3f}s (+{:.0%})".format(name, before, after, after / before - 1))
+    if regressions:
+        print("{} time(s) exceed the threshold of +{:.0%} against {}".format(
+            len(regressions), args.threshold, baseline.get("commit")))
+        return 1
+    print("No regressions against {} (threshold +{:.0%})".format(baseline.get("commit"), args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Content-addressed on-disk cache for the lint suites
+
+Two stores live under .sigma-cache/ in the repository root:
+
+* parsed documents, keyed by the SHA-256 of the rule text and the parser version
+* per-file findings of each check, keyed by check name, rule path and content hash,
+  inside a file that is only valid for one checker version
+
+The checker version is a digest over the check modules, the sigmalint package,
+logsource.json and thor.yml, so editing any of them invalidates all findings.
+Set SIGMA_LINT_NO_CACHE=1 to bypass the cache, or SIGMA_LINT_CACHE_DIR to move it.
+"""
+
+import collections
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+import yaml
+
+from .paths import REPO_ROOT, TESTS_DIR
+from .querycost import QUERY_COST_PATH
+
+CACHE_FORMAT = 1
+
+CACHE_DIR = os.environ.get("SIGMA_LINT_CACHE_DIR", os.path.join(REPO_ROOT, ".sigma-cache"))
+
+PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Data files read by the checks, any change must invalidate the stored findings
+CHECKER_DATA_FILES = [
+    os.path.join(TESTS_DIR, "logsource.json"),
+    os.path.join(TESTS_DIR, "filename-conventions.yml"),
+    os.path.join(TESTS_DIR, "thor.yml"),
+    os.path.join(REPO_ROOT, "sigma-schema.rx.yml"),
+    QUERY_COST_PATH,
+]
+
+Finding = collections.namedtuple("Finding", ["entry", "message"])
+Finding.__doc__ = """
+One result of a per-file check. 'entry' is what the test collects in its faulty list
+(usually the rule path), 'message' the colored line printed for it (or None).
+"""
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("SIGMA_LINT_NO_CACHE", "") in ("", "0")
+
+
+def content_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def files_digest(paths: list, seed: str = "") -> str:
+    digest = hashlib.sha256(seed.encode("utf-8"))
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except FileNotFoundError:
+            digest.update(b"\0missing")
+    return digest.hexdigest()
+
+
+def parser_version() -> str:
+    return files_digest([os.path.join(PACKAGE_DIR, "corpus.py")],
+                        "format={} pyyaml={}".format(CACHE_FORMAT, yaml.__version__))
+
+
+def checker_version(sources: list) -> str:
+    package_sources = sorted(glob.glob(os.path.join(PACKAGE_DIR, "*.py")))
+    return files_digest(list(sources) + package_sources + CHECKER_DATA_FILES, "format={}".format(CACHE_FORMAT))
+
+
+def _read_pickle(path: str):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError):
+        # TypeError: a namedtuple stored by an older layout
+        return None
+
+
+def _write_pickle(path: str, data) -> None:
+    # Write to a temporary file first so that concurrent or interrupted runs never leave a torn cache
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DocumentCache:
+    """
+    SHA-256 of rule text -> list of parsed YAML documents
+    """
+
+    def __init__(self, directory: str = CACHE_DIR):
+        self.path = os.path.join(directory, "documents.pickle")
+        self.version = parser_version()
+        stored = _read_pickle(self.path) if cache_enabled() else None
+        if stored and stored.get("version") == self.version:
+            self._entries = stored["entries"]
+        else:
+            self._entries = {}
+        self._used = set()
+        self._dirty = False
+
+    def get(self, digest: str):
+        documents = self._entries.get(digest)
+        if documents is not None:
+            self._used.add(digest)
+        return documents
+
+    def put(self, digest: str, documents: list) -> None:
+        self._entries[digest] = documents
+        self._used.add(digest)
+        self._dirty = True
+
+    def save(self) -> None:
+        # Drop entries of rules that no longer exist with this content
+        if not cache_enabled():
+            return
+        if not self._dirty and len(self._used) == len(self._entries):
+            return
+        self._entries = {digest: self._entries[digest] for digest in self._used}
+        _write_pickle(self.path, {"version": self.version, "entries": self._entries})
+        self._dirty = False
+
+
+class FindingsCache:
+    """
+    (check name, rule path, content hash, context) -> list of Finding for one check module.
+    Without a directory the findings are only kept in memory.
+    """
+
+    _shared = {}
+
+    def __init__(self, name: str, sources: list, directory: str = CACHE_DIR):
+        self.path = os.path.join(directory, "findings-{}.pickle".format(name)) if directory else None
+        self.version = checker_version(sources)
+        stored = _read_pickle(self.path) if cache_enabled() and self.path else None
+        if stored and stored.get("version") == self.version:
+            self._entries = stored["entries"]
+        else:
+            self._entries = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def shared(cls, name: str, sources: list):
+        if name not in cls._shared:
+            cls._shared[name] = cls(name, sources)
+        return cls._shared[name]
+
+    def findings(self, check, rule, context: str = "") -> list:
+        """
+        Return the findings of check(rule.path, rule), computing them only on a cache miss.
+        'context' must change whenever the check depends on data not covered by the checker version.
+        """
+        key = (check.__name__, rule.path, rule.digest, context)
+        found = self._entries.get(key)
+        if found is not None:
+            self.hits += 1
+            return found
+        self.misses += 1
+        found = [Finding(*finding) for finding in check(rule.path, rule)]
+        self._entries[key] = found
+        self._dirty = True
+        return found
+
+    def engine_findings(self, engine, rule) -> dict:
+        """
+        Return check name -> findings for every check of a CheckEngine. The checks missing
+        from the cache are computed together in a single traversal of the rule.
+        """
+        result, missing = self.cached_engine_findings(engine.registry, rule)
+        if missing:
+            found = engine.run(rule.path, rule, missing)
+            self.store_engine_findings(engine.registry, rule, found)
+            result.update(found)
+        return result
+
+    def cached_engine_findings(self, registry, rule) -> tuple:
+        """
+        Return (check name -> cached findings, names of the checks missing from the cache)
+        """
+        result = {}
+        missing = []
+        for name in registry.names():
+            found = self._entries.get((name, rule.path, rule.digest, registry.context(name))) \
+                if registry.cached(name) else None
+            if found is None:
+                missing.append(name)
+            else:
+                result[name] = found
+        self.hits += len(result)
+        self.misses += len(missing)
+        return result, missing
+
+    def store_engine_findings(self, registry, rule, found: dict) -> None:
+        # Checks registered with cached=False are run again every time
+        stored = {name: findings for name, findings in found.items() if registry.cached(name)}
+        for name, findings in stored.items():
+            self._entries[(name, rule.path, rule.digest, registry.context(name))] = findings
+        if stored:
+            self._dirty = True
+
+    def save(self, rules) -> None:
+        """
+        Persist the findings. 'rules' are all current rules (anything with path and digest),
+        entries of edited or removed rules are dropped while other checks of unchanged rules are kept.
+        """
+        if not cache_enabled() or not self._dirty or self.path is None:
+            return
+        live = {(rule.path, rule.digest) for rule in rules}
+        self._entries = {key: found for key, found in self._entries.items() if (key[1], key[2]) in live}
+        _write_pickle(self.path, {"version": self.version, "entries": self._entries})
+        self._dirty = False
@@ -0,0 +1,48 @@
+"""
+Find the rule files a branch touches, for the --changed-since lint mode
+
+Only the changed rules are checked, unless the branch also touches what the checks are made of:
+the lint modules and their data below tests/, the rule schema or the workflows. Such a change
+can fail rules nobody edited, so all rules are checked then.
+"""
+
+import subprocess
+
+from .corpus import yield_rule_file_paths
+from .paths import REPO_ROOT
+
+# Paths of the checks, their data and the CI running them, relative to the repository
+LINT_INPUTS = ["tests", "sigma-schema.rx.yml", ".github"]
+
+
+def _git(args: list, root: str) -> list:
+    result = subprocess.run(["git", "-C", root] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("git {} failed: {}".format(" ".join(args), result.stderr.strip()))
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def changed_rule_paths(rev: str, directories: list, root: str = REPO_ROOT) -> list:
+    """
+    Return the rule files added or modified since 'rev' (committed, staged, unstaged or untracked),
+    as repository relative paths in the same order the full corpus would visit them.
+    """
+    changed = set()
+    for line in _git(["diff", "--name-status", "--no-renames", rev, "--"] + directories, root):
+        status, path = line.split("\t", 1)
+        if status[0] in "AM":
+            changed.add(path)
+    changed.update(_git(["ls-files", "--others", "--exclude-standard", "--"] + directories, root))
+    return [path for path, _ in yield_rule_file_paths(directories, root)
+            if path.replace("\\", "/") in changed]
+
+
+def changed_lint_inputs(rev: str, root: str = REPO_ROOT) -> list:
+    """
+    Return the files of the checks (see LINT_INPUTS) changed since 'rev' in any way, untracked
+    ones included, as sorted repository relative paths.
+    """
+    changed = {line.split("\t", 1)[1] for line in _git(["diff", "--name-status", "--no-renames", rev, "--"] + LINT_INPUTS, root)}
+    changed.update(_git(["ls-files", "--others", "--exclude-standard", "--"] + LINT_INPUTS, root))
+    return sorted(changed)
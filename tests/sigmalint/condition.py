@@ -0,0 +1,252 @@
+"""
+Tokenizer and parser of Sigma detection conditions
+
+A condition is parsed into an immutable AST:
+
+    Identifier(name)                      search identifier
+    Quantified(quantifier, pattern)       '1 of' / 'all of' a pattern with wildcards, or 'them'
+    Not(operand), And(operands), Or(operands)
+    Aggregation(function, field, group_by, operator, value, expression)
+                                          what follows a '|', e.g. 'count(dst) by src > 10', 'near a and b'
+    Condition(text, tokens, expression, aggregation)
+                                          one condition string, aggregation is None without pipe
+
+'not' binds tighter than 'and', 'and' tighter than 'or'. Keywords are recognized in any letter
+case, the tokens keep the text as written. A condition that does not parse raises
+ConditionSyntaxError.
+
+Parses are shared: parse_condition() is memoized by text and Rule.conditions parses the
+detection of a rule once for every check.
+"""
+
+import fnmatch
+import functools
+import re
+from collections import namedtuple
+
+Token = namedtuple("Token", ["kind", "text", "position"])
+
+Identifier = namedtuple("Identifier", ["name"])
+Quantified = namedtuple("Quantified", ["quantifier", "pattern"])
+Not = namedtuple("Not", ["operand"])
+And = namedtuple("And", ["operands"])
+Or = namedtuple("Or", ["operands"])
+Aggregation = namedtuple("Aggregation", ["function", "field", "group_by", "operator", "value", "expression"])
+Condition = namedtuple("Condition", ["text", "tokens", "expression", "aggregation"])
+
+KEYWORDS = ("and", "or", "not", "quantifier")
+
+# Matches anything: 'them' is every search identifier
+THEM = "them"
+
+_TOKENS = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<pipe>\|)
+  | (?P<quantifier>(?:1|all)\s+of)(?![\w*-])
+  | (?P<and>and)(?![\w*-])
+  | (?P<or>or)(?![\w*-])
+  | (?P<not>not)(?![\w*-])
+  | (?P<identifier>[\w*-]+)
+""", re.IGNORECASE | re.VERBOSE)
+
+_AGGREGATION = re.compile(r"""
+    \s*(?P<function>count|min|max|avg|sum)\s*\(\s*(?P<field>[\w.]*)\s*\)
+    (?:\s+by\s+(?P<group_by>[\w.]+))?
+    \s*(?P<operator><=|>=|==|=|<|>)\s*(?P<value>\d+)\s*$
+""", re.IGNORECASE | re.VERBOSE)
+
+_NEAR = re.compile(r"\s*near\s+", re.IGNORECASE)
+
+
+class ConditionSyntaxError(ValueError):
+    """
+    A condition that is not valid Sigma, 'position' is the offset of the offending text
+    """
+
+    def __init__(self, message: str, text: str, position: int):
+        super().__init__("{} at position {} of '{}'".format(message, position, text))
+        self.text = text
+        self.position = position
+
+
+def tokenize(text: str) -> tuple:
+    """
+    Tokens of a condition up to a pipe, the aggregation text after the pipe is one 'pipe' token
+    """
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKENS.match(text, position)
+        if match is None:
+            raise ConditionSyntaxError("Unexpected character {!r}".format(text[position]), text, position)
+        kind = match.lastgroup
+        if kind == "pipe":
+            tokens.append(Token(kind, text[position + 1:], position + 1))
+            break
+        if kind != "space":
+            tokens.append(Token(kind, match.group(), position))
+        position = match.end()
+    return tuple(tokens)
+
+
+class _Parser:
+    """
+    Recursive descent over the tokens of one search expression
+    """
+
+    def __init__(self, text: str, tokens: list):
+        self.text = text
+        self.tokens = tokens
+        self.index = 0
+
+    def _peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def _fail(self, message: str):
+        token = self._peek()
+        raise ConditionSyntaxError(message, self.text, token.position if token else len(self.text))
+
+    def _take(self, kind: str):
+        token = self._peek()
+        if token is None or token.kind != kind:
+            return None
+        self.index += 1
+        return token
+
+    def parse(self):
+        node = self._or()
+        if self._peek() is not None:
+            self._fail("Unexpected '{}'".format(self._peek().text))
+        return node
+
+    def _or(self):
+        operands = [self._and()]
+        while self._take("or"):
+            operands.append(self._and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def _and(self):
+        operands = [self._not()]
+        while self._take("and"):
+            operands.append(self._not())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def _not(self):
+        if self._take("not"):
+            return Not(self._not())
+        return self._primary()
+
+    def _primary(self):
+        if self._take("lparen"):
+            node = self._or()
+            if not self._take("rparen"):
+                self._fail("Missing ')'")
+            return node
+        quantifier = self._take("quantifier")
+        if quantifier:
+            pattern = self._take("identifier")
+            if pattern is None:
+                self._fail("Expected a search identifier pattern after '{}'".format(quantifier.text))
+            amount = quantifier.text.split()[0].lower()
+            return Quantified("all" if amount == "all" else "1", pattern.text)
+        identifier = self._take("identifier")
+        if identifier:
+            if identifier.text.lower() == THEM or "*" in identifier.text:
+                raise ConditionSyntaxError("'{}' needs '1 of' or 'all of'".format(identifier.text),
+                                           self.text, identifier.position)
+            return Identifier(identifier.text)
+        self._fail("Expected a search identifier" if self._peek() else "Unexpected end of condition")
+
+
+def _parse_aggregation(text: str, offset: int):
+    near = _NEAR.match(text)
+    if near:
+        tokens = list(tokenize(text[near.end():]))
+        expression = _Parser(text, [token._replace(position=token.position + near.end()) for token in tokens]).parse()
+        return Aggregation("near", None, None, None, None, expression)
+    match = _AGGREGATION.match(text)
+    if match is None:
+        raise ConditionSyntaxError("Invalid aggregation", text, offset)
+    return Aggregation(match.group("function").lower(), match.group("field") or None, match.group("group_by"),
+                       match.group("operator"), int(match.group("value")), None)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_condition(text: str) -> Condition:
+    """
+    AST of one condition string
+    """
+    tokens = tokenize(text)
+    aggregation = None
+    search = list(tokens)
+    if search and search[-1].kind == "pipe":
+        pipe = search.pop()
+        aggregation = _parse_aggregation(pipe.text, pipe.position)
+    if not search:
+        raise ConditionSyntaxError("Empty condition", text, 0)
+    return Condition(text, tokens, _Parser(text, search).parse(), aggregation)
+
+
+def parse_detection_conditions(detection) -> tuple:
+    """
+    Conditions of a detection section: 'condition' is a string or a list of strings
+    """
+    if not isinstance(detection, dict) or "condition" not in detection:
+        return ()
+    condition = detection["condition"]
+    conditions = condition if isinstance(condition, list) else [condition]
+    parsed = []
+    for text in conditions:
+        if not isinstance(text, str):
+            raise ConditionSyntaxError("Condition is not a string", str(text), 0)
+        parsed.append(parse_condition(text))
+    return tuple(parsed)
+
+
+def walk(node):
+    """
+    Yield a node and all nodes below it, a Condition includes its aggregation expression
+    """
+    yield node
+    if isinstance(node, Condition):
+        yield from walk(node.expression)
+        if node.aggregation is not None and node.aggregation.expression is not None:
+            yield from walk(node.aggregation.expression)
+    elif isinstance(node, Not):
+        yield from walk(node.operand)
+    elif isinstance(node, (And, Or)):
+        for operand in node.operands:
+            yield from walk(operand)
+
+
+def quantified(conditions, quantifier: str = None, pattern: str = None) -> list:
+    """
+    Quantified nodes of some conditions, optionally only those with the given quantifier or pattern
+    """
+    return [node for condition in conditions for node in walk(condition)
+            if isinstance(node, Quantified)
+            and (quantifier is None or node.quantifier == quantifier)
+            and (pattern is None or node.pattern.lower() == pattern)]
+
+
+def pattern_matches(pattern: str, name: str) -> bool:
+    if pattern.lower() == THEM:
+        return True
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+def referenced_names(conditions, names) -> set:
+    """
+    The search identifiers among 'names' that some condition refers to, by name or pattern
+    """
+    names = list(names)
+    referenced = set()
+    for condition in conditions:
+        for node in walk(condition):
+            if isinstance(node, Identifier):
+                referenced.add(node.name)
+            elif isinstance(node, Quantified):
+                referenced.update(name for name in names if pattern_matches(node.pattern, name))
+    return referenced.intersection(names)
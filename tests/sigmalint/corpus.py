@@ -0,0 +1,181 @@
+"""
+Parse-once view of all Sigma rule files in the repository
+
+Every lint test used to walk the rule directories and re-run yaml.safe_load_all
+for each rule part it needed. A RuleCorpus reads and parses each file exactly once
+and hands the pre-parsed documents, the raw text and the path metadata to all tests.
+"""
+
+import os
+import yaml
+
+from .cache import DocumentCache, content_digest
+from .condition import ConditionSyntaxError, parse_detection_conditions
+from .paths import REPO_ROOT, RULE_DIRECTORIES
+from .pool import map_sharded
+
+
+class Rule:
+    """
+    One rule file: path metadata, raw text and the parsed YAML documents
+    """
+
+    __slots__ = ("path", "abspath", "filename", "directory", "text", "digest", "yaml", "_conditions")
+
+    def __init__(self, path: str, abspath: str, text: str, documents: list, digest: str = None):
+        self.path = path
+        self.abspath = abspath
+        self.filename = os.path.basename(path)
+        self.directory = path.split(os.sep, 1)[0]
+        self.text = text
+        self.digest = digest or content_digest(text)
+        self.yaml = documents
+        self._conditions = None
+
+    def __repr__(self):
+        return "Rule({!r})".format(self.path)
+
+    @property
+    def lines(self) -> list:
+        return self.text.splitlines(keepends=True)
+
+    @property
+    def is_multipart(self) -> bool:
+        return len(self.yaml) != 1
+
+    @property
+    def conditions(self) -> tuple:
+        """
+        Parsed conditions of the detection (see sigmalint.condition), parsed once and shared by all checks.
+        Raises ConditionSyntaxError for a condition that does not parse.
+        """
+        if self._conditions is None:
+            try:
+                self._conditions = parse_detection_conditions(self.get_part("detection"))
+            except ConditionSyntaxError as error:
+                self._conditions = error
+        if isinstance(self._conditions, ConditionSyntaxError):
+            raise self._conditions
+        return self._conditions
+
+    def get_part(self, part_name: str):
+        # Same semantics as the former get_rule_part(): first document holding the key wins
+        for yaml_part in self.yaml:
+            if part_name in yaml_part.keys():
+                return yaml_part[part_name]
+
+        return None
+
+
+def parse_rule_text(text: str) -> list:
+    return list(yaml.safe_load_all(text))
+
+
+def yield_rule_file_paths(directories: list, root: str = REPO_ROOT):
+    """
+    Walk the rule directories in os.walk order and yield (relative, absolute) paths
+    """
+    for path_ in directories:
+        for dirpath, _, files in os.walk(os.path.join(root, path_)):
+            for file in files:
+                if file.endswith('.yml'):
+                    abspath = os.path.join(dirpath, file)
+                    yield os.path.relpath(abspath, root), abspath
+
+
+class RuleCorpus:
+    """
+    Ordered mapping of relative rule path -> Rule, parsed once per session
+    """
+
+    _shared = {}
+
+    def __init__(self, rules: list, root: str = REPO_ROOT, parse_count: int = None):
+        self.root = root
+        self._rules = {rule.path: rule for rule in rules}
+        self.parse_count = len(self._rules) if parse_count is None else parse_count
+
+    @classmethod
+    def load(cls, directories: list = None, root: str = REPO_ROOT, documents: DocumentCache = None, only: list = None,
+             jobs: int = 1):
+        """
+        Read all rule files, or only the relative paths in 'only'.
+        With a DocumentCache only files whose content changed are parsed again,
+        by 'jobs' worker processes (see sigmalint.pool).
+        """
+        if only is not None:
+            file_paths = [(path, os.path.join(root, path)) for path in only]
+        else:
+            file_paths = yield_rule_file_paths(directories or RULE_DIRECTORIES, root)
+        files = []
+        unparsed = []
+        for path, abspath in file_paths:
+            with open(abspath, encoding='utf-8') as f:
+                text = f.read()
+            digest = content_digest(text)
+            parsed = documents.get(digest) if documents is not None else None
+            if parsed is None:
+                unparsed.append(len(files))
+            files.append((path, abspath, text, digest, parsed))
+        parsed_texts = map_sharded(parse_rule_text, [files[index][2] for index in unparsed], jobs)
+        for index, parsed in zip(unparsed, parsed_texts):
+            files[index] = files[index][:4] + (parsed,)
+            if documents is not None:
+                documents.put(files[index][3], parsed)
+        rules = [Rule(path, abspath, text, parsed, digest) for path, abspath, text, digest, parsed in files]
+        return cls(rules, root, len(unparsed))
+
+    @classmethod
+    def from_texts(cls, files, root: str = REPO_ROOT, jobs: int = 1):
+        """
+        Parse in-memory (relative path, text) pairs, e.g. a generated corpus, without touching the disk
+        """
+        files = list(files)
+        parsed_texts = map_sharded(parse_rule_text, [text for _, text in files], jobs)
+        rules = [Rule(path, os.path.join(root, path), text, parsed) for (path, text), parsed in zip(files, parsed_texts)]
+        return cls(rules, root)
+
+    @classmethod
+    def shared(cls, directories: list = None, root: str = REPO_ROOT, only: list = None, jobs: int = 1):
+        """
+        Return the session-wide corpus, loading it on first use.
+        Both lint modules call this from setUpClass so one run costs a single parse of the repo,
+        and unchanged files are served from the on-disk document cache.
+        """
+        key = (tuple(directories or RULE_DIRECTORIES), root, tuple(only) if only is not None else None)
+        if key not in cls._shared:
+            if only is not None:
+                # A handful of changed rules, loading the whole document cache would cost more than parsing
+                cls._shared[key] = cls.load(directories, root, None, only, jobs)
+            else:
+                documents = DocumentCache()
+                cls._shared[key] = cls.load(directories, root, documents, jobs=jobs)
+                documents.save()
+        return cls._shared[key]
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __iter__(self):
+        return iter(self._rules.values())
+
+    def __contains__(self, path):
+        return path in self._rules
+
+    def __getitem__(self, path: str) -> Rule:
+        return self._rules[path]
+
+    def items(self):
+        return self._rules.items()
+
+    def put(self, rule: Rule) -> None:
+        """
+        Add or replace a rule, e.g. after its file was saved
+        """
+        self._rules[rule.path] = rule
+
+    def discard(self, path: str) -> None:
+        self._rules.pop(path, None)
+
+    def paths(self):
+        return self._rules.keys()
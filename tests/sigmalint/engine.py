@@ -0,0 +1,215 @@
+"""
+Single-pass check engine: one traversal of a rule feeds every registered check
+
+Checks are the check_<name> methods of a CorpusTestCase. Undecorated methods are called once
+per rule as check_<name>(file, rule), the decorators below subscribe a method to a finer event
+of the traversal instead:
+
+    @on_metadata("tags")   check_<name>(file, value)                      top level key of the rule
+    @on_selection()        check_<name>(file, name, value)                every key of 'detection'
+    @on_field()            check_<name>(file, selection, field, value)    field of a selection map
+    @on_value()            check_<name>(file, selection, field, value)    every single value, field is None for keywords
+
+Handlers yield or return Finding records, they are stored as they are. Passing
+check="check_<other>" files the findings of a handler under another check, so one check can
+listen to several events. Checks whose verdict is not a function of the rule text, e.g. that
+time the rule, pass cached=False: their findings are computed on every run and never stored.
+"""
+
+from collections import namedtuple
+
+EVENTS = ("rule", "metadata", "selection", "field", "value")
+
+# Detection keys that are not search identifiers
+DETECTION_KEYWORDS = ("condition", "timeframe")
+
+RegisteredCheck = namedtuple("RegisteredCheck", ["name", "event", "key", "handler", "context", "cached"])
+
+
+def _subscribe(event: str, key: str = None, context: str = None, check: str = None, cached: bool = True):
+    def decorate(handler):
+        handler.check_event = event
+        handler.check_key = key
+        handler.check_context = context
+        handler.check_name = check
+        handler.check_cached = cached
+        return handler
+    return decorate
+
+
+def on_rule(context: str = None, check: str = None, cached: bool = True):
+    """
+    Mark a whole-rule check. Only needed to declare a context: the name of a test case attribute
+    the findings depend on, it becomes part of their cache key, or to keep the findings out of
+    the cache.
+    """
+    return _subscribe("rule", context=context, check=check, cached=cached)
+
+
+def on_metadata(key: str, context: str = None, check: str = None, cached: bool = True):
+    """
+    Call the check with the value of the top level key 'key', if the rule has it
+    """
+    return _subscribe("metadata", key=key, context=context, check=check, cached=cached)
+
+
+def on_selection(context: str = None, check: str = None, cached: bool = True):
+    return _subscribe("selection", context=context, check=check, cached=cached)
+
+
+def on_field(context: str = None, check: str = None, cached: bool = True):
+    return _subscribe("field", context=context, check=check, cached=cached)
+
+
+def on_value(context: str = None, check: str = None, cached: bool = True):
+    return _subscribe("value", context=context, check=check, cached=cached)
+
+
+class CheckRegistry:
+    """
+    Check name -> handlers subscribed to the traversal events
+    """
+
+    def __init__(self):
+        self._checks = {}
+
+    def register(self, name: str, handler, event: str = "rule", key: str = None, context: str = "",
+                 cached: bool = True) -> None:
+        if event not in EVENTS:
+            raise ValueError("Unknown check event '{}', expected one of {}".format(event, ", ".join(EVENTS)))
+        if event == "metadata" and key is None:
+            raise ValueError("Check {} listens to metadata events but has no key".format(name))
+        handlers = self._checks.setdefault(name, [])
+        if handlers and handlers[0].context != context:
+            raise ValueError("Handlers of check {} declare different contexts".format(name))
+        if handlers and handlers[0].cached != cached:
+            raise ValueError("Handlers of check {} disagree on caching".format(name))
+        handlers.append(RegisteredCheck(name, event, key, handler, context, cached))
+
+    @classmethod
+    def from_object(cls, target, prefix: str = "check_"):
+        """
+        Register the check methods of 'target', bound to it. Context attribute names are resolved now.
+        """
+        registry = cls()
+        for attribute in dir(type(target)):
+            if not attribute.startswith(prefix):
+                continue
+            handler = getattr(target, attribute)
+            if not callable(handler):
+                continue
+            context = getattr(handler, "check_context", None)
+            registry.register(
+                getattr(handler, "check_name", None) or attribute,
+                handler,
+                event=getattr(handler, "check_event", "rule"),
+                key=getattr(handler, "check_key", None),
+                context=str(getattr(target, context)) if context else "",
+                cached=getattr(handler, "check_cached", True),
+            )
+        return registry
+
+    def names(self) -> list:
+        return list(self._checks)
+
+    def context(self, name: str) -> str:
+        return self._checks[name][0].context
+
+    def cached(self, name: str) -> bool:
+        return self._checks[name][0].cached
+
+    def handlers(self, names=None) -> list:
+        if names is None:
+            names = self._checks
+        return [handler for name in names for handler in self._checks[name]]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._checks
+
+    def __len__(self) -> int:
+        return len(self._checks)
+
+
+class CheckEngine:
+    """
+    Walks a rule once and dispatches every event to the subscribed handlers
+    """
+
+    def __init__(self, registry: CheckRegistry):
+        self.registry = registry
+        self._plans = {}
+
+    def _plan(self, names: tuple) -> tuple:
+        """
+        Handlers of the checks 'names' grouped by event, metadata handlers by key
+        """
+        plan = self._plans.get(names)
+        if plan is None:
+            by_event = {event: [] for event in EVENTS}
+            metadata = {}
+            for handler in self.registry.handlers(names):
+                if handler.event == "metadata":
+                    metadata.setdefault(handler.key, []).append(handler)
+                else:
+                    by_event[handler.event].append(handler)
+            plan = self._plans[names] = (by_event, metadata)
+        return plan
+
+    def run(self, file: str, rule, names=None) -> dict:
+        """
+        Return check name -> list of Finding for the checks 'names' (default: all) on one rule
+        """
+        names = tuple(self.registry.names() if names is None else names)
+        by_event, metadata = self._plan(names)
+        findings = {name: [] for name in names}
+
+        def emit(handlers, *args):
+            for handler in handlers:
+                found = handler.handler(*args)
+                if found:
+                    findings[handler.name].extend(found)
+
+        emit(by_event["rule"], file, rule)
+
+        if metadata:
+            # The first document holding a key wins, as in Rule.get_part()
+            seen = set()
+            for document in rule.yaml:
+                if not isinstance(document, dict):
+                    continue
+                for key, value in document.items():
+                    if key in metadata and key not in seen:
+                        seen.add(key)
+                        emit(metadata[key], file, value)
+
+        selection_handlers = by_event["selection"]
+        field_handlers = by_event["field"]
+        value_handlers = by_event["value"]
+        if not (selection_handlers or field_handlers or value_handlers):
+            return findings
+        detection = rule.get_part("detection")
+        if not isinstance(detection, dict):
+            return findings
+
+        def visit_fields(selection, fields):
+            for field, value in fields.items():
+                emit(field_handlers, file, selection, field, value)
+                if value_handlers:
+                    for item in (value if isinstance(value, list) else [value]):
+                        emit(value_handlers, file, selection, field, item)
+
+        for name, value in detection.items():
+            emit(selection_handlers, file, name, value)
+            if name in DETECTION_KEYWORDS:
+                continue
+            if isinstance(value, dict):
+                visit_fields(name, value)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict):
+                        visit_fields(name, item)
+                    elif value_handlers:
+                        emit(value_handlers, file, name, None, item)
+            elif value_handlers:
+                emit(value_handlers, file, name, None, value)
+        return findings
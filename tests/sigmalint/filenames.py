@@ -0,0 +1,147 @@
+"""
+Rule file name conventions
+
+The file name prefix of a rule follows from its logsource, as declared in
+tests/filename-conventions.yml. A FilenameConvention compiles that table once into a dict
+from (logsource key, value) to prefix template, so the expected prefix of a rule, and a
+suggested file name for a new rule, cost one lookup per logsource key. The expanded prefixes
+are also kept in a trie to find which known prefix a file name uses.
+
+To suggest the file name of a rule, run from the tests directory:
+# python -m sigmalint.filenames path/to/rule.yml
+"""
+
+import argparse
+import os
+import re
+import sys
+
+import yaml
+
+from .paths import TESTS_DIR
+
+CONVENTIONS_PATH = os.path.join(TESTS_DIR, "filename-conventions.yml")
+
+LOGSOURCE_KEYS = ("product", "category", "service")
+
+# Limits of test_file_names: [a-z0-9_]{10,70} plus '.yml'
+MIN_STEM_LENGTH = 10
+MAX_STEM_LENGTH = 70
+
+_NOT_ALLOWED = re.compile(r"[^a-z0-9]+")
+
+_loaded = {}
+
+
+class PrefixTrie:
+    """
+    Longest known prefix of a string, in time linear in the prefix length
+    """
+
+    _END = ""
+
+    def __init__(self, prefixes=()):
+        self._root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix: str) -> None:
+        node = self._root
+        for character in prefix:
+            node = node.setdefault(character, {})
+        node[self._END] = prefix
+
+    def longest_prefix(self, text: str) -> str:
+        node = self._root
+        found = node.get(self._END)
+        for character in text:
+            node = node.get(character)
+            if node is None:
+                break
+            found = node.get(self._END, found)
+        return found
+
+
+class FilenameConvention:
+    """
+    Compiled table of the file name prefixes per logsource
+    """
+
+    def __init__(self, prefixes: dict, os_infixes: dict):
+        # (logsource key, value) -> prefix template with an optional {os} placeholder
+        self.prefixes = dict(prefixes)
+        self.os_infixes = dict(os_infixes)
+        expanded = set()
+        for template in self.prefixes.values():
+            for infix in set(self.os_infixes.values()) | {""}:
+                expanded.add(template.format(os=infix))
+        self.trie = PrefixTrie(sorted(expanded))
+
+    @classmethod
+    def compile(cls, data: dict):
+        prefixes = {}
+        for key in LOGSOURCE_KEYS:
+            for value, template in (data.get(key) or {}).items():
+                prefixes[(key, value)] = template
+        return cls(prefixes, data.get("os_infix") or {})
+
+    @classmethod
+    def from_file(cls, path: str = CONVENTIONS_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls.compile(yaml.safe_load(f))
+
+    def prefix(self, logsource) -> str:
+        """
+        Expected file name prefix of a rule with this logsource, "" if there is no convention
+        """
+        if not isinstance(logsource, dict):
+            return ""
+        template = ""
+        for key, value in logsource.items():
+            # The last key with a convention wins
+            if isinstance(value, str):
+                template = self.prefixes.get((key, value), template)
+        return template.format(os=self.os_infixes.get(logsource.get("product"), ""))
+
+    def known_prefix(self, filename: str) -> str:
+        """
+        The longest prefix of the table that 'filename' starts with, None if it uses none
+        """
+        return self.trie.longest_prefix(filename)
+
+    def suggest(self, logsource, title: str) -> str:
+        """
+        File name for a rule: the prefix of its logsource and its title in lower case with underscores
+        """
+        prefix = self.prefix(logsource)
+        words = _NOT_ALLOWED.sub("_", str(title or "").lower()).strip("_")
+        stem = (prefix + words)[:MAX_STEM_LENGTH].rstrip("_")
+        if len(stem) < MIN_STEM_LENGTH:
+            stem = (stem + "_rule").lstrip("_")
+        return stem + ".yml"
+
+
+def load_filename_convention(path: str = CONVENTIONS_PATH) -> FilenameConvention:
+    convention = _loaded.get(path)
+    if convention is None:
+        convention = _loaded[path] = FilenameConvention.from_file(path)
+    return convention
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.filenames",
+                                     description="Suggest file names following the naming convention for rule files")
+    parser.add_argument("rules", nargs="+", metavar="RULE", help="rule file")
+    args = parser.parse_args(argv)
+    convention = load_filename_convention()
+    for path in args.rules:
+        with open(path, encoding="utf-8") as f:
+            documents = [document for document in yaml.safe_load_all(f) if isinstance(document, dict)]
+        logsource = next((document["logsource"] for document in documents if "logsource" in document), None)
+        title = next((document["title"] for document in documents if "title" in document), None)
+        print("{}: {}".format(path, convention.suggest(logsource, title)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Canonical detection fingerprints
+
+Two rules have the same detection logic when their logsource and detection reduce to the
+same canonical form. The form is independent of the order of keys and values, lowercases
+values that Sigma matches case-insensitively and ignores what does not change the matched
+events: the logsource 'definition', the 'timeframe' and repeated values. Its hash turns the
+duplicate search into a single pass over a dict of buckets:
+
+    buckets = group_by_fingerprint((path, logsource, detection) for ...)
+    duplicates = [paths for paths in buckets.values() if len(paths) > 1]
+
+Nothing here modifies the documents passed in.
+"""
+
+import hashlib
+import json
+
+# Value modifiers that make the comparison case-sensitive
+CASE_SENSITIVE_MODIFIERS = frozenset(["re", "cased", "base64", "base64offset"])
+
+# Detection keys ignored by the fingerprint, the rest are search identifiers and the condition
+IGNORED_DETECTION_KEYS = frozenset(["timeframe"])
+
+# Logsource keys ignored by the fingerprint, 'definition' is free text for humans
+IGNORED_LOGSOURCE_KEYS = frozenset(["definition"])
+
+
+def _string(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _scalar(value, case_sensitive: bool) -> str:
+    if isinstance(value, bool) or value is None:
+        return _string(value)
+    if isinstance(value, (int, float)):
+        # 4688 and '4688' match the same events
+        value = str(value)
+    if isinstance(value, str):
+        return _string(value if case_sensitive else value.lower())
+    return _canonical(value, case_sensitive)
+
+
+def _value_list(values: list, case_sensitive: bool) -> str:
+    # Values of a field or keyword list are alternatives (or all required with |all),
+    # neither their order nor repetitions change the result
+    return "[" + ",".join(sorted(set(_scalar(value, case_sensitive) for value in values))) + "]"
+
+
+def _field_map(fields: dict) -> str:
+    items = []
+    for field, values in fields.items():
+        modifiers = str(field).split("|")[1:]
+        case_sensitive = not CASE_SENSITIVE_MODIFIERS.isdisjoint(modifiers)
+        if isinstance(values, list):
+            canonical = _value_list(values, case_sensitive)
+        else:
+            canonical = _scalar(values, case_sensitive)
+        items.append(_string(str(field)) + ":" + canonical)
+    return "{" + ",".join(sorted(items)) + "}"
+
+
+def _canonical(value, case_sensitive: bool = False) -> str:
+    if isinstance(value, dict):
+        return _field_map(value)
+    if isinstance(value, list):
+        return _value_list(value, case_sensitive)
+    return _scalar(value, case_sensitive)
+
+
+def _condition(condition) -> str:
+    if isinstance(condition, list):
+        return "[" + ",".join(sorted(set(_condition(item) for item in condition))) + "]"
+    if isinstance(condition, str):
+        return _string(" ".join(condition.split()))
+    return _string(condition)
+
+
+def canonical_detection(logsource: dict, detection: dict) -> str:
+    """
+    Canonical text form of a logsource and detection, equal for rules matching the same events
+    """
+    logsource_items = sorted(
+        _string(str(key).lower()) + ":" + _scalar(value, False)
+        for key, value in (logsource or {}).items() if key not in IGNORED_LOGSOURCE_KEYS)
+    detection_items = []
+    for name, value in (detection or {}).items():
+        if name in IGNORED_DETECTION_KEYS:
+            continue
+        if name == "condition":
+            detection_items.append(_string(name) + ":" + _condition(value))
+        else:
+            # A list of maps is an OR of the maps, canonical like any other value list
+            detection_items.append(_string(name) + ":" + _canonical(value))
+    return "logsource{" + ",".join(logsource_items) + "}detection{" + ",".join(sorted(detection_items)) + "}"
+
+
+def detection_fingerprint(logsource: dict, detection: dict) -> str:
+    """
+    Stable hash of canonical_detection()
+    """
+    return hashlib.sha256(canonical_detection(logsource, detection).encode("utf-8")).hexdigest()
+
+
+def rule_fingerprint(rule) -> str:
+    """
+    Fingerprint of a Rule, None for multi-part rules and rules without detection
+    """
+    if rule.is_multipart:
+        return None
+    detection = rule.get_part("detection")
+    if not isinstance(detection, dict):
+        return None
+    return detection_fingerprint(rule.get_part("logsource"), detection)
+
+
+def group_by_fingerprint(items) -> dict:
+    """
+    Group (key, logsource, detection) triples, return fingerprint -> [keys] in input order
+    """
+    buckets = {}
+    for key, logsource, detection in items:
+        buckets.setdefault(detection_fingerprint(logsource, detection), []).append(key)
+    return buckets
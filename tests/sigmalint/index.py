@@ -0,0 +1,142 @@
+"""
+Persisted index of the cross-rule facts used by the corpus-wide checks
+
+The uniqueness checks (ids, titles, file names) and the duplicate detection check
+need every other rule of the repository. The index keeps exactly those facts per
+rule, the detection as its canonical fingerprint, in .sigma-cache/index.pickle, validated by file size and mtime, so the
+--changed-since mode can probe it instead of reading and parsing the unchanged rules.
+"""
+
+import collections
+import os
+
+from .cache import (CACHE_DIR, CACHE_FORMAT, PACKAGE_DIR, _read_pickle, _write_pickle, cache_enabled, content_digest,
+                    files_digest)
+from .corpus import Rule, parse_rule_text, yield_rule_file_paths
+from .fingerprint import rule_fingerprint
+from .paths import REPO_ROOT
+
+IndexEntry = collections.namedtuple("IndexEntry", [
+    "path", "filename", "mtime_ns", "size", "digest", "multipart", "id", "title", "fingerprint"])
+
+
+def index_version() -> str:
+    # The entry layout and the fingerprints are defined by these modules
+    return files_digest([os.path.join(PACKAGE_DIR, name) for name in ("index.py", "fingerprint.py", "corpus.py")],
+                        "format={}".format(CACHE_FORMAT))
+
+
+def index_entry(rule, stat: os.stat_result = None) -> IndexEntry:
+    # Rules that are not on disk have no mtime
+    return IndexEntry(
+        path=rule.path,
+        filename=rule.filename,
+        mtime_ns=stat.st_mtime_ns if stat is not None else None,
+        size=stat.st_size if stat is not None else len(rule.text.encode("utf-8")),
+        digest=rule.digest,
+        multipart=rule.is_multipart,
+        id=rule.get_part("id"),
+        title=rule.get_part("title"),
+        fingerprint=rule_fingerprint(rule),
+    )
+
+
+class RuleIndex:
+    """
+    Ordered mapping of rule path -> IndexEntry for all rule files on disk
+    """
+
+    _shared = {}
+
+    def __init__(self, entries: dict, path: str):
+        self._entries = entries
+        self.path = path
+        self._dirty = False
+
+    @classmethod
+    def open(cls, directory: str = CACHE_DIR):
+        path = os.path.join(directory, "index.pickle")
+        stored = _read_pickle(path) if cache_enabled() else None
+        if stored and stored.get("version") == index_version():
+            return cls(stored["entries"], path)
+        return cls({}, path)
+
+    @classmethod
+    def shared(cls, directories: list, root: str = REPO_ROOT, corpus=None):
+        """
+        Return the index of all rules below 'directories', brought up to date with the disk.
+        Rules already present in 'corpus' are taken from there, other files whose size or
+        mtime changed since they were indexed are read and parsed again.
+        """
+        key = (tuple(directories), root)
+        if key not in cls._shared:
+            index = cls.open()
+            index.refresh(directories, root, corpus)
+            index.save()
+            cls._shared[key] = index
+        return cls._shared[key]
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """
+        In-memory index of a corpus that does not live on disk, it is never saved
+        """
+        return cls({rule.path: index_entry(rule) for rule in corpus}, None)
+
+    def refresh(self, directories: list, root: str, corpus=None) -> None:
+        entries = {}
+        for path, abspath in yield_rule_file_paths(directories, root):
+            stat = os.stat(abspath)
+            entry = self._entries.get(path)
+            rule = corpus[path] if corpus is not None and path in corpus else None
+            if rule is not None:
+                if entry is None or entry.digest != rule.digest or entry.mtime_ns != stat.st_mtime_ns:
+                    entry = index_entry(rule, stat)
+                    self._dirty = True
+            elif entry is None or entry.mtime_ns != stat.st_mtime_ns or entry.size != stat.st_size:
+                with open(abspath, encoding='utf-8') as f:
+                    text = f.read()
+                digest = content_digest(text)
+                if entry is not None and entry.digest == digest:
+                    entry = entry._replace(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                else:
+                    entry = index_entry(Rule(path, abspath, text, parse_rule_text(text), digest), stat)
+                self._dirty = True
+            entries[path] = entry
+        if len(entries) != len(self._entries):
+            self._dirty = True
+        self._entries = entries
+
+    def put(self, entry: IndexEntry) -> None:
+        if self._entries.get(entry.path) != entry:
+            self._entries[entry.path] = entry
+            self._dirty = True
+
+    def discard(self, path: str) -> None:
+        if self._entries.pop(path, None) is not None:
+            self._dirty = True
+
+    def save(self) -> None:
+        if not cache_enabled() or not self._dirty or self.path is None:
+            return
+        _write_pickle(self.path, {"version": index_version(), "entries": self._entries})
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __getitem__(self, path: str) -> IndexEntry:
+        return self._entries[path]
+
+    def excluding(self, paths) -> list:
+        """
+        Entries of all indexed rules except 'paths', in corpus order
+        """
+        paths = set(paths)
+        return [entry for entry in self._entries.values() if entry.path not in paths]
@@ -0,0 +1,266 @@
+"""
+Per-check instrumentation of lint runs (--profile)
+
+With --profile the setup stages (corpus loading, rule index, findings cache), every test
+method and every per-file check record their wall time, CPU time, the rule files they
+visited and the YAML documents they parsed. When the run ends the report is written as JSON
+and the slowest entries are printed. --cprofile PATH additionally runs the session under
+cProfile, --tracemalloc records the peak memory of every entry.
+
+Without --profile nothing is wrapped or patched, the lint modules only check whether
+active_profiler() is None.
+
+Per-file checks run in one traversal per rule, their entries hold the time summed over all
+rules and the number of rules checked (cache misses). With -j N the traversal runs in worker
+processes and only the stages and tests are timed.
+"""
+
+import atexit
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+import yaml
+
+from .cache import CACHE_DIR
+from .engine import CheckRegistry
+from .options import OPTIONS
+
+REPORT_FORMAT = 1
+
+# yaml functions counted as parses
+YAML_LOADERS = ("load", "load_all", "safe_load", "safe_load_all", "full_load", "full_load_all")
+
+_profiler = None
+
+
+class Measurement:
+    """
+    Accumulated cost of one stage, test or check
+    """
+
+    __slots__ = ("wall", "cpu", "calls", "files", "yaml_parses", "memory_peak")
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.files = 0
+        self.yaml_parses = 0
+        self.memory_peak = None
+
+    @contextlib.contextmanager
+    def measure(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            self.wall += time.perf_counter() - wall
+            self.cpu += time.process_time() - cpu
+            self.calls += 1
+
+    def to_json(self) -> dict:
+        data = {"wall": round(self.wall, 6), "cpu": round(self.cpu, 6), "calls": self.calls, "files": self.files,
+                "yaml_parses": self.yaml_parses}
+        if self.memory_peak is not None:
+            data["memory_peak"] = self.memory_peak
+        return data
+
+
+def timed_registry(registry: CheckRegistry, records: dict, prefix: str = "") -> CheckRegistry:
+    """
+    Copy of a CheckRegistry whose handlers add their time to records[prefix + check name]
+    """
+    timed = CheckRegistry()
+    for name in registry.names():
+        record = records.setdefault(prefix + name, Measurement())
+        for check in registry.handlers([name]):
+            def handler(*args, _handler=check.handler, _record=record):
+                with _record.measure():
+                    found = _handler(*args)
+                    # Generator checks do their work while being consumed
+                    return list(found) if found else found
+            timed.register(name, handler, check.event, check.key, check.context, check.cached)
+    return timed
+
+
+class VisitCountingCorpus:
+    """
+    RuleCorpus view counting the rules iterated over, as files visited
+    """
+
+    def __init__(self, corpus, profiler):
+        self.corpus = corpus
+        self._profiler = profiler
+
+    def __iter__(self):
+        for rule in self.corpus:
+            self._profiler.visits += 1
+            yield rule
+
+    def items(self):
+        for item in self.corpus.items():
+            self._profiler.visits += 1
+            yield item
+
+    def __len__(self):
+        return len(self.corpus)
+
+    def __contains__(self, path):
+        return path in self.corpus
+
+    def __getitem__(self, path: str):
+        return self.corpus[path]
+
+    def __getattr__(self, name):
+        return getattr(self.corpus, name)
+
+
+class Profiler:
+    """
+    Records the measurements of one lint module run and reports them at exit
+    """
+
+    def __init__(self, name: str, output: str = None, top: int = 10, cprofile: str = None, trace_memory: bool = False):
+        self.name = name
+        self.output = output or os.path.join(CACHE_DIR, "profile-{}.json".format(name))
+        self.top = top
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.tests = {}
+        self.checks = {}
+        self.visits = 0
+        self.yaml_parses = 0
+        self._profile = None
+        self._patched = {}
+
+    def _counting(self, loader):
+        def load(*args, **kwargs):
+            self.yaml_parses += 1
+            return loader(*args, **kwargs)
+        return load
+
+    def start(self) -> None:
+        for name in YAML_LOADERS:
+            if hasattr(yaml, name):
+                self._patched[name] = getattr(yaml, name)
+                setattr(yaml, name, self._counting(self._patched[name]))
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        atexit.register(self.finish)
+
+    def stop(self) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+        for name, loader in self._patched.items():
+            setattr(yaml, name, loader)
+        self._patched = {}
+
+    @contextlib.contextmanager
+    def scope(self, records: dict, name: str):
+        record = records.setdefault(name, Measurement())
+        visits, parses = self.visits, self.yaml_parses
+        if self.trace_memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        try:
+            with record.measure():
+                yield record
+        finally:
+            record.files += self.visits - visits
+            record.yaml_parses += self.yaml_parses - parses
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - before
+                record.memory_peak = max(record.memory_peak or 0, peak)
+
+    def stage(self, name: str):
+        return self.scope(self.stages, name)
+
+    def test(self, name: str):
+        return self.scope(self.tests, name)
+
+    def count_files(self, prefix: str, names) -> None:
+        # One traversal of a rule for these checks
+        for name in names:
+            self.checks[prefix + name].files += 1
+
+    def report(self) -> dict:
+        return {
+            "format": REPORT_FORMAT,
+            "module": self.name,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "jobs": OPTIONS.jobs,
+            "changed_since": OPTIONS.changed_since,
+            "cprofile": self.cprofile,
+            "stages": {name: record.to_json() for name, record in self.stages.items()},
+            "tests": {name: record.to_json() for name, record in self.tests.items()},
+            "checks": {name: record.to_json() for name, record in sorted(self.checks.items())},
+        }
+
+    def write(self, report: dict) -> None:
+        directory = os.path.dirname(os.path.abspath(self.output))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+            f.write("\n")
+
+    def summary(self, report: dict) -> str:
+        entries = [("stage " + name, data) for name, data in report["stages"].items()]
+        entries += [("test " + name.rsplit(".", 1)[-1], data) for name, data in report["tests"].items()]
+        entries += [("check " + name, data) for name, data in report["checks"].items()]
+        entries.sort(key=lambda entry: -entry[1]["wall"])
+        memory = self.trace_memory
+        lines = ["Slowest {} of {} profiled entries of {}:".format(min(self.top, len(entries)), len(entries), self.name),
+                 "{:>10} {:>10} {:>7} {:>6}{}  {}".format("wall", "cpu", "files", "yaml",
+                                                         " {:>10}".format("peak KiB") if memory else "", "name")]
+        for name, data in entries[:self.top]:
+            peak = " {:>10}".format(data.get("memory_peak", 0) // 1024) if memory else ""
+            lines.append("{:>9.3f}s {:>9.3f}s {:>7} {:>6}{}  {}".format(
+                data["wall"], data["cpu"], data["files"], data["yaml_parses"], peak, name))
+        lines.append("Profile written to {}".format(self.output))
+        return "\n".join(lines)
+
+    def finish(self) -> None:
+        self.stop()
+        report = self.report()
+        self.write(report)
+        print()
+        print(self.summary(report))
+        if self._profile is not None:
+            self._profile.dump_stats(self.cprofile)
+            print("cProfile statistics written to {} (python -m pstats {})".format(self.cprofile, self.cprofile))
+            pstats.Stats(self._profile).sort_stats("cumulative").print_stats(self.top)
+
+
+def start_profiler(name: str) -> Profiler:
+    """
+    Start the profiler of this run if it is enabled by the options, return the active one or None
+    """
+    global _profiler
+    if _profiler is None and (OPTIONS.profile or OPTIONS.cprofile or OPTIONS.tracemalloc):
+        _profiler = Profiler(name, OPTIONS.profile_output, OPTIONS.profile_top, OPTIONS.cprofile, OPTIONS.tracemalloc)
+        _profiler.start()
+    return _profiler
+
+
+def active_profiler() -> Profiler:
+    return _profiler
+
+
+def stage(name: str):
+    """
+    Context measuring a setup stage, a no-op without profiler
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
@@ -0,0 +1,151 @@
+"""
+Compiled field schema of the logsources in tests/logsource.json
+
+logsource.json lists the valid field names per product and category or service, in a
+'legit' section extended by an 'addon' section, with the 'commun' fields of a product valid
+in all its categories and services. A LogsourceSchema resolves all of this once into one
+frozenset of field names per (product, category, service), so checking a field is a set
+lookup. The compiled schema is kept in .sigma-cache/logsource-schema.pickle, validated by the
+digest of logsource.json and of this module.
+"""
+
+import json
+import os
+
+from .cache import CACHE_DIR, CACHE_FORMAT, _read_pickle, _write_pickle, cache_enabled, files_digest
+from .paths import TESTS_DIR
+
+LOGSOURCE_PATH = os.path.join(TESTS_DIR, "logsource.json")
+
+# Rules may search the hashes extracted from a 'Hashes' or 'Hash' field
+HASH_FIELDS = ("md5", "sha1", "sha256", "Imphash")
+
+# Product of the rules without product
+EMPTY_PRODUCT = "empty"
+
+_loaded = {}
+
+
+class LogsourceSchema:
+    """
+    Immutable (product, category, service) -> frozenset of valid field names
+    """
+
+    __slots__ = ("_fields", "_common")
+
+    def __init__(self, fields: dict, common: dict):
+        # fields: (product, category, service) with at most one of category and service set,
+        # (product, None, None) holds the fields of rules naming only the product
+        object.__setattr__(self, "_fields", dict(fields))
+        object.__setattr__(self, "_common", dict(common))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LogsourceSchema is immutable")
+
+    def __reduce__(self):
+        return LogsourceSchema, (self._fields, self._common)
+
+    def __eq__(self, other):
+        return isinstance(other, LogsourceSchema) and self._fields == other._fields and self._common == other._common
+
+    def __hash__(self):
+        return hash(frozenset(self._fields.items()))
+
+    @classmethod
+    def compile(cls, data: dict):
+        """
+        Schema of the parsed content of logsource.json
+        """
+        products = {}
+        for section in ("legit", "addon"):
+            for product, sources in data.get(section, {}).items():
+                known = products.setdefault(product, {"commun": [], "empty": [], "category": {}, "service": {}})
+                for key in ("commun", "empty"):
+                    known[key] = known[key] + [field for field in sources.get(key, []) if field not in known[key]]
+                for kind in ("category", "service"):
+                    for name, names in sources.get(kind, {}).items():
+                        known[kind][name] = known[kind].get(name, []) + list(names)
+
+        fields = {}
+        common = {}
+        for product, sources in products.items():
+            common[product] = frozenset(sources["commun"])
+            fields[(product, None, None)] = frozenset(sources["empty"])
+            for name, names in sources["category"].items():
+                extracted = HASH_FIELDS if "Hashes" in names or "Hash" in names else ()
+                fields[(product, name, None)] = frozenset(names).union(extracted, common[product])
+            for name, names in sources["service"].items():
+                fields[(product, None, name)] = frozenset(names).union(common[product])
+        return cls(fields, common)
+
+    @classmethod
+    def from_file(cls, path: str = LOGSOURCE_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls.compile(json.load(f))
+
+    def products(self) -> frozenset:
+        return frozenset(self._common)
+
+    def _key(self, product, category, service):
+        if product is not None and product not in self._common:
+            return None
+        product = product or EMPTY_PRODUCT
+        # A known category wins over the service, as in the former get_logsource()
+        if category is not None and (product, category, None) in self._fields:
+            return product, category, None
+        if service is not None and (product, None, service) in self._fields:
+            return product, None, service
+        if category is None and service is None:
+            return product, None, None
+        return None
+
+    def exists(self, product: str = None, category: str = None, service: str = None) -> bool:
+        """
+        Whether logsource.json knows this logsource
+        """
+        return self._key(product, category, service) is not None
+
+    def fields(self, product: str = None, category: str = None, service: str = None) -> frozenset:
+        """
+        Valid field names of a logsource, None if it is unknown. Unknown products use the 'empty' product.
+        """
+        if product not in self._common:
+            product = None
+        key = self._key(product, category, service)
+        return self._fields.get(key) if key else None
+
+    def common(self, product: str = None) -> frozenset:
+        """
+        The 'commun' fields of a product, valid for all of its categories and services
+        """
+        if product not in self._common:
+            product = EMPTY_PRODUCT
+        return self._common.get(product, frozenset())
+
+    def is_valid_field(self, field: str, product: str = None, category: str = None, service: str = None) -> bool:
+        fields = self.fields(product, category, service)
+        return fields is not None and field in fields
+
+
+def schema_version(path: str = LOGSOURCE_PATH) -> str:
+    return files_digest([path, os.path.realpath(__file__)], "format={}".format(CACHE_FORMAT))
+
+
+def load_logsource_schema(path: str = LOGSOURCE_PATH, directory: str = CACHE_DIR) -> LogsourceSchema:
+    """
+    The compiled schema of logsource.json, from the pickled snapshot if it is up to date
+    """
+    version = schema_version(path)
+    schema = _loaded.get(path)
+    if schema is not None and schema[0] == version:
+        return schema[1]
+    snapshot = os.path.join(directory, "logsource-schema.pickle")
+    stored = _read_pickle(snapshot) if cache_enabled() else None
+    if stored and stored.get("version") == version and isinstance(stored.get("schema"), LogsourceSchema):
+        compiled = stored["schema"]
+    else:
+        compiled = LogsourceSchema.from_file(path)
+        if cache_enabled():
+            _write_pickle(snapshot, {"version": version, "schema": compiled})
+    _loaded[path] = (version, compiled)
+    return compiled
@@ -0,0 +1,522 @@
+"""
+Language server: Sigma rule diagnostics while typing
+
+A Language Server Protocol server over stdio for editors. It loads the lint modules once,
+like the watch mode, with the corpus and the uniqueness facts of every rule resident in
+memory, and runs every open buffer through the per-file checks of all modules and the
+uniqueness index whenever it changes. Changes arriving faster than they are checked are
+coalesced, only the latest text of a buffer is checked once the input is drained. Checks
+taking longer than the latency budget are logged to the editor.
+
+Buffers are parsed with the mark-keeping loader of sigmalint.marks, so each finding is
+placed on the key or value its check was called with: the metadata key, the selection,
+the field or the single value. Findings of whole-rule checks are placed on the field,
+key or text quoted in their message, or on the first line.
+
+Saved files and files changed outside the editor update the resident corpus, the open
+buffers are checked again against it.
+
+Configure the editor to start, with the tests directory as working directory:
+# python -m sigmalint.lsp
+"""
+
+import argparse
+import json
+import os
+import re
+import select
+import signal
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+import yaml
+from colorama import Fore
+
+from .corpus import Rule
+from .engine import CheckEngine, CheckRegistry
+from .index import index_entry
+from .marks import Span, load_with_marks
+from .options import OPTIONS
+from .paths import REPO_ROOT
+from .watch import UNIQUE_MESSAGES, WatchSession, create_watcher
+
+SERVER_NAME = "sigma-lint"
+
+# Milliseconds a buffer check may take before it is reported to the editor
+LATENCY_BUDGET_MS = 100
+
+# Seconds without input after which rule files changed on disk are picked up
+IDLE_SECONDS = 1.0
+
+# LSP DiagnosticSeverity, MessageType and TextDocumentSyncKind
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+MESSAGE_WARNING = 2
+MESSAGE_INFO = 3
+SYNC_FULL = 1
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+SERVER_NOT_INITIALIZED = -32002
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+QUOTED = re.compile(r"'([^']+)'|<([^>]+)>|\"([^\"]+)\"")
+
+UNIQUE_LOCATIONS = {
+    "id": ("key", ("id",)),
+    "title": ("key", ("title",)),
+    "filename": None,
+    "fingerprint": ("key", ("detection",)),
+}
+
+
+class MessageStream:
+    """
+    JSON-RPC messages framed by Content-Length headers, the LSP base protocol
+    """
+
+    def __init__(self, infile, outfile):
+        self._fd = infile.fileno()
+        self._out = outfile
+        self._buffer = bytearray()
+
+    def _take(self):
+        end = self._buffer.find(b"\r\n\r\n")
+        if end < 0:
+            return None
+        length = None
+        for line in bytes(self._buffer[:end]).split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        if length is None:
+            raise ValueError("Message without Content-Length header")
+        start = end + 4
+        if len(self._buffer) < start + length:
+            return None
+        body = bytes(self._buffer[start:start + length])
+        del self._buffer[:start + length]
+        return json.loads(body.decode("utf-8"))
+
+    def read(self, timeout: float = None):
+        """
+        Next message, None if none is complete within 'timeout' seconds. EOFError at the end of the input.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            message = self._take()
+            if message is not None:
+                return message
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return None
+            data = os.read(self._fd, 64 * 1024)
+            if not data:
+                raise EOFError
+            self._buffer += data
+
+    def write(self, message: dict) -> None:
+        body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        self._out.write(b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n\r\n" + body)
+        self._out.flush()
+
+
+def _event_location(event: str, key: str, args: tuple):
+    # What a handler was called with, see the events of sigmalint.engine
+    if event == "metadata":
+        return "key", (key,)
+    if event == "selection":
+        return "key", ("detection", args[1])
+    if event == "field":
+        return "field", args[1], args[2]
+    if event == "value":
+        return "value", args[1], args[2], args[3]
+    return None
+
+
+def located_registry(registry: CheckRegistry) -> CheckRegistry:
+    """
+    Copy of a CheckRegistry whose handlers return (Finding, location) pairs instead of Finding
+    """
+    located = CheckRegistry()
+    for check in registry.handlers():
+        def handler(*args, _handler=check.handler, _event=check.event, _key=check.key):
+            found = _handler(*args)
+            if not found:
+                return found
+            location = _event_location(_event, _key, args)
+            return [(finding, location) for finding in found]
+        located.register(check.name, handler, check.event, check.key, check.context, check.cached)
+    return located
+
+
+class RuleLocator:
+    """
+    Spans of the keys and values of a parsed rule buffer
+    """
+
+    def __init__(self, rule: Rule, marks: list):
+        self.rule = rule
+        self.marks = marks
+
+    def _marks_of(self, key: str):
+        # First document holding the key, as in Rule.get_part()
+        for document, marks in zip(self.rule.yaml, self.marks):
+            if isinstance(document, dict) and key in document:
+                return marks
+        return None
+
+    def key(self, path: tuple) -> Span:
+        marks = self._marks_of(path[0])
+        return marks.key(path) if marks else None
+
+    def value(self, path: tuple) -> Span:
+        marks = self._marks_of(path[0])
+        return marks.value(path) if marks else None
+
+    def _selection_path(self, selection, field):
+        detection = self.rule.get_part("detection")
+        value = detection.get(selection) if isinstance(detection, dict) else None
+        path = ("detection", str(selection))
+        if field is None:
+            return path, value
+        if isinstance(value, dict):
+            return path + (str(field),), value.get(field)
+        if isinstance(value, list):
+            for position, item in enumerate(value):
+                if isinstance(item, dict) and field in item:
+                    return path + (position, str(field)), item[field]
+        return None, None
+
+    def _mentioned(self, message: str) -> Span:
+        for groups in QUOTED.findall(message):
+            token = next(group for group in groups if group)
+            if token == self.rule.path:
+                continue
+            for marks in self.marks:
+                for path, span in marks.keys.items():
+                    if path[-1] == token or path[-1].split("|")[0] == token:
+                        return span
+            match = re.search(r"(?<!\w){}(?!\w)".format(re.escape(token)), self.rule.text)
+            if match:
+                line = self.rule.text.count("\n", 0, match.start())
+                column = match.start() - (self.rule.text.rfind("\n", 0, match.start()) + 1)
+                return Span(line, column, line, column + len(token))
+        return None
+
+    def locate(self, location, message: str = "") -> Span:
+        """
+        Span of a finding from its handler location, the tokens quoted in its message or the first line
+        """
+        span = None
+        if location is not None:
+            kind = location[0]
+            if kind == "key":
+                span = self.key(tuple(str(item) for item in location[1]))
+            elif kind == "field":
+                path, _ = self._selection_path(location[1], location[2])
+                span = self.key(path) if path else None
+            elif kind == "value":
+                path, values = self._selection_path(location[1], location[2])
+                if path and isinstance(values, list):
+                    try:
+                        span = self.value(path + (values.index(location[3]),))
+                    except ValueError:
+                        span = self.value(path)
+                elif path:
+                    span = self.value(path)
+        if span is None:
+            span = self._mentioned(ANSI_ESCAPE.sub("", message))
+        if span is None:
+            first_line = self.rule.text.split("\n", 1)[0]
+            span = Span(0, 0, 0, len(first_line))
+        return span
+
+
+def _utf16_column(line: str, column: int) -> int:
+    # LSP positions count UTF-16 code units, YAML marks count characters
+    prefix = line[:column]
+    return column if prefix.isascii() else len(prefix.encode("utf-16-le")) // 2
+
+
+def _diagnostic(text_lines: list, span: Span, message: str, code: str = None) -> dict:
+    def position(line, column):
+        line_text = text_lines[line] if line < len(text_lines) else ""
+        return {"line": line, "character": _utf16_column(line_text, column)}
+    severity = SEVERITY_ERROR if message.startswith(Fore.RED) else SEVERITY_WARNING
+    diagnostic = {
+        "range": {"start": position(span.start_line, span.start_column), "end": position(span.end_line, span.end_column)},
+        "severity": severity,
+        "source": SERVER_NAME,
+        "message": ANSI_ESCAPE.sub("", message),
+    }
+    if code:
+        diagnostic["code"] = code
+    return diagnostic
+
+
+class LanguageServer:
+    """
+    Dispatches the LSP messages of one editor session
+    """
+
+    def __init__(self, stream: MessageStream, budget_ms: float = LATENCY_BUDGET_MS, poll: bool = False):
+        self.stream = stream
+        self.budget_ms = budget_ms
+        self.poll = poll
+        self.session = None
+        self.engines = []
+        self.watcher = None
+        self.documents = {}
+        self.dirty = set()
+        self.initialized = False
+        self.shutting_down = False
+        self.requests = {
+            "initialize": self.initialize,
+            "shutdown": self.shutdown,
+        }
+        self.notifications = {
+            "initialized": self.on_initialized,
+            "textDocument/didOpen": self.did_open,
+            "textDocument/didChange": self.did_change,
+            "textDocument/didSave": self.did_save,
+            "textDocument/didClose": self.did_close,
+            "workspace/didChangeWatchedFiles": self.did_change_watched_files,
+        }
+
+    def log(self, message: str, kind: int = MESSAGE_INFO) -> None:
+        self.stream.write({"jsonrpc": "2.0", "method": "window/logMessage", "params": {"type": kind, "message": message}})
+
+    def publish(self, uri: str, diagnostics: list) -> None:
+        self.stream.write({"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics",
+                           "params": {"uri": uri, "diagnostics": diagnostics}})
+
+    def load_session(self) -> None:
+        if self.session is not None:
+            return
+        started = time.perf_counter()
+        self.session = WatchSession()
+        self.engines = [(case, CheckEngine(located_registry(registry))) for case, registry, _ in self.session.linters]
+        self.watcher = create_watcher(self.session.directories, self.session.root, self.poll)
+        self.log("Loaded {} rules in {:.1f}s".format(len(self.session.corpus), time.perf_counter() - started))
+
+    def close(self) -> None:
+        if self.watcher is not None:
+            self.watcher.close()
+        if self.session is not None:
+            self.session.close()
+
+    # Requests
+
+    def initialize(self, params: dict) -> dict:
+        self.initialized = True
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": SYNC_FULL, "save": {"includeText": False}},
+            },
+            "serverInfo": {"name": SERVER_NAME},
+        }
+
+    def shutdown(self, params) -> None:
+        self.shutting_down = True
+        return None
+
+    # Notifications
+
+    def on_initialized(self, params) -> None:
+        self.load_session()
+
+    def did_open(self, params: dict) -> None:
+        document = params["textDocument"]
+        self.documents[document["uri"]] = document["text"]
+        self.dirty.add(document["uri"])
+
+    def did_change(self, params: dict) -> None:
+        uri = params["textDocument"]["uri"]
+        # Full synchronization: the last change holds the whole text
+        changes = [change for change in params["contentChanges"] if "range" not in change]
+        if changes:
+            self.documents[uri] = changes[-1]["text"]
+            self.dirty.add(uri)
+
+    def did_save(self, params: dict) -> None:
+        self.load_session()
+        path = self.document_path(params["textDocument"]["uri"])[1]
+        if os.path.isfile(path):
+            self.session.refresh(path)
+
+    def did_close(self, params: dict) -> None:
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        self.dirty.discard(uri)
+        self.publish(uri, [])
+
+    def did_change_watched_files(self, params: dict) -> None:
+        self.load_session()
+        paths = [self.document_path(change["uri"])[1] for change in params.get("changes", [])]
+        self.refresh([path for path in paths if path.endswith(".yml")])
+
+    def refresh(self, paths) -> None:
+        if not paths:
+            return
+        # Removals first, as in the watch mode
+        for path in sorted(paths, key=lambda path: (os.path.exists(path), path)):
+            self.session.refresh(path)
+        # Uniqueness of the open buffers depends on the other rules
+        self.dirty.update(self.documents)
+
+    # Checking
+
+    def document_path(self, uri: str) -> tuple:
+        """
+        (path as in the lint modules, absolute path) of a document URI
+        """
+        parsed = urllib.parse.urlparse(uri)
+        if parsed.scheme == "file":
+            abspath = urllib.request.url2pathname(parsed.path)
+        else:
+            abspath = urllib.parse.unquote(parsed.path or uri)
+        root = os.path.join(self.session.root if self.session else REPO_ROOT, "")
+        path = os.path.relpath(abspath, root) if abspath.startswith(root) else abspath
+        return path, abspath
+
+    def diagnostics(self, uri: str, text: str) -> list:
+        path, abspath = self.document_path(uri)
+        text_lines = text.split("\n")
+        try:
+            documents, marks = load_with_marks(text)
+        except yaml.MarkedYAMLError as error:
+            mark = error.problem_mark or error.context_mark
+            span = Span(mark.line, mark.column, mark.line, mark.column + 1) if mark else Span(0, 0, 0, 0)
+            problem = " ".join(part for part in (error.context, error.problem) if part)
+            return [_diagnostic(text_lines, span, Fore.RED + "Rule {} is not valid YAML: {}".format(path, problem))]
+        except yaml.YAMLError as error:
+            return [_diagnostic(text_lines, Span(0, 0, 0, 0), Fore.RED + "Rule {} is not valid YAML: {}".format(path, error))]
+
+        rule = Rule(path, abspath, text, documents)
+        locator = RuleLocator(rule, marks)
+        found = []
+        for case, engine in self.engines:
+            try:
+                results = engine.run(path, rule)
+            except Exception as error:
+                message = Fore.RED + "The checks of {} failed on {}: {!r}".format(case.__module__, path, error)
+                found.append(_diagnostic(text_lines, locator.locate(None), message))
+                continue
+            for name, located in results.items():
+                printed = [(finding, location) for finding, location in located if finding.message]
+                for finding, location in printed:
+                    found.append(_diagnostic(text_lines, locator.locate(location, finding.message), finding.message, name))
+                faulty = [location for finding, location in located if finding.entry is not None]
+                if faulty and not printed:
+                    # Some checks only explain the problem in the assertion of their test
+                    message = Fore.YELLOW + "Rule {} fails {}".format(path, name.replace("check_", "test_", 1))
+                    found.append(_diagnostic(text_lines, locator.locate(faulty[0]), message, name))
+
+        try:
+            entry = index_entry(rule)
+        except Exception:
+            return found
+        for kind, others in self.session.uniques.clashes(entry).items():
+            for other in others:
+                message = UNIQUE_MESSAGES[kind].format(path, other)
+                found.append(_diagnostic(text_lines, locator.locate(UNIQUE_LOCATIONS[kind], message), message))
+        return found
+
+    def check_documents(self) -> None:
+        self.load_session()
+        for uri in sorted(self.dirty):
+            started = time.perf_counter()
+            self.publish(uri, self.diagnostics(uri, self.documents[uri]))
+            elapsed = (time.perf_counter() - started) * 1000
+            if elapsed > self.budget_ms:
+                self.log("Checking {} took {:.0f} ms, over the budget of {:.0f} ms".format(
+                    uri, elapsed, self.budget_ms), MESSAGE_WARNING)
+        self.dirty.clear()
+
+    # Dispatch
+
+    def handle(self, message: dict) -> bool:
+        """
+        Dispatch one message, False on the exit notification
+        """
+        method = message.get("method")
+        if method is None:
+            # Response to a request of ours, there are none
+            return True
+        if method == "exit":
+            return False
+        params = message.get("params")
+        if "id" not in message:
+            handler = self.notifications.get(method)
+            if handler is not None and self.initialized:
+                try:
+                    handler(params)
+                except Exception as error:
+                    self.log("{} failed: {!r}".format(method, error), MESSAGE_WARNING)
+            return True
+
+        response = {"jsonrpc": "2.0", "id": message["id"]}
+        handler = self.requests.get(method)
+        if handler is None:
+            response["error"] = {"code": METHOD_NOT_FOUND, "message": "Unknown method {}".format(method)}
+        elif not self.initialized and method != "initialize":
+            response["error"] = {"code": SERVER_NOT_INITIALIZED, "message": "Server not initialized"}
+        else:
+            try:
+                response["result"] = handler(params)
+            except Exception as error:
+                response["error"] = {"code": INTERNAL_ERROR, "message": repr(error)}
+        self.stream.write(response)
+        return True
+
+    def run(self) -> int:
+        """
+        Serve until the exit notification or the end of the input, return the exit code
+        """
+        try:
+            while True:
+                try:
+                    message = self.stream.read(0 if self.dirty else IDLE_SECONDS)
+                except EOFError:
+                    return 0 if self.shutting_down else 1
+                if message is not None:
+                    if not self.handle(message):
+                        return 0 if self.shutting_down else 1
+                elif self.dirty:
+                    # Input drained: check the latest text of the changed buffers
+                    self.check_documents()
+                elif self.watcher is not None:
+                    self.refresh(self.watcher.changes(0))
+        finally:
+            self.close()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.lsp",
+                                     description="Language server reporting lint findings of Sigma rules while typing")
+    parser.add_argument("--budget-ms", type=float, default=LATENCY_BUDGET_MS, metavar="MS",
+                        help="report buffer checks taking longer than MS milliseconds (default: %(default)s)")
+    parser.add_argument("--poll", action="store_true", help="poll the rule directories instead of using inotify")
+    parser.add_argument("-j", "--jobs", type=int, default=OPTIONS.jobs, metavar="N",
+                        help="parse the corpus in N worker processes at startup (0: one per CPU)")
+    args = parser.parse_args(argv)
+
+    OPTIONS.jobs = args.jobs
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # Protocol messages own stdout, the output of the lint modules goes to stderr
+    output = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    server = LanguageServer(MessageStream(sys.stdin.buffer, output), args.budget_ms, args.poll)
+    try:
+        return server.run()
+    except KeyboardInterrupt:
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+YAML loading that keeps the source position of every node
+
+yaml.safe_load_all() drops the node marks while constructing the documents. load_with_marks()
+composes the node graph itself, constructs the same documents from it and keeps, per document,
+the span of every mapping key and value under its key path, e.g.
+("detection", "selection", "Image|endswith", 0). Keys are the scalars as written (str),
+sequence positions are int. Lines and columns count from 0.
+"""
+
+from collections import namedtuple
+
+import yaml
+
+Span = namedtuple("Span", ["start_line", "start_column", "end_line", "end_column"])
+
+
+def _span(node) -> Span:
+    return Span(node.start_mark.line, node.start_mark.column, node.end_mark.line, node.end_mark.column)
+
+
+class DocumentMarks:
+    """
+    Key path -> Span of the keys and the values of one YAML document
+    """
+
+    def __init__(self, node):
+        self.keys = {}
+        self.values = {}
+        self._walk(node, (), set())
+
+    def _walk(self, node, path: tuple, active: set) -> None:
+        self.values[path] = _span(node)
+        if id(node) in active:
+            # Recursive alias
+            return
+        active.add(id(node))
+        if isinstance(node, yaml.MappingNode):
+            for key_node, value_node in node.value:
+                if not isinstance(key_node, yaml.ScalarNode):
+                    continue
+                key_path = path + (key_node.value,)
+                if key_path not in self.keys:
+                    self.keys[key_path] = _span(key_node)
+                    self._walk(value_node, key_path, active)
+        elif isinstance(node, yaml.SequenceNode):
+            for position, item in enumerate(node.value):
+                self._walk(item, path + (position,), active)
+        active.discard(id(node))
+
+    def key(self, path: tuple) -> Span:
+        return self.keys.get(path)
+
+    def value(self, path: tuple) -> Span:
+        return self.values.get(path)
+
+
+def load_with_marks(text: str) -> tuple:
+    """
+    (documents, list of DocumentMarks) of a YAML stream, the documents equal yaml.safe_load_all(text)
+    """
+    loader = yaml.SafeLoader(text)
+    documents = []
+    marks = []
+    try:
+        while loader.check_node():
+            node = loader.get_node()
+            # Merge keys are flattened into the node while constructing
+            documents.append(loader.construct_document(node))
+            marks.append(DocumentMarks(node))
+    finally:
+        loader.dispose()
+    return documents, marks
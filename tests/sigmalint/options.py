@@ -0,0 +1,60 @@
+"""
+Command line options shared by the lint modules
+
+The options are parsed off sys.argv before the remaining arguments are handed to
+unittest.main(). Under pytest or other runners use the environment variables instead.
+"""
+
+import argparse
+import os
+
+
+class LintOptions:
+    """
+    Run-wide lint settings, defaults come from the environment
+    """
+
+    def __init__(self):
+        # Only lint rules added or modified since this git revision
+        self.changed_since = os.environ.get("SIGMA_LINT_CHANGED_SINCE") or None
+        # Worker processes for the per-file work, 0 means one per CPU
+        self.jobs = int(os.environ.get("SIGMA_LINT_JOBS") or 1)
+        # Per-check timing report, see sigmalint.instrument
+        self.profile = os.environ.get("SIGMA_LINT_PROFILE", "") not in ("", "0")
+        self.profile_output = os.environ.get("SIGMA_LINT_PROFILE_OUTPUT") or None
+        self.profile_top = int(os.environ.get("SIGMA_LINT_PROFILE_TOP") or 10)
+        self.cprofile = os.environ.get("SIGMA_LINT_CPROFILE") or None
+        self.tracemalloc = os.environ.get("SIGMA_LINT_TRACEMALLOC", "") not in ("", "0")
+
+
+OPTIONS = LintOptions()
+
+
+def parse_args(argv: list) -> list:
+    """
+    Consume the lint options from argv and return the arguments left for unittest.main()
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--changed-since", metavar="REV", default=OPTIONS.changed_since,
+                        help="only check rules added or modified since the git revision REV")
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=OPTIONS.jobs,
+                        help="parse and check the rule files in N worker processes (0: one per CPU)")
+    parser.add_argument("--profile", action="store_true", default=OPTIONS.profile,
+                        help="report wall time, CPU time, files visited and YAML parses per check")
+    parser.add_argument("--profile-output", metavar="PATH", default=OPTIONS.profile_output,
+                        help="JSON report of --profile (default: .sigma-cache/profile-<module>.json)")
+    parser.add_argument("--profile-top", metavar="N", type=int, default=OPTIONS.profile_top,
+                        help="entries in the --profile summary (default: 10)")
+    parser.add_argument("--cprofile", metavar="PATH", default=OPTIONS.cprofile,
+                        help="also run under cProfile and write the statistics to PATH")
+    parser.add_argument("--tracemalloc", action="store_true", default=OPTIONS.tracemalloc,
+                        help="also record the peak memory of every profiled entry")
+    parsed, remaining = parser.parse_known_args(argv[1:])
+    OPTIONS.changed_since = parsed.changed_since
+    OPTIONS.jobs = parsed.jobs
+    OPTIONS.profile = parsed.profile
+    OPTIONS.profile_output = parsed.profile_output
+    OPTIONS.profile_top = parsed.profile_top
+    OPTIONS.cprofile = parsed.cprofile
+    OPTIONS.tracemalloc = parsed.tracemalloc
+    return argv[:1] + remaining
@@ -0,0 +1,11 @@
+"""
+Well-known locations inside the repository
+"""
+
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+TESTS_DIR = os.path.join(REPO_ROOT, "tests")
+
+RULE_DIRECTORIES = ["rules", "rules-emerging-threats", "rules-placeholder", "rules-threat-hunting", "rules-compliance"]
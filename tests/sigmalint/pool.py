@@ -0,0 +1,83 @@
+"""
+Process pool for the per-file lint work (-j N)
+
+Work items are split into contiguous shards and mapped in forked worker processes. Large
+read-only state such as the parsed corpus or the bound check methods is inherited through
+the fork (see worker_state()) instead of being pickled for every task, only the items and
+the compact results travel between the processes. Results come back in item order, so the
+merged output does not depend on the number of workers.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Below this many items starting the workers costs more than it saves
+MIN_PARALLEL_ITEMS = 64
+
+# Shards per worker, smaller shards even out files of different sizes
+SHARDS_PER_JOB = 4
+
+_worker_state = None
+
+
+def worker_state():
+    """
+    The 'state' passed to map_sharded(), inside the function it maps
+    """
+    return _worker_state
+
+
+def effective_jobs(jobs: int) -> int:
+    """
+    Number of worker processes for the -j value, 0 means one per CPU
+    """
+    if jobs is None or jobs < 0:
+        return 1
+    if jobs == 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def can_fork() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def shard(items: list, count: int) -> list:
+    """
+    Split items into at most 'count' contiguous, nearly equal parts
+    """
+    count = max(1, min(count, len(items)))
+    size, rest = divmod(len(items), count)
+    shards = []
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < rest else 0)
+        shards.append(items[start:end])
+        start = end
+    return shards
+
+
+def _map_shard(task) -> list:
+    function, items = task
+    return [function(item) for item in items]
+
+
+def map_sharded(function, items: list, jobs: int = 1, state=None) -> list:
+    """
+    Return [function(item) for item in items], computed by up to 'jobs' worker processes.
+    'function' must be a module level function. Runs in this process for a single job, few
+    items or on platforms without fork().
+    """
+    global _worker_state
+    items = list(items)
+    jobs = effective_jobs(jobs)
+    _worker_state = state
+    try:
+        if jobs <= 1 or len(items) < MIN_PARALLEL_ITEMS or not can_fork():
+            return [function(item) for item in items]
+        tasks = [(function, part) for part in shard(items, jobs * SHARDS_PER_JOB)]
+        with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")) as executor:
+            return [result for part in executor.map(_map_shard, tasks) for result in part]
+    finally:
+        _worker_state = None
@@ -0,0 +1,286 @@
+"""
+Cost model of the backend queries of a rule
+
+Backends like Elasticsearch or Splunk turn a rule into a search over an index. Most of its cost
+comes from terms that cannot use the index: leading wildcards ('|contains', '|endswith', values
+starting with '*'), full text keywords and regular expressions. Value modifiers multiply the terms:
+'|windash' searches every dash in 5 variants, '|base64offset' every value in 3. rule_query_cost()
+counts, after these expansions:
+
+    terms               comparisons of the query
+    leading_wildcards   terms starting with a wildcard
+    contains_all        terms of '|all' fields, each one a separate search that must match
+    fanout              terms added by '|windash' and '|base64offset'
+    keywords            full text terms of keyword (list) selections
+    regexes             '|re' values
+    or_width            alternatives of the widest OR of the condition, over all selections
+
+The score of a rule is the sum of these numbers weighted by tests/query-cost.yml, which also holds
+the budgets of the lint stage: a maximum score and maximum metrics, with overrides per rule
+directory, and the rules accepted over budget. SIGMA_LINT_QUERY_COST names another file.
+
+To export the cost of every rule as a table, run from the tests directory:
+# python -m sigmalint.querycost [rule files or directories] [--format csv|json] [-o PATH]
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from collections import namedtuple
+
+import yaml
+
+from .condition import And, ConditionSyntaxError, Identifier, Not, Or, Quantified, pattern_matches
+from .paths import TESTS_DIR
+
+QUERY_COST_PATH = os.environ.get("SIGMA_LINT_QUERY_COST") or os.path.join(TESTS_DIR, "query-cost.yml")
+
+METRICS = ("terms", "leading_wildcards", "contains_all", "fanout", "keywords", "regexes", "or_width")
+
+QueryCost = namedtuple("QueryCost", METRICS + ("score",))
+
+# Variants of each dash of a '|windash' value: - / en dash, em dash, horizontal bar
+WINDASH_VARIANTS = 5
+# Alignments of a '|base64offset' value
+BASE64_OFFSETS = 3
+
+# Dashes replaced by '|windash', as in pySigma
+_WINDASH = re.compile(r"\B[-/]\b")
+
+LEADING_WILDCARD_MODIFIERS = ("contains", "endswith")
+
+_loaded = {}
+
+
+class QueryCostModel:
+    """
+    Weights of the metrics and budgets of the lint stage, from tests/query-cost.yml
+    """
+
+    def __init__(self, weights: dict, budgets: dict, overrides: dict = None, accepted=()):
+        self.weights = {metric: float(weights.get(metric, 0)) for metric in METRICS}
+        self.budgets = dict(budgets)
+        # Path prefix -> budgets replacing some of the defaults, the longest prefix wins
+        self.overrides = {prefix.replace("/", os.sep).rstrip(os.sep): dict(budget)
+                          for prefix, budget in (overrides or {}).items()}
+        # Rule paths whose cost is known, they are reported but do not fail
+        self.accepted = frozenset(path.replace("/", os.sep) for path in accepted)
+
+    @classmethod
+    def compile(cls, data: dict):
+        return cls(data.get("weights") or {}, data.get("budgets") or {}, data.get("directories") or {},
+                   data.get("accepted") or ())
+
+    @classmethod
+    def from_file(cls, path: str = QUERY_COST_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls.compile(yaml.safe_load(f))
+
+    def score(self, metrics: dict) -> float:
+        return sum(self.weights[metric] * metrics[metric] for metric in METRICS)
+
+    def budget(self, path: str) -> dict:
+        """
+        Budgets of a rule file: 'score' and any of the metrics, missing ones are unlimited
+        """
+        budget = dict(self.budgets)
+        matching = [prefix for prefix in self.overrides if path == prefix or path.startswith(prefix + os.sep)]
+        if matching:
+            budget.update(self.overrides[max(matching, key=len)])
+        return budget
+
+    def over_budget(self, path: str, cost: QueryCost) -> list:
+        """
+        (name, value, limit) of every budget the cost of a rule exceeds
+        """
+        budget = self.budget(path)
+        return [(name, getattr(cost, name), limit) for name, limit in budget.items()
+                if limit is not None and name in QueryCost._fields and getattr(cost, name) > limit]
+
+
+def load_query_cost_model(path: str = QUERY_COST_PATH) -> QueryCostModel:
+    model = _loaded.get(path)
+    if model is None:
+        model = _loaded[path] = QueryCostModel.from_file(path)
+    return model
+
+
+def _expansion(value, modifiers: list) -> int:
+    # Terms one written value turns into
+    count = 1
+    if "windash" in modifiers and isinstance(value, str):
+        count *= WINDASH_VARIANTS ** len(_WINDASH.findall(value))
+    if "base64offset" in modifiers:
+        count *= BASE64_OFFSETS
+    return count
+
+
+def _field_cost(field: str, values) -> tuple:
+    """
+    (metrics, OR width) of one 'field|modifiers: values' entry of a selection
+    """
+    metrics = dict.fromkeys(METRICS, 0)
+    _, *modifiers = str(field).split("|")
+    values = values if isinstance(values, list) else [values]
+    width = 0
+    for value in values:
+        expanded = _expansion(value, modifiers)
+        metrics["terms"] += expanded
+        metrics["fanout"] += expanded - 1
+        if "re" in modifiers:
+            metrics["regexes"] += 1
+        elif any(modifier in LEADING_WILDCARD_MODIFIERS for modifier in modifiers) \
+                or isinstance(value, str) and value.startswith(("*", "?")):
+            metrics["leading_wildcards"] += expanded
+        if "all" in modifiers:
+            metrics["contains_all"] += expanded
+            width = max(width, expanded)
+        else:
+            width += expanded
+    return metrics, width
+
+
+def _add(total: dict, metrics: dict) -> None:
+    for metric in METRICS:
+        total[metric] += metrics[metric]
+
+
+def selection_cost(selection) -> tuple:
+    """
+    (metrics, OR width) of one selection: a map of fields, a list of maps or a list of keywords
+    """
+    metrics = dict.fromkeys(METRICS, 0)
+    if isinstance(selection, dict):
+        # Fields are combined with AND
+        width = 0
+        for field, values in selection.items():
+            field_metrics, field_width = _field_cost(field, values)
+            _add(metrics, field_metrics)
+            width = max(width, field_width)
+        return metrics, width
+    items = selection if isinstance(selection, list) else [selection]
+    width = 0
+    for item in items:
+        if isinstance(item, dict):
+            item_metrics, item_width = selection_cost(item)
+            _add(metrics, item_metrics)
+            width += item_width
+        else:
+            metrics["terms"] += 1
+            metrics["keywords"] += 1
+            width += 1
+    return metrics, width
+
+
+def _or_width(node, widths: dict) -> int:
+    # Alternatives of the widest OR below a node of the condition AST
+    if isinstance(node, Identifier):
+        return widths.get(node.name, 0)
+    if isinstance(node, Quantified):
+        matching = [width for name, width in widths.items() if pattern_matches(node.pattern, name)]
+        if not matching:
+            return 0
+        return sum(matching) if node.quantifier == "1" else max(matching)
+    if isinstance(node, Not):
+        return _or_width(node.operand, widths)
+    if isinstance(node, Or):
+        return sum(_or_width(operand, widths) for operand in node.operands)
+    if isinstance(node, And):
+        return max(_or_width(operand, widths) for operand in node.operands)
+    return 0
+
+
+def rule_query_cost(rule, model: QueryCostModel) -> QueryCost:
+    """
+    Query cost of a rule, see the module documentation for the metrics
+    """
+    metrics = dict.fromkeys(METRICS, 0)
+    detection = rule.get_part("detection")
+    widths = {}
+    if isinstance(detection, dict):
+        for name, selection in detection.items():
+            if name in ("condition", "timeframe"):
+                continue
+            selection_metrics, widths[name] = selection_cost(selection)
+            _add(metrics, selection_metrics)
+    try:
+        conditions = rule.conditions
+    except ConditionSyntaxError:
+        conditions = ()
+    if conditions:
+        metrics["or_width"] = max(_or_width(condition.expression, widths) for condition in conditions)
+    else:
+        metrics["or_width"] = max(widths.values(), default=0)
+    return QueryCost(score=round(model.score(metrics), 2), **metrics)
+
+
+def cost_table(rules, model: QueryCostModel) -> list:
+    """
+    (rule path, QueryCost) of the rules, most expensive first
+    """
+    rows = [(rule.path, rule_query_cost(rule, model)) for rule in rules]
+    rows.sort(key=lambda row: (-row[1].score, row[0]))
+    return rows
+
+
+def _write_table(rows: list, model: QueryCostModel, output_format: str, out) -> None:
+    columns = ("path",) + QueryCost._fields + ("over_budget", "accepted")
+    records = [(path,) + tuple(cost) + (" ".join(name for name, _, _ in model.over_budget(path, cost)),
+                                        path in model.accepted)
+               for path, cost in rows]
+    if output_format == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(records)
+    elif output_format == "json":
+        json.dump([dict(zip(columns, record)) for record in records], out, indent=1)
+        out.write("\n")
+    else:
+        out.write("{:>8} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6}  {}\n".format(
+            "score", "terms", "lead*", "all", "fanout", "kw", "re", "or", "rule"))
+        for record in records:
+            path, cost, over, accepted = record[0], record[1:-2], record[-2], record[-1]
+            out.write("{:>8} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6}  {}{}\n".format(
+                cost[-1], *cost[:-1], path,
+                "  {}over budget: {}".format("accepted " if accepted else "", over) if over else ""))
+
+
+def main(argv: list = None) -> int:
+    from .corpus import RuleCorpus
+    from .paths import REPO_ROOT, RULE_DIRECTORIES
+
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.querycost",
+                                     description="Export the estimated backend query cost of rules")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="rule files or directories relative to the repository (default: all rule directories)")
+    parser.add_argument("--config", default=QUERY_COST_PATH, metavar="PATH",
+                        help="weights and budgets (default: {})".format(QUERY_COST_PATH))
+    parser.add_argument("--format", choices=("text", "csv", "json"), default="text", help="table format")
+    parser.add_argument("-o", "--output", metavar="PATH", help="write the table to PATH instead of stdout")
+    parser.add_argument("--top", type=int, metavar="N", help="only the N most expensive rules")
+    args = parser.parse_args(argv)
+
+    model = load_query_cost_model(args.config)
+    paths = [os.path.relpath(os.path.abspath(path), REPO_ROOT) for path in args.paths]
+    files = [path for path in paths if path.endswith(".yml")]
+    directories = [path for path in paths if not path.endswith(".yml")] or ([] if paths else RULE_DIRECTORIES)
+    rules = list(RuleCorpus.load(directories)) if directories else []
+    rules += list(RuleCorpus.load(only=files)) if files else []
+    rows = cost_table(rules, model)
+    over = sum(1 for path, cost in rows if model.over_budget(path, cost) and path not in model.accepted)
+    if args.top is not None:
+        rows = rows[:args.top]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            _write_table(rows, model, args.format, out)
+    else:
+        _write_table(rows, model, args.format, sys.stdout)
+    print("{} rule(s) over budget, not counting the accepted ones".format(over), file=sys.stderr)
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
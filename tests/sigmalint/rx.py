@@ -0,0 +1,443 @@
+"""
+Compiled validator for Rx schemas (http://rx.codesimply.com/), used for sigma-schema.rx.yml
+
+compile_schema() turns a schema into Python source, one function per schema node, and executes
+it once. The generated functions test the value directly, without looking at the schema again:
+a '//str' becomes an isinstance() test written inline, an '//any' of literal strings becomes one
+lookup in a frozenset, the keys of a '//rec' are constants of the code. A generated function
+returns None for a valid value, or a list of (path, message) for an invalid one. The path is a
+tuple of the map keys and array indexes leading to the error, built only on errors.
+
+Supported are the core types of Rx: //any, //arr, //bool, //def, //fail, //int, //map, //nil,
+//num, //one, //rec, //seq and //str. As in Rx, the 'rest' of a //rec validates the map of the
+keys that are neither required nor optional.
+
+To validate rules and print the throughput, run from the tests directory:
+# python -m sigmalint.rx [rule files or directories] [--source]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import yaml
+
+from .paths import REPO_ROOT
+
+SCHEMA_PATH = os.path.join(REPO_ROOT, "sigma-schema.rx.yml")
+
+CORE_PREFIX = "//"
+
+# Tests of the parameterless types, written inline into the generated code
+_INLINE_TESTS = {
+    "nil": "{0} is None",
+    "def": "{0} is not None",
+    "fail": "False",
+    "bool": "isinstance({0}, bool)",
+    "int": "(isinstance({0}, int) and not isinstance({0}, bool))",
+    "num": "(isinstance({0}, (int, float)) and not isinstance({0}, bool))",
+    "one": "isinstance({0}, (str, int, float))",
+}
+
+_loaded = {}
+
+
+class RxSchemaError(ValueError):
+    """
+    A schema that is not valid Rx or uses a type this compiler does not know
+    """
+
+
+def _kind(value) -> str:
+    if value is None:
+        return "nil"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "num"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, list):
+        return "arr"
+    if isinstance(value, dict):
+        return "map"
+    return type(value).__name__
+
+
+def _prefixed(key, errors: list) -> list:
+    return [((key,) + path, message) for path, message in errors]
+
+
+def format_path(path: tuple) -> str:
+    return "/".join(str(key) for key in path) or "(document)"
+
+
+class RxValidator:
+    """
+    A compiled schema: validate(value) returns the list of (path, message), empty when valid
+    """
+
+    def __init__(self, schema, source: str, function):
+        self.schema = schema
+        self.source = source
+        self._function = function
+
+    def validate(self, value) -> list:
+        return self._function(value) or []
+
+    def is_valid(self, value) -> bool:
+        return self._function(value) is None
+
+
+class _Compiler:
+    """
+    Generates the source of the validator functions of one schema
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.constants = {}
+        self._count = 0
+
+    def constant(self, value) -> str:
+        name = "_C{}".format(len(self.constants))
+        self.constants[name] = value
+        return name
+
+    def message(self, text: str) -> str:
+        # Messages are constants too, no quoting of schema values in the generated code
+        return self.constant(text)
+
+    def _function_name(self) -> str:
+        self._count += 1
+        return "_v{}".format(self._count)
+
+    @staticmethod
+    def _normalize(schema) -> dict:
+        if isinstance(schema, str):
+            schema = {"type": schema}
+        if not isinstance(schema, dict) or not isinstance(schema.get("type"), str):
+            raise RxSchemaError("Not an Rx schema: {!r}".format(schema))
+        if not schema["type"].startswith(CORE_PREFIX):
+            raise RxSchemaError("Unsupported Rx type {}".format(schema["type"]))
+        return schema
+
+    def describe(self, schema) -> str:
+        """
+        Short text of what a schema accepts, for messages
+        """
+        schema = self._normalize(schema)
+        name = schema["type"][len(CORE_PREFIX):]
+        if name == "str" and "value" in schema:
+            return repr(schema["value"])
+        if name == "any" and "of" in schema:
+            return " or ".join(self.describe(alternative) for alternative in schema["of"])
+        if name == "arr":
+            return "arr of {}".format(self.describe(schema["contents"]))
+        return name
+
+    def inline(self, schema, variable: str):
+        """
+        A boolean expression testing 'variable' against the schema, None if it needs a function
+        """
+        schema = self._normalize(schema)
+        name = schema["type"][len(CORE_PREFIX):]
+        parameters = set(schema) - {"type"}
+        if name == "any" and not parameters:
+            return "True"
+        if name == "any" and parameters == {"of"}:
+            literals = self._literal_strings(schema["of"])
+            if literals is not None:
+                return "({0}.__class__ is str and {0} in {1})".format(variable, self.constant(frozenset(literals)))
+            tests = [self.inline(alternative, variable) for alternative in schema["of"]]
+            if all(tests):
+                return "({})".format(" or ".join(tests) or "False")
+            return None
+        if parameters - {"value"}:
+            return None
+        if name == "str":
+            if "value" in schema:
+                return "({0}.__class__ is str and {0} == {1})".format(variable, self.constant(schema["value"]))
+            return "isinstance({}, str)".format(variable)
+        if parameters or name not in _INLINE_TESTS:
+            return None
+        return _INLINE_TESTS[name].format(variable)
+
+    def _literal_strings(self, alternatives):
+        literals = []
+        for alternative in alternatives:
+            alternative = self._normalize(alternative)
+            if alternative["type"] != "//str" or set(alternative) != {"type", "value"}:
+                return None
+            literals.append(alternative["value"])
+        return literals
+
+    def check(self, schema, variable: str, key: str, indent: str) -> list:
+        """
+        Lines validating 'variable' and filing its errors under 'key' into 'errors'
+        """
+        test = self.inline(schema, variable)
+        if test is not None:
+            if test == "True":
+                return []
+            return [indent + "if not {}:".format(test),
+                    indent + "    errors.append((({},), {} + _kind({})))".format(
+                        key, self.message("expected {} but found ".format(self.describe(schema))), variable)]
+        function = self.function(schema)
+        return [indent + "found = {}({})".format(function, variable),
+                indent + "if found:",
+                indent + "    errors.extend(_prefixed({}, found))".format(key)]
+
+    def _length(self, schema, indent: str, what: str) -> list:
+        length = schema.get("length")
+        if not length:
+            return []
+        lines = []
+        if "min" in length:
+            lines += [indent + "if len(value) < {}:".format(int(length["min"])),
+                      indent + "    errors.append(((), {} + str(len(value))))".format(
+                          self.message("expected {} of at least {} but found ".format(what, int(length["min"]))))]
+        if "max" in length:
+            lines += [indent + "if len(value) > {}:".format(int(length["max"])),
+                      indent + "    errors.append(((), {} + str(len(value))))".format(
+                          self.message("expected {} of at most {} but found ".format(what, int(length["max"]))))]
+        return lines
+
+    def _range(self, schema, indent: str) -> list:
+        bounds = schema.get("range") or {}
+        lines = []
+        for bound, operator in (("min", "<"), ("min-ex", "<="), ("max", ">"), ("max-ex", ">=")):
+            if bound in bounds:
+                lines += [indent + "if value {} {}:".format(operator, self.constant(bounds[bound])),
+                          indent + "    errors.append(((), {}))".format(
+                              self.message("value out of range {} {}".format(bound, bounds[bound])))]
+        return lines
+
+    def function(self, schema) -> str:
+        """
+        Generate the function of a schema node and return its name
+        """
+        schema = self._normalize(schema)
+        name = self._function_name()
+        kind = schema["type"][len(CORE_PREFIX):]
+        generate = getattr(self, "_generate_" + kind, None)
+        if generate is None:
+            raise RxSchemaError("Unsupported Rx type {}".format(schema["type"]))
+        body = generate(schema)
+        self.lines += ["", "def {}(value):".format(name)] + ["    " + line for line in body]
+        return name
+
+    def _type_guard(self, test: str, what: str) -> list:
+        return ["if not {}:".format(test),
+                "    return [((), {} + _kind(value))]".format(self.message("expected {} but found ".format(what))),
+                "errors = []"]
+
+    def _simple(self, schema, kind: str) -> list:
+        test = self.inline({"type": schema["type"]}, "value")
+        lines = self._type_guard(test, kind)
+        if "value" in schema:
+            lines += ["if value != {}:".format(self.constant(schema["value"])),
+                      "    errors.append(((), {}))".format(self.message("expected {!r}".format(schema["value"])))]
+        lines += self._range(schema, "")
+        return lines + ["return errors or None"]
+
+    def _generate_any(self, schema) -> list:
+        if "of" not in schema:
+            return ["return None"]
+        calls = []
+        for alternative in schema["of"]:
+            test = self.inline(alternative, "value")
+            calls.append(test if test is not None else "{}(value) is None".format(self.function(alternative)))
+        return ["if {}:".format(" or ".join(calls) or "False"),
+                "    return None",
+                "return [((), {} + _kind(value))]".format(
+                    self.message("expected {} but found ".format(self.describe(schema))))]
+
+    def _generate_fail(self, schema) -> list:
+        return ["return [((), {})]".format(self.message("no value is allowed here"))]
+
+    def _generate_nil(self, schema) -> list:
+        return self._simple(schema, "nil")
+
+    def _generate_def(self, schema) -> list:
+        return self._simple(schema, "a value")
+
+    def _generate_bool(self, schema) -> list:
+        return self._simple(schema, "bool")
+
+    def _generate_int(self, schema) -> list:
+        return self._simple(schema, "int")
+
+    def _generate_num(self, schema) -> list:
+        return self._simple(schema, "num")
+
+    def _generate_one(self, schema) -> list:
+        return self._simple(schema, "a single value")
+
+    def _generate_str(self, schema) -> list:
+        lines = self._type_guard("isinstance(value, str)", "str")
+        if "value" in schema:
+            lines += ["if value != {}:".format(self.constant(schema["value"])),
+                      "    errors.append(((), {}))".format(self.message("expected {!r}".format(schema["value"])))]
+        lines += self._length(schema, "", "a length")
+        return lines + ["return errors or None"]
+
+    def _generate_arr(self, schema) -> list:
+        if "contents" not in schema:
+            raise RxSchemaError("//arr without 'contents'")
+        lines = self._type_guard("isinstance(value, list)", "arr")
+        lines += self._length(schema, "", "a length")
+        check = self.check(schema["contents"], "item", "index", "    ")
+        if check:
+            lines += ["for index, item in enumerate(value):"] + check
+        return lines + ["return errors or None"]
+
+    def _generate_seq(self, schema) -> list:
+        contents = schema.get("contents") or []
+        lines = self._type_guard("isinstance(value, list)", "arr")
+        lines += ["if len(value) < {}:".format(len(contents)),
+                  "    return [((), {} + str(len(value)))]".format(
+                      self.message("expected at least {} entries but found ".format(len(contents))))]
+        for index, entry in enumerate(contents):
+            lines += ["item = value[{}]".format(index)] + self.check(entry, "item", str(index), "")
+        if "tail" in schema:
+            check = self.check(schema["tail"], "item", "index", "    ")
+            if check:
+                lines += ["for index in range({}, len(value)):".format(len(contents)),
+                          "    item = value[index]"] + check
+        else:
+            lines += ["if len(value) > {}:".format(len(contents)),
+                      "    errors.append(((), {} + str(len(value))))".format(
+                          self.message("expected at most {} entries but found ".format(len(contents))))]
+        return lines + ["return errors or None"]
+
+    def _generate_map(self, schema) -> list:
+        if "values" not in schema:
+            raise RxSchemaError("//map without 'values'")
+        lines = self._type_guard("isinstance(value, dict)", "map")
+        check = self.check(schema["values"], "item", "key", "    ")
+        if check:
+            lines += ["for key, item in value.items():"] + check
+        return lines + ["return errors or None"]
+
+    def _generate_rec(self, schema) -> list:
+        required = schema.get("required") or {}
+        optional = schema.get("optional") or {}
+        overlap = set(required) & set(optional)
+        if overlap:
+            raise RxSchemaError("//rec keys both required and optional: {}".format(", ".join(sorted(overlap))))
+        lines = self._type_guard("isinstance(value, dict)", "map")
+        for key, entry in required.items():
+            lines += ["item = value.get({0!r}, _MISSING)".format(key),
+                      "if item is _MISSING:",
+                      "    errors.append((({0!r},), 'required key is missing'))".format(key),
+                      "else:"]
+            lines += self.check(entry, "item", repr(key), "    ") or ["    pass"]
+        for key, entry in optional.items():
+            check = self.check(entry, "item", repr(key), "    ")
+            if check:
+                lines += ["item = value.get({0!r}, _MISSING)".format(key),
+                          "if item is not _MISSING:"] + check
+        keys = self.constant(frozenset(required) | frozenset(optional))
+        rest = schema.get("rest")
+        if rest is None:
+            lines += ["if len(value) > len({0}) or not {0}.issuperset(value):".format(keys),
+                      "    for key in value:",
+                      "        if key not in {}:".format(keys),
+                      "            errors.append(((key,), 'unexpected key'))"]
+        elif self.inline(rest, "value") != "True":
+            lines += ["rest = {{key: item for key, item in value.items() if key not in {}}}".format(keys)]
+            test = self.inline(rest, "rest")
+            if test is not None:
+                lines += ["if not {}:".format(test),
+                          "    errors.append(((), {} + _kind(rest)))".format(
+                              self.message("expected the other keys to be {} but found ".format(self.describe(rest))))]
+            else:
+                lines += ["found = {}(rest)".format(self.function(rest)),
+                          "if found:",
+                          "    errors.extend(found)"]
+        return lines + ["return errors or None"]
+
+
+def compile_schema(schema) -> RxValidator:
+    """
+    Generate and load the validator functions of an Rx schema
+    """
+    compiler = _Compiler()
+    entry = compiler.function(schema)
+    source = "\n".join(compiler.lines + ["", "validate = {}".format(entry), ""])
+    namespace = dict(compiler.constants, _kind=_kind, _prefixed=_prefixed, _MISSING=object())
+    exec(compile(source, "<rx schema>", "exec"), namespace)
+    return RxValidator(schema, source, namespace["validate"])
+
+
+def load_rule_schema(path: str = SCHEMA_PATH) -> RxValidator:
+    validator = _loaded.get(path)
+    if validator is None:
+        with open(path, encoding="utf-8") as f:
+            validator = _loaded[path] = compile_schema(yaml.safe_load(f))
+    return validator
+
+
+def rule_documents(rule) -> list:
+    return [document for document in rule.yaml if document is not None]
+
+
+def measure_throughput(validator: RxValidator, documents: list, min_seconds: float = 0.05) -> float:
+    """
+    Documents validated per second, over at least 'min_seconds'
+    """
+    if not documents:
+        return 0.0
+    validate = validator._function
+    rounds = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_seconds:
+        for document in documents:
+            validate(document)
+        rounds += 1
+        elapsed = time.perf_counter() - start
+    return rounds * len(documents) / elapsed
+
+
+def main(argv: list = None) -> int:
+    from .corpus import RuleCorpus
+    from .paths import RULE_DIRECTORIES
+
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.rx",
+                                     description="Validate rules against sigma-schema.rx.yml")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="rule files or directories relative to the repository (default: all rule directories)")
+    parser.add_argument("--schema", default=SCHEMA_PATH, metavar="PATH", help="Rx schema (default: {})".format(SCHEMA_PATH))
+    parser.add_argument("--source", action="store_true", help="print the generated validator code and exit")
+    args = parser.parse_args(argv)
+
+    validator = load_rule_schema(args.schema)
+    if args.source:
+        print(validator.source)
+        return 0
+    paths = [os.path.relpath(os.path.abspath(path), REPO_ROOT) for path in args.paths]
+    files = [path for path in paths if path.endswith(".yml")]
+    directories = [path for path in paths if not path.endswith(".yml")] or ([] if paths else RULE_DIRECTORIES)
+    rules = list(RuleCorpus.load(directories)) if directories else []
+    rules += list(RuleCorpus.load(only=files)) if files else []
+    invalid = 0
+    documents = []
+    for rule in rules:
+        for document in rule_documents(rule):
+            documents.append(document)
+            errors = validator.validate(document)
+            invalid += bool(errors)
+            for path, message in errors:
+                print("{}: {}: {}".format(rule.path, format_path(path), message))
+    print("{} of {} rule document(s) invalid, {:.0f} rules/s".format(
+        invalid, len(documents), measure_throughput(validator, documents)), file=sys.stderr)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
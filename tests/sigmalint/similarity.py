@@ -0,0 +1,258 @@
+"""
+Near-duplicate rule discovery with MinHash and locality-sensitive hashing
+
+Every rule is reduced to a set of shingles, one per (field, modifiers, value) triple of its
+detection, with values lowercased where Sigma matches case-insensitively. Rules of the same
+logsource whose shingle sets have a Jaccard similarity of at least the threshold are grouped
+into clusters, ranked by size and similarity, as candidates to merge or retire.
+
+MinHash signatures estimate the similarity and LSH banding only pairs up rules that agree in
+at least one band of their signature, so the run stays near-linear in the number of rules.
+Candidate pairs are confirmed with the exact Jaccard similarity of their shingle sets.
+
+Run from the tests directory:
+# python -m sigmalint.similarity --threshold 0.8
+# python -m sigmalint.similarity --json near-duplicates.json
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+
+from .corpus import RuleCorpus
+from .fingerprint import CASE_SENSITIVE_MODIFIERS
+from .paths import RULE_DIRECTORIES
+from .pool import map_sharded, worker_state
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+
+# Universal hashing h(x) = (a * x + b) mod p over 32 bit shingle hashes
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# Weight of missed pairs against extra candidates when choosing the LSH bands. Candidates are
+# verified with the exact similarity, so an extra candidate only costs one set comparison.
+FALSE_NEGATIVE_WEIGHT = 0.95
+
+# Detection keys without field values
+DETECTION_KEYWORDS = ("condition", "timeframe")
+
+
+def _value_shingles(field: str, values) -> list:
+    name, _, modifiers = field.partition("|")
+    case_sensitive = not CASE_SENSITIVE_MODIFIERS.isdisjoint(modifiers.split("|"))
+    shingles = []
+    for value in (values if isinstance(values, list) else [values]):
+        value = "null" if value is None else str(value)
+        if not case_sensitive:
+            value = value.lower()
+        shingles.append("{}|{}={}".format(name, modifiers, value))
+    return shingles
+
+
+def detection_shingles(detection: dict) -> frozenset:
+    """
+    (field, modifiers, value) shingles of a detection, keywords have an empty field name
+    """
+    shingles = set()
+    for name, selection in (detection or {}).items():
+        if name in DETECTION_KEYWORDS:
+            continue
+        for item in (selection if isinstance(selection, list) else [selection]):
+            if isinstance(item, dict):
+                for field, values in item.items():
+                    shingles.update(_value_shingles(str(field), values))
+            else:
+                shingles.update(_value_shingles("", item))
+    return frozenset(shingles)
+
+
+def logsource_key(logsource: dict) -> tuple:
+    logsource = logsource or {}
+    return tuple(str(logsource.get(key) or "").lower() for key in ("product", "category", "service"))
+
+
+def jaccard(first: frozenset, second: frozenset) -> float:
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+class MinHasher:
+    """
+    MinHash signatures of 'num_perm' hash functions, stable for a given seed
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        generator = random.Random(seed)
+        self.num_perm = num_perm
+        self.permutations = [(generator.randrange(1, MERSENNE_PRIME), generator.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, shingles) -> tuple:
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                  for shingle in shingles]
+        if not hashes:
+            return None
+        return tuple(min(((a * value + b) % MERSENNE_PRIME) & MAX_HASH for value in hashes)
+                     for a, b in self.permutations)
+
+
+def _false_positive_area(threshold: float, bands: int, rows: int, steps: int = 100) -> float:
+    # Probability mass of pairs below the threshold that still share a band
+    width = threshold / steps
+    return sum(1 - (1 - ((index + 0.5) * width) ** rows) ** bands for index in range(steps)) * width
+
+
+def _false_negative_area(threshold: float, bands: int, rows: int, steps: int = 100) -> float:
+    # Probability mass of pairs above the threshold that share no band
+    width = (1 - threshold) / steps
+    return sum((1 - (threshold + (index + 0.5) * width) ** rows) ** bands for index in range(steps)) * width
+
+
+def lsh_parameters(threshold: float, num_perm: int) -> tuple:
+    """
+    (bands, rows) with bands * rows <= num_perm minimizing the weighted false positive and
+    false negative probabilities around the threshold
+    """
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            error = ((1 - FALSE_NEGATIVE_WEIGHT) * _false_positive_area(threshold, bands, rows)
+                     + FALSE_NEGATIVE_WEIGHT * _false_negative_area(threshold, bands, rows))
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def _signature_task(shingles) -> tuple:
+    return worker_state().signature(shingles)
+
+
+class SimilarityIndex:
+    """
+    LSH index of rule signatures, bucketed per logsource and band
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        self.keys = []
+        self.shingles = []
+        self._buckets = {}
+
+    def add_all(self, items, jobs: int = 1) -> None:
+        """
+        Add (key, logsource, detection) triples, signatures are computed by 'jobs' processes
+        """
+        items = [(key, logsource_key(logsource), detection_shingles(detection)) for key, logsource, detection in items]
+        signatures = map_sharded(_signature_task, [shingles for _, _, shingles in items], jobs, state=self.hasher)
+        for (key, source, shingles), signature in zip(items, signatures):
+            self._add(key, source, shingles, signature)
+
+    def _add(self, key, source: tuple, shingles: frozenset, signature: tuple) -> None:
+        if signature is None:
+            return
+        position = len(self.keys)
+        self.keys.append(key)
+        self.shingles.append(shingles)
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            self._buckets.setdefault((source, band, values), []).append(position)
+
+    def candidate_pairs(self) -> set:
+        pairs = set()
+        for positions in self._buckets.values():
+            for index, first in enumerate(positions):
+                for second in positions[index + 1:]:
+                    pairs.add((first, second))
+        return pairs
+
+    def similar_pairs(self) -> list:
+        """
+        (first position, second position, jaccard) of all candidate pairs at or above the threshold
+        """
+        found = []
+        for first, second in sorted(self.candidate_pairs()):
+            similarity = jaccard(self.shingles[first], self.shingles[second])
+            if similarity >= self.threshold:
+                found.append((first, second, similarity))
+        return found
+
+    def clusters(self) -> list:
+        """
+        Connected groups of similar rules as dicts of keys, pairs and mean similarity,
+        largest and most similar first
+        """
+        parent = list(range(len(self.keys)))
+
+        def find(position):
+            while parent[position] != position:
+                parent[position] = parent[parent[position]]
+                position = parent[position]
+            return position
+
+        pairs = self.similar_pairs()
+        for first, second, _ in pairs:
+            parent[find(first)] = find(second)
+        grouped = {}
+        for first, second, similarity in pairs:
+            grouped.setdefault(find(first), []).append((first, second, similarity))
+        clusters = []
+        for cluster_pairs in grouped.values():
+            members = sorted({position for pair in cluster_pairs for position in pair[:2]})
+            clusters.append({
+                "rules": [self.keys[position] for position in members],
+                "similarity": sum(pair[2] for pair in cluster_pairs) / len(cluster_pairs),
+                "pairs": [(self.keys[first], self.keys[second], round(similarity, 3))
+                          for first, second, similarity in sorted(cluster_pairs, key=lambda pair: -pair[2])],
+            })
+        clusters.sort(key=lambda cluster: (-len(cluster["rules"]), -cluster["similarity"], cluster["rules"]))
+        return clusters
+
+
+def near_duplicate_clusters(corpus, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                            jobs: int = 1) -> list:
+    """
+    Clusters of near-duplicate rules of a RuleCorpus, see SimilarityIndex.clusters()
+    """
+    index = SimilarityIndex(threshold, num_perm)
+    index.add_all(((rule.path, rule.get_part("logsource"), rule.get_part("detection"))
+                   for rule in corpus if not rule.is_multipart), jobs)
+    return index.clusters()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.similarity",
+                                     description="Report clusters of rules with nearly the same detection values")
+    parser.add_argument("directories", nargs="*", default=RULE_DIRECTORIES,
+                        help="rule directories relative to the repository root (default: all)")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="minimum Jaccard similarity of two rules (default: {})".format(DEFAULT_THRESHOLD))
+    parser.add_argument("--num-perm", type=int, default=DEFAULT_NUM_PERM,
+                        help="MinHash permutations (default: {})".format(DEFAULT_NUM_PERM))
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="compute the signatures in N worker processes (0: one per CPU)")
+    parser.add_argument("--json", metavar="PATH", help="also write the clusters as JSON to PATH")
+    args = parser.parse_args(argv)
+
+    corpus = RuleCorpus.shared(args.directories, jobs=args.jobs)
+    clusters = near_duplicate_clusters(corpus, args.threshold, args.num_perm, args.jobs)
+    for number, cluster in enumerate(clusters, 1):
+        print("Cluster {}: {} rules, mean similarity {:.2f}".format(number, len(cluster["rules"]), cluster["similarity"]))
+        for path in cluster["rules"]:
+            print("    {}".format(path))
+    print("{} clusters with {} rules out of {} (threshold {})".format(
+        len(clusters), sum(len(cluster["rules"]) for cluster in clusters), len(corpus), args.threshold))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"threshold": args.threshold, "num_perm": args.num_perm, "clusters": clusters}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
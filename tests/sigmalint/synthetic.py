@@ -0,0 +1,152 @@
+"""
+Synthetic rule corpora for benchmarks
+
+A synthetic corpus scales the real rules by a factor: every rule is copied 'scale' times
+with the same shape. The metadata keys, selections, condition, modifiers and value lengths
+stay as they are, while the id, title, file name, field names and values change per copy,
+so no two rules collide in the uniqueness and duplicate checks. Field names are swapped for
+other fields specific to the same logsource in tests/logsource.json, values keep their
+wildcards, punctuation and letter case but get other letters and digits.
+
+Copies are generated deterministically from a seed.
+"""
+
+import json
+import os
+import random
+import string
+import uuid
+
+import yaml
+
+from .paths import TESTS_DIR
+from .pool import map_sharded, worker_state
+
+LOGSOURCE_SCHEMA_PATH = os.path.join(TESTS_DIR, "logsource.json")
+
+# Values of these modifiers have a syntax of their own and are copied unchanged
+VERBATIM_MODIFIERS = frozenset(["re", "cidr", "base64", "base64offset"])
+
+DETECTION_KEYWORDS = ("condition", "timeframe")
+
+_Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def logsource_fields(path: str = LOGSOURCE_SCHEMA_PATH) -> dict:
+    """
+    (product, category, service) -> tuple of the field names specific to that logsource.
+    The common fields of a product (EventID, Provider_Name, ...) are left out, checks rely
+    on their meaning. Rules without product use the 'empty' product.
+    """
+    with open(path, encoding="utf-8") as f:
+        schema = json.load(f)
+    fields = {}
+    for section in ("legit", "addon"):
+        for product, sources in schema.get(section, {}).items():
+            common = set(sources.get("commun", []))
+            for kind in ("category", "service"):
+                for name, names in sources.get(kind, {}).items():
+                    key = (product, name, None) if kind == "category" else (product, None, name)
+                    known = fields.setdefault(key, [])
+                    known += [field for field in names if field not in common and field not in known]
+    return {key: tuple(names) for key, names in fields.items()}
+
+
+def _substitution(generator: random.Random) -> dict:
+    # One random permutation per character class keeps case and digits in place
+    table = {}
+    for alphabet in (string.ascii_lowercase, string.ascii_uppercase, string.digits):
+        shuffled = list(alphabet)
+        generator.shuffle(shuffled)
+        table.update(str.maketrans(alphabet, "".join(shuffled)))
+    return table
+
+
+class RuleSynthesizer:
+    """
+    Generates same-shaped copies of parsed rules
+    """
+
+    def __init__(self, fields: dict = None, seed: int = 1):
+        self.fields = logsource_fields() if fields is None else fields
+        self.seed = seed
+
+    def _known_fields(self, logsource) -> tuple:
+        if not isinstance(logsource, dict):
+            return ()
+        product = logsource.get("product") or "empty"
+        return self.fields.get((product, logsource.get("category"), logsource.get("service")), ())
+
+    def synthesize(self, rule, copy: int) -> tuple:
+        """
+        (relative path, text) of copy number 'copy' of a Rule
+        """
+        generator = random.Random("{}:{}:{}".format(self.seed, rule.path, copy))
+        table = _substitution(generator)
+        known = self._known_fields(rule.get_part("logsource"))
+        renamed = list(known)
+        generator.shuffle(renamed)
+        field_names = dict(zip(sorted(known), renamed))
+
+        def value(item, verbatim):
+            if isinstance(item, str) and not verbatim:
+                return item.translate(table)
+            if isinstance(item, list):
+                return [value(element, verbatim) for element in item]
+            return item
+
+        def fields(selection):
+            copied = {}
+            for field, values in selection.items():
+                name, *modifiers = str(field).split("|")
+                verbatim = not VERBATIM_MODIFIERS.isdisjoint(modifiers)
+                copied["|".join([field_names.get(name, name)] + modifiers)] = value(values, verbatim)
+            return copied
+
+        def detection(part):
+            copied = {}
+            for name, selection in part.items():
+                if name in DETECTION_KEYWORDS:
+                    copied[name] = selection
+                elif isinstance(selection, dict):
+                    copied[name] = fields(selection)
+                elif isinstance(selection, list):
+                    copied[name] = [fields(item) if isinstance(item, dict) else value(item, False)
+                                    for item in selection]
+                else:
+                    copied[name] = value(selection, False)
+            return copied
+
+        documents = []
+        for document in rule.yaml:
+            if not isinstance(document, dict):
+                documents.append(document)
+                continue
+            copied = dict(document)
+            if "id" in copied:
+                copied["id"] = str(uuid.UUID(int=generator.getrandbits(128), version=4))
+            if isinstance(copied.get("title"), str):
+                copied["title"] = "{} {}".format(copied["title"], copy)
+            if isinstance(copied.get("detection"), dict):
+                copied["detection"] = detection(copied["detection"])
+            documents.append(copied)
+
+        stem, extension = os.path.splitext(rule.path)
+        text = yaml.dump_all(documents, Dumper=_Dumper, sort_keys=False, allow_unicode=True)
+        return "{}_{}{}".format(stem, copy, extension), text
+
+
+def _synthesize_task(task) -> tuple:
+    synthesizer, rules = worker_state()
+    position, copy = task
+    return synthesizer.synthesize(rules[position], copy)
+
+
+def synthesize_corpus(corpus, scale: int, synthesizer: RuleSynthesizer = None, jobs: int = 1) -> list:
+    """
+    (relative path, text) of 'scale' copies of every rule of a RuleCorpus, for RuleCorpus.from_texts()
+    """
+    synthesizer = synthesizer or RuleSynthesizer()
+    rules = list(corpus)
+    tasks = [(position, copy) for copy in range(scale) for position in range(len(rules))]
+    return map_sharded(_synthesize_task, tasks, jobs, state=(synthesizer, rules))
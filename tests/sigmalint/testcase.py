@@ -0,0 +1,177 @@
+"""
+unittest base class shared by the rule lint modules
+"""
+
+import importlib
+import os
+import sys
+import unittest
+
+from .cache import FindingsCache
+from .changes import changed_lint_inputs, changed_rule_paths
+from .corpus import RuleCorpus
+from .engine import CheckEngine, CheckRegistry
+from .index import RuleIndex
+from .instrument import VisitCountingCorpus, active_profiler, stage, start_profiler, timed_registry
+from .options import OPTIONS
+from .paths import RULE_DIRECTORIES, TESTS_DIR
+from .pool import map_sharded, worker_state
+
+# Lint modules in the order of the CI workflow
+LINT_MODULES = ("test_logsource", "test_rules")
+
+
+def load_lint_module(name: str):
+    """
+    Import a lint module of the tests directory
+    """
+    if TESTS_DIR not in sys.path:
+        sys.path.insert(0, TESTS_DIR)
+    return importlib.import_module(name)
+
+
+def run_engine(task) -> dict:
+    """
+    Pool task: findings of the checks 'names' on the rule 'path', see CorpusTestCase.run_checks()
+    """
+    engine, corpus = worker_state()
+    path, names = task
+    return engine.run(path, corpus[path], names)
+
+
+class CorpusTestCase(unittest.TestCase):
+    """
+    Loads the shared RuleCorpus and the findings cache of the test module once per class.
+    Per-file checks are the check_<name> methods returning Finding records (see sigmalint.engine).
+    The first run_file_check() call runs all of them in a single traversal per rule, each
+    test method then replays the findings of its own check.
+
+    With --changed-since the corpus only holds the added or modified rules, all of them if the
+    checks changed too (see sigmalint.changes). Corpus-wide checks then compare them against
+    unchanged_rules(), entries of the persisted RuleIndex.
+
+    Setting lint_corpus checks that corpus instead of the rule files on disk (see
+    sigmalint.benchmark), nothing is read from or written to the caches for it.
+    """
+
+    path_to_rules = RULE_DIRECTORIES
+
+    lint_corpus = None
+
+    @classmethod
+    def setUpClass(cls):
+        module_file = os.path.realpath(sys.modules[cls.__module__].__file__)
+        cache_name = os.path.splitext(os.path.basename(module_file))[0]
+        cls.check_results = None
+        if cls.lint_corpus is not None:
+            cls.corpus = cls.lint_corpus
+            cls.index = RuleIndex.from_corpus(cls.corpus)
+            cls.findings_cache = FindingsCache(cache_name, [module_file], directory=None)
+            return
+        profiler = start_profiler(cache_name)
+        with stage("corpus"):
+            changed = None
+            if OPTIONS.changed_since:
+                inputs = changed_lint_inputs(OPTIONS.changed_since)
+                if inputs:
+                    print("Checking all rules, the checks changed since {}: {}".format(
+                        OPTIONS.changed_since, ", ".join(inputs)))
+                else:
+                    changed = changed_rule_paths(OPTIONS.changed_since, cls.path_to_rules)
+                    print("Checking {} rule file(s) changed since {}".format(len(changed), OPTIONS.changed_since))
+            if changed is not None:
+                cls.corpus = RuleCorpus.shared(cls.path_to_rules, only=changed, jobs=OPTIONS.jobs)
+            else:
+                # Parse every rule file once for the whole session
+                cls.corpus = RuleCorpus.shared(cls.path_to_rules, jobs=OPTIONS.jobs)
+        if profiler is not None:
+            # Worker processes parse out of sight of the YAML counter
+            profiler.stages["corpus"].yaml_parses = cls.corpus.parse_count
+            cls.corpus = VisitCountingCorpus(cls.corpus, profiler)
+        with stage("index"):
+            # Full runs keep the index current for later --changed-since runs
+            cls.index = RuleIndex.shared(cls.path_to_rules, corpus=cls.corpus)
+        with stage("findings cache"):
+            cls.findings_cache = FindingsCache.shared(cache_name, [module_file])
+
+    @classmethod
+    def tearDownClass(cls):
+        with stage("save caches"):
+            # The index covers every rule on disk, also those left out by --changed-since
+            cls.findings_cache.save(cls.index)
+
+    def run(self, result=None):
+        profiler = active_profiler()
+        if profiler is None:
+            return super().run(result)
+        with profiler.test(self.id()):
+            return super().run(result)
+
+    def unchanged_rules(self) -> list:
+        """
+        Index entries of the rules outside the corpus, empty unless running with --changed-since
+        """
+        if len(self.corpus) == len(self.index):
+            return []
+        return self.index.excluding(self.corpus.paths())
+
+    def registered_checks(self) -> CheckRegistry:
+        """
+        The registered check_<name> methods, run by run_checks()
+        """
+        return CheckRegistry.from_object(self)
+
+    def run_checks(self) -> dict:
+        """
+        Check name -> rule path -> findings of every registered check, computed once per class.
+        Cache misses are computed by OPTIONS.jobs worker processes and merged in corpus order.
+        """
+        if self.check_results is None:
+            profiler = active_profiler()
+            registry = self.registered_checks()
+            if profiler is not None:
+                prefix = "{}.".format(profiler.name)
+                registry = timed_registry(registry, profiler.checks, prefix)
+            engine = CheckEngine(registry)
+            results = {name: {} for name in registry.names()}
+            pending = []
+            for rule in self.corpus:
+                found, missing = self.findings_cache.cached_engine_findings(registry, rule)
+                for name, findings in found.items():
+                    results[name][rule.path] = findings
+                if missing:
+                    pending.append((rule.path, tuple(missing)))
+            computed = map_sharded(run_engine, pending, OPTIONS.jobs, state=(engine, self.corpus))
+            for (path, names), found in zip(pending, computed):
+                if profiler is not None:
+                    profiler.count_files(prefix, names)
+                self.findings_cache.store_engine_findings(registry, self.corpus[path], found)
+                for name, findings in found.items():
+                    results[name][path] = findings
+            type(self).check_results = results
+        return self.check_results
+
+    def rule_findings(self, check, rule) -> list:
+        """
+        Findings of one registered check on one rule
+        """
+        return self.run_checks()[check.__name__][rule.path]
+
+    def run_file_check(self, check, context: str = "") -> list:
+        """
+        Run a per-file check over the corpus, print its messages and return the faulty entries.
+        'context' is only used for checks that are not registered check_<name> methods.
+        """
+        results = self.run_checks().get(check.__name__)
+        faulty = []
+        for rule in self.corpus:
+            if results is not None:
+                findings = results[rule.path]
+            else:
+                findings = self.findings_cache.findings(check, rule, context)
+            for finding in findings:
+                if finding.message:
+                    print(finding.message)
+                if finding.entry is not None:
+                    faulty.append(finding.entry)
+        return faulty
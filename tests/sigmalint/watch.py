@@ -0,0 +1,392 @@
+"""
+Watch mode: re-lint rule files as they are saved
+
+The daemon loads the lint modules once, with the parsed corpus and the uniqueness facts of
+every rule (id, title, file name, detection fingerprint) resident in memory. Each saved rule
+file is parsed again and run through the per-file checks of all modules in one traversal,
+then compared against the resident facts instead of the whole corpus, which takes a few
+milliseconds. Removed files are dropped from the indexes.
+
+The rule directories are watched with inotify on Linux, elsewhere they are polled. On exit
+the rule index and the findings of the linted files are saved to the caches, so the next
+full run or --changed-since run starts warm.
+
+Run from the tests directory:
+# python -m sigmalint.watch
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+import yaml
+from colorama import Fore, init
+
+from .corpus import Rule, parse_rule_text, yield_rule_file_paths
+from .engine import CheckEngine
+from .index import index_entry
+from .options import OPTIONS
+from .paths import REPO_ROOT
+from .testcase import LINT_MODULES, CorpusTestCase, load_lint_module
+
+# Editors save in several steps, events this close together are linted once
+DEBOUNCE_SECONDS = 0.02
+
+POLL_SECONDS = 0.5
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Returned by a watcher when it lost track of the changes
+RESCAN = "*"
+
+
+def _unique_keys(entry) -> dict:
+    # Normalized as in the corpus-wide tests of test_rules.py
+    return {
+        "id": entry.id.lower() if isinstance(entry.id, str) and len(entry.id) == 36 else None,
+        "title": entry.title.lower().rstrip() if isinstance(entry.title, str) else None,
+        "filename": entry.filename,
+        "fingerprint": entry.fingerprint,
+    }
+
+
+UNIQUE_MESSAGES = {
+    "id": Fore.YELLOW + "Rule {} has the same 'id' as {}. Ids have to be unique.",
+    "title": Fore.RED + "Rule {} has an already used title in {}.",
+    "filename": Fore.YELLOW + "Rule {} is a duplicate file name of {}.",
+    "fingerprint": Fore.YELLOW + "Rule {} has exactly the same detection logic as {}.",
+}
+
+
+class UniquenessIndex:
+    """
+    Value -> rule paths for every fact that has to be unique across the corpus
+    """
+
+    def __init__(self, entries=()):
+        self._keys = {}
+        self._paths = {kind: {} for kind in UNIQUE_MESSAGES}
+        for entry in entries:
+            self.put(entry)
+
+    def put(self, entry) -> None:
+        self.discard(entry.path)
+        keys = _unique_keys(entry)
+        self._keys[entry.path] = keys
+        for kind, value in keys.items():
+            if value is not None:
+                self._paths[kind].setdefault(value, set()).add(entry.path)
+
+    def discard(self, path: str) -> None:
+        for kind, value in self._keys.pop(path, {}).items():
+            paths = self._paths[kind].get(value)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._paths[kind][value]
+
+    def clashes(self, entry) -> dict:
+        """
+        Kind -> sorted paths of other rules sharing that fact with 'entry'
+        """
+        found = {}
+        for kind, value in _unique_keys(entry).items():
+            others = self._paths[kind].get(value, set()) - {entry.path} if value is not None else ()
+            if others:
+                found[kind] = sorted(others)
+        return found
+
+
+class InotifyWatcher:
+    """
+    Rule file changes below some directories, from the Linux inotify API
+    """
+
+    def __init__(self, directories: list):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}
+        for directory in directories:
+            self._watch_tree(directory)
+
+    def _watch_tree(self, directory: str) -> list:
+        # Returns the rule files found, a directory moved into place already holds some
+        found = []
+        for dirpath, _, files in os.walk(directory):
+            descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if descriptor < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", dirpath)
+            self._directories[descriptor] = dirpath
+            found += [os.path.join(dirpath, file) for file in files if file.endswith(".yml")]
+        return found
+
+    def changes(self, timeout: float = None) -> set:
+        """
+        Paths of the rule files changed, created or removed, waiting up to 'timeout' seconds
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0"))
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.add(RESCAN)
+                continue
+            directory = self._directories.get(descriptor)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._directories[descriptor]
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self._watch_tree(path))
+                elif mask & IN_MOVED_FROM:
+                    changed.add(RESCAN)
+            elif path.endswith(".yml"):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Rule file changes found by comparing size and mtime every 'interval' seconds
+    """
+
+    def __init__(self, directories: list, root: str = REPO_ROOT, interval: float = POLL_SECONDS):
+        self.directories = directories
+        self.root = root
+        self.interval = interval
+        self._state = self._scan()
+
+    def _scan(self) -> dict:
+        state = {}
+        for _, abspath in yield_rule_file_paths(self.directories, self.root):
+            try:
+                stat = os.stat(abspath)
+            except FileNotFoundError:
+                continue
+            state[abspath] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def changes(self, timeout: float = None) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic())))
+            state = self._scan()
+            changed = {path for path in state.keys() | self._state.keys() if state.get(path) != self._state.get(path)}
+            self._state = state
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(directories: list, root: str = REPO_ROOT, poll: bool = False):
+    absolute = [os.path.join(root, directory) for directory in directories]
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher([directory for directory in absolute if os.path.isdir(directory)])
+        except (OSError, AttributeError) as error:
+            print(Fore.YELLOW + "inotify is not available ({}), polling the rule directories".format(error))
+    return PollingWatcher(directories, root)
+
+
+class WatchSession:
+    """
+    The lint modules with their corpus, index and findings cache resident in memory
+    """
+
+    def __init__(self, module_names=LINT_MODULES, root: str = REPO_ROOT):
+        # The daemon always holds the whole corpus
+        OPTIONS.changed_since = None
+        self.root = root
+        self.cases = []
+        self.linters = []
+        for name in module_names:
+            module = load_lint_module(name)
+            for case in vars(module).values():
+                if isinstance(case, type) and issubclass(case, CorpusTestCase) and case.__module__ == module.__name__:
+                    case.setUpClass()
+                    registry = case().registered_checks()
+                    self.cases.append(case)
+                    self.linters.append((case, registry, CheckEngine(registry)))
+        self.corpus = self.cases[0].corpus
+        self.index = self.cases[0].index
+        self.directories = self.cases[0].path_to_rules
+        self.uniques = UniquenessIndex(self.index)
+
+    def lint(self, abspath: str) -> int:
+        """
+        Check one rule file against the resident corpus, print the findings and return their number
+        """
+        started = time.perf_counter()
+        path = os.path.relpath(abspath, self.root)
+        try:
+            with open(abspath, encoding="utf-8") as f:
+                text = f.read()
+            stat = os.stat(abspath)
+        except FileNotFoundError:
+            self.forget(path)
+            print("{}: removed".format(path))
+            return 0
+        try:
+            documents = parse_rule_text(text)
+        except yaml.YAMLError as error:
+            print(Fore.RED + "Rule {} is not valid YAML: {}".format(path, error))
+            return 1
+
+        rule = Rule(path, abspath, text, documents)
+        messages = []
+        problems = 0
+        for case, registry, engine in self.linters:
+            try:
+                found = engine.run(path, rule)
+            except Exception as error:
+                messages.append(Fore.RED + "The checks of {} failed on {}: {!r}".format(case.__module__, path, error))
+                problems += 1
+                continue
+            case.findings_cache.store_engine_findings(registry, rule, found)
+            for name, findings in found.items():
+                printed = [finding.message for finding in findings if finding.message]
+                faulty = sum(1 for finding in findings if finding.entry is not None)
+                messages += printed
+                if faulty and not printed:
+                    # Some checks only explain the problem in the assertion of their test
+                    messages.append(Fore.YELLOW + "Rule {} fails {}".format(path, name.replace("check_", "test_", 1)))
+                problems += faulty
+
+        entry = index_entry(rule, stat)
+        for kind, others in self.uniques.clashes(entry).items():
+            for other in others:
+                messages.append(UNIQUE_MESSAGES[kind].format(path, other))
+                problems += 1
+        self.keep(rule, entry)
+
+        for message in messages:
+            print(message)
+        elapsed = (time.perf_counter() - started) * 1000
+        if problems:
+            print(Fore.RED + "{}: {} problem(s) ({:.0f} ms)".format(path, problems, elapsed))
+        else:
+            print(Fore.GREEN + "{}: OK ({:.0f} ms)".format(path, elapsed))
+        return problems
+
+    def keep(self, rule: Rule, entry) -> None:
+        self.corpus.put(rule)
+        self.index.put(entry)
+        self.uniques.put(entry)
+
+    def forget(self, path: str) -> None:
+        self.corpus.discard(path)
+        self.index.discard(path)
+        self.uniques.discard(path)
+
+    def refresh(self, abspath: str) -> None:
+        """
+        Bring the resident corpus and indexes up to date with one file without checking it
+        """
+        path = os.path.relpath(abspath, self.root)
+        try:
+            with open(abspath, encoding="utf-8") as f:
+                text = f.read()
+            stat = os.stat(abspath)
+        except FileNotFoundError:
+            self.forget(path)
+            return
+        try:
+            rule = Rule(path, abspath, text, parse_rule_text(text))
+        except yaml.YAMLError:
+            return
+        self.keep(rule, index_entry(rule, stat))
+
+    def rescan(self) -> list:
+        """
+        Rule files whose size or mtime differ from the index, and indexed files that are gone
+        """
+        changed = []
+        seen = set()
+        for path, abspath in yield_rule_file_paths(self.directories, self.root):
+            seen.add(path)
+            stat = os.stat(abspath)
+            entry = self.index[path] if path in self.index else None
+            if entry is None or entry.mtime_ns != stat.st_mtime_ns or entry.size != stat.st_size:
+                changed.append(abspath)
+        changed += [os.path.join(self.root, entry.path) for entry in self.index if entry.path not in seen]
+        return changed
+
+    def close(self) -> None:
+        for case in self.cases:
+            case.tearDownClass()
+        self.index.save()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmalint.watch",
+                                     description="Lint rule files whenever they are saved")
+    parser.add_argument("--poll", action="store_true", help="poll the rule directories instead of using inotify")
+    parser.add_argument("-j", "--jobs", type=int, default=OPTIONS.jobs, metavar="N",
+                        help="parse the corpus in N worker processes at startup (0: one per CPU)")
+    args = parser.parse_args(argv)
+    init(autoreset=True)
+
+    OPTIONS.jobs = args.jobs
+    # Stop as on Ctrl-C, saving the caches
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    started = time.perf_counter()
+    session = WatchSession()
+    watcher = create_watcher(session.directories, session.root, args.poll)
+    print("Watching {} rules (loaded in {:.1f}s), press Ctrl-C to stop".format(
+        len(session.corpus), time.perf_counter() - started))
+    try:
+        while True:
+            changed = watcher.changes()
+            while True:
+                burst = watcher.changes(DEBOUNCE_SECONDS)
+                if not burst:
+                    break
+                changed |= burst
+            if RESCAN in changed:
+                changed.discard(RESCAN)
+                changed.update(session.rescan())
+            # Removals first, a rule saved in the same burst must not clash with them
+            for path in sorted(changed, key=lambda path: (os.path.exists(path), path)):
+                session.lint(path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        session.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+Offline matching of the Sigma rules of this repository against dict-shaped events
+
+Rules are compiled once into closure trees (see compiler.py) and matched by a RuleSet, or by a
+RoutedRuleSet that only evaluates the rules of the logsource of an event (see routing.py).
+
+To match the events of JSON lines files and print the hits, run from the tests directory:
+# python -m sigmamatch events.jsonl [--rules PATH ...] [--benchmark]
+"""
+
+from .compiler import CompiledRule, RuleCompileError, compile_rule
+from .event import EventView
+from .routing import LogsourceRouter, RoutedRuleSet, Route
+from .ruleset import Hit, RuleSet
+from .values import ValueModifierError
+
+__all__ = ["CompiledRule", "EventView", "Hit", "LogsourceRouter", "Route", "RoutedRuleSet",
+           "RuleCompileError", "RuleSet", "ValueModifierError", "compile_rule"]
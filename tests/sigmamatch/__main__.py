@@ -0,0 +1,127 @@
+"""
+Match events against the rules: python -m sigmamatch EVENTS... [--rules PATH ...] [--benchmark]
+
+Events are matched against the rules of their logsource route (see routing.py), all rules with
+--all-rules. --route-stats prints the events, rules, rules evaluated per event after the literal prefilter
+and hits of each route.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from sigmalint.corpus import RuleCorpus
+from sigmalint.paths import REPO_ROOT, RULE_DIRECTORIES
+
+from .event import EventView
+from .routing import RoutedRuleSet
+from .ruleset import RuleSet
+from .values import expansion_cache_info
+
+
+def read_events(path: str) -> list:
+    """
+    Events of a JSON lines file, or of a file holding one JSON array, '-' is stdin
+    """
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        text = f.read()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def naive_hits(rules, events: list, source: str = None) -> int:
+    """
+    Hits of the conditions without aggregation, every rule of the route of an event (all rules
+    without routing) evaluated for it, without the literal prefilter
+    """
+    hits = 0
+    for event in events:
+        view = EventView(event)
+        for _, search in rules.unfiltered(view, source):
+            if search(view):
+                hits += 1
+    return hits
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sigmamatch",
+                                     description="Match JSON events against the Sigma rules of the repository")
+    parser.add_argument("events", nargs="+", metavar="EVENTS", help="JSON lines file of events, '-' for stdin")
+    parser.add_argument("--rules", nargs="+", metavar="PATH",
+                        help="rule files or directories relative to the repository (default: all rule directories)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="only report the compile time and the events per second, against the same rules without prefilter")
+    parser.add_argument("--all-rules", action="store_true",
+                        help="match every event against all rules instead of the rules of its logsource route")
+    parser.add_argument("--source", metavar="SOURCE",
+                        help="thor.yml source of events without Channel, e.g. 'File:/var/log/auth.log'")
+    parser.add_argument("--route-stats", action="store_true", help="print the events, rules and hits per route")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N", help="match the events N times (default: 1)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    paths = [os.path.relpath(os.path.abspath(path), REPO_ROOT) for path in args.rules or ()]
+    files = [path for path in paths if path.endswith(".yml")]
+    directories = [path for path in paths if not path.endswith(".yml")] or ([] if paths else RULE_DIRECTORIES)
+    ruleset = RuleSet if args.all_rules else RoutedRuleSet
+    corpus = list(RuleCorpus.shared(directories)) if directories else []
+    if files:
+        corpus += list(RuleCorpus.shared(RULE_DIRECTORIES, only=files))
+    rules = ruleset.from_rules(corpus)
+    compiled = time.perf_counter() - start
+    for error in rules.errors:
+        print("Not compiled: {}".format(error), file=sys.stderr)
+
+    events = [event for path in args.events for event in read_events(path)]
+    hits = 0
+    start = time.perf_counter()
+    for round_ in range(max(args.repeat, 1)):
+        for hit in rules.match_events(events, args.source):
+            hits += 1
+            # Repeated rounds only count
+            if not args.benchmark and round_ == 0:
+                print(json.dumps({"event": hit.index, "rule": hit.rule.path, "id": hit.rule.id,
+                                  "title": hit.rule.title, "level": hit.rule.level}))
+    elapsed = time.perf_counter() - start
+    matched = len(events) * max(args.repeat, 1)
+    print("{} rules compiled in {:.2f} s ({} not compiled), {} events matched in {:.2f} s: {:.0f} events/s, {} hits".format(
+        len(rules), compiled, len(rules.errors), matched, elapsed, matched / elapsed if elapsed else 0.0, hits),
+        file=sys.stderr)
+    if args.benchmark:
+        print("{} values expanded with their modifiers, {} expansions reused".format(*expansion_cache_info()),
+              file=sys.stderr)
+        if rules.nodes is not None and rules.nodes.requested:
+            print("{} unique condition nodes of {} compiled without sharing ({:.0%})".format(
+                len(rules.nodes), rules.nodes.requested, len(rules.nodes) / rules.nodes.requested), file=sys.stderr)
+        start = time.perf_counter()
+        indexed = sum(len(rules.match(event, args.source)) for event in events)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        naive = naive_hits(rules, events, args.source)
+        naive_elapsed = time.perf_counter() - start
+        print("Without aggregations: {:.0f} events/s ({} hits), naive per-rule loop {:.0f} events/s ({} hits)".format(
+            len(events) / elapsed if elapsed else 0.0, indexed, len(events) / naive_elapsed if naive_elapsed else 0.0,
+            naive), file=sys.stderr)
+        # Both evaluate the same rules, only the prefilter differs: other hits are a bug, not a speed-up
+        if naive != indexed:
+            print("The prefilter changed the hits ({} instead of {}), no speed-up to report".format(indexed, naive),
+                  file=sys.stderr)
+            return 1
+        print("Speed-up of the prefilter: {:.1f}x".format(naive_elapsed / elapsed if elapsed else 0.0), file=sys.stderr)
+    if args.route_stats and isinstance(rules, RoutedRuleSet):
+        print("{:>8} {:>8} {:>10} {:>8}  {}".format("events", "rules", "evaluated", "hits", "route"), file=sys.stderr)
+        for stats in rules.route_stats():
+            print("{:>8} {:>8} {:>10.1f} {:>8}  {} {}".format(stats.events, stats.rules, stats.rules_per_event, stats.hits,
+                                                            stats.label, ",".join(stats.names)).rstrip(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,491 @@
+"""
+Compile Sigma rules into closure trees
+
+compile_rule() turns the detection of a rule into nested closures, each taking an EventView
+and returning a bool:
+
+    field       one 'field|modifiers: values' entry, the patterns of all values merged by kind
+                into a set of exact values, tuples for startswith/endswith, a list of substrings,
+                single compiled regexes and a PrefixTable of the cidr networks, so a value
+                is tested once per kind
+    selection   a map of fields (AND), a list of maps (OR) or a list of keywords; a key without
+                field, e.g. '|all', searches its values as keywords
+    condition   the AST of sigmalint.condition: and, or, not, '1 of'/'all of' patterns
+
+The closures are built once, matching an event calls them without looking at the rule again.
+With a NodeCache, the nodes of all rules of a rule set form one DAG: a field is keyed on its
+name, modifiers and set of values, a selection or expression on the set of its (shared)
+operands, so identical subexpressions of different rules are compiled once. The result of a
+selection or expression node is kept in EventView.memo, so every node is evaluated at most once
+per event whichever rules evaluate it.
+Conditions with an aggregation ('| count() by ...', '| near ...') are compiled too, their state
+over a stream of events is kept by sigmamatch.ruleset.
+"""
+
+import re
+from collections import namedtuple
+
+from sigmalint.condition import And, ConditionSyntaxError, Identifier, Not, Or, Quantified, THEM, \
+    parse_detection_conditions, pattern_matches, referenced_names
+
+from .networks import PrefixTable
+from .prefilter import expression_atoms, selection_atoms, union_atoms
+from .values import KEYWORD_MODIFIERS, ValueModifierError, keyword_modifiers, value_patterns
+
+# Detection keys that are not search identifiers
+DETECTION_KEYWORDS = ("condition", "timeframe")
+
+# Pattern kinds _text_test() matches
+TEXT_KINDS = ("exact", "startswith", "endswith", "contains", "wildcard", "any")
+
+CompiledCondition = namedtuple("CompiledCondition", ["text", "search", "aggregation", "near", "near_searches", "atoms"])
+CompiledCondition.__doc__ = """
+One condition of a rule: 'search' is the closure of the expression before the pipe,
+'aggregation' the sigmalint.condition.Aggregation node or None. For 'near', 'near' is the
+closure of its expression over the set of search identifiers seen so far and 'near_searches'
+maps these identifiers to their closures. 'atoms' are the (field, kind, literal) triples of which
+the event satisfies one whenever 'search' matches, or None (see prefilter.py).
+"""
+
+
+class RuleCompileError(ValueError):
+    """
+    A rule whose detection cannot be compiled
+    """
+
+    def __init__(self, path: str, message: str):
+        super().__init__("{}: {}".format(path, message))
+        self.path = path
+
+
+class CompiledRule:
+    """
+    A rule ready to match events: its metadata and compiled conditions
+    """
+
+    __slots__ = ("path", "id", "title", "level", "logsource", "conditions", "searches", "search", "aggregating",
+                 "atoms")
+
+    def __init__(self, path: str, metadata: dict, conditions: tuple):
+        self.path = path
+        self.id = metadata.get("id")
+        self.title = metadata.get("title")
+        self.level = metadata.get("level")
+        self.logsource = metadata.get("logsource") if isinstance(metadata.get("logsource"), dict) else {}
+        self.conditions = conditions
+        # Search closures of the conditions without aggregation, any of them is a match
+        self.searches = tuple(condition.search for condition in conditions if condition.aggregation is None)
+        self.search = _any_of(self.searches)
+        self.aggregating = tuple(condition for condition in conditions if condition.aggregation is not None)
+        # Literal atoms of 'search' for the prefilter, None if it has to run for every event
+        self.atoms = union_atoms(condition.atoms for condition in conditions if condition.aggregation is None)
+
+    def __repr__(self):
+        return "CompiledRule({!r})".format(self.path)
+
+    def matches(self, view) -> bool:
+        """
+        Whether one event matches a condition of the rule that has no aggregation
+        """
+        return self.search(view)
+
+
+class NodeCache:
+    """
+    Shared closures of the condition nodes of a rule set, by canonical key
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        # Closure -> number of its node
+        self.ids = {}
+        # Nodes the rules asked for, as many as a compiler without sharing would build
+        self.requested = 0
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def node(self, key, build, memoize: bool = True):
+        """
+        The closure of a node, build() compiling it the first time its key is seen. Unless
+        'memoize' is false, as for fields whose values EventView caches already, the closure
+        memoizes its result per event, so the node is evaluated at most once per event
+        however many rules use it.
+        """
+        self.requested += 1
+        matcher = self.nodes.get(key)
+        if matcher is None:
+            # build() may add the nodes below first
+            matcher = build()
+            number = len(self.nodes) + 1
+            if memoize:
+                matcher = _memoized(number, matcher)
+            self.nodes[key] = matcher
+            self.ids[matcher] = number
+        return matcher
+
+    def identity(self, matcher):
+        """
+        Key of a closure as an operand: its node number, or itself if it is not a node
+        """
+        return self.ids.get(matcher, matcher)
+
+
+def _memoized(slot: int, matcher):
+    def match(view) -> bool:
+        memo = view.memo
+        result = memo.get(slot)
+        if result is None:
+            result = memo[slot] = matcher(view)
+        return result
+    return match
+
+
+def _shared(nodes, key, build, memoize: bool = True):
+    return build() if nodes is None else nodes.node(key, build, memoize)
+
+
+def _combined(nodes, operator: str, matchers: list):
+    """
+    All (operator 'and') or any ('or') of the matchers, a shared node with a NodeCache
+    """
+    combine = _all_of if operator == "and" else _any_of
+    if nodes is None:
+        return combine(matchers)
+    # The operands are nodes themselves, equal subexpressions have the same identity
+    unique = list({nodes.identity(matcher): matcher for matcher in matchers}.values())
+    if len(unique) <= 1:
+        return combine(unique)
+    return nodes.node((operator, frozenset(map(nodes.identity, unique))), lambda: combine(unique))
+
+
+def _always(view) -> bool:
+    return True
+
+
+def _never(view) -> bool:
+    return False
+
+
+def _any_of(matchers: list):
+    matchers = tuple(matchers)
+    if not matchers:
+        return _never
+    if len(matchers) == 1:
+        return matchers[0]
+    if len(matchers) == 2:
+        first, second = matchers
+        return lambda view: first(view) or second(view)
+
+    def match(view) -> bool:
+        for matcher in matchers:
+            if matcher(view):
+                return True
+        return False
+    return match
+
+
+def _all_of(matchers: list):
+    matchers = tuple(matchers)
+    if not matchers:
+        return _always
+    if len(matchers) == 1:
+        return matchers[0]
+    if len(matchers) == 2:
+        first, second = matchers
+        return lambda view: first(view) and second(view)
+
+    def match(view) -> bool:
+        for matcher in matchers:
+            if not matcher(view):
+                return False
+        return True
+    return match
+
+
+def _minimal_needles(needles) -> tuple:
+    # Substrings to search for, shortest first: a needle containing another one is redundant
+    kept = []
+    for needle in sorted(set(needles), key=len):
+        if not any(other in needle for other in kept):
+            kept.append(needle)
+    return tuple(kept)
+
+
+def _text_test(patterns: list):
+    """
+    One test of a lower case value against all text patterns, None if there are none
+    """
+    contained = _minimal_needles(pattern.value for pattern in patterns if pattern.kind == "contains")
+    # Literals containing a needle match whenever it does
+    covered = (lambda text: any(needle in text for needle in contained)) if contained else (lambda text: False)
+    exact = frozenset(pattern.value for pattern in patterns if pattern.kind == "exact" and not covered(pattern.value))
+    starts = tuple(dict.fromkeys(pattern.value for pattern in patterns
+                                 if pattern.kind == "startswith" and not covered(pattern.value)))
+    ends = tuple(dict.fromkeys(pattern.value for pattern in patterns
+                               if pattern.kind == "endswith" and not covered(pattern.value)))
+    wildcards = [pattern.value for pattern in patterns if pattern.kind == "wildcard"]
+    wildcard = None
+    if wildcards:
+        wildcard = wildcards[0] if len(wildcards) == 1 else \
+            re.compile("|".join("(?:{})".format(regex.pattern) for regex in wildcards), re.DOTALL)
+    tests = []
+    if exact:
+        tests.append(exact.__contains__)
+    if starts:
+        tests.append(lambda value: value.startswith(starts))
+    if ends:
+        tests.append(lambda value: value.endswith(ends))
+    if len(contained) == 1:
+        needle = contained[0]
+        tests.append(lambda value: needle in value)
+    elif contained:
+        tests.append(lambda value: any(needle in value for needle in contained))
+    if wildcard is not None:
+        fullmatch = wildcard.fullmatch
+        tests.append(lambda value: fullmatch(value) is not None)
+    if not tests:
+        return None
+    if len(tests) == 1:
+        return tests[0]
+    tests = tuple(tests)
+    return lambda value: any(test(value) for test in tests)
+
+
+def _regex_test(patterns: list):
+    """
+    One test of a value as is against the regex patterns, None if there are none
+    """
+    regexes = tuple(pattern.value.search for pattern in patterns if pattern.kind == "regex")
+    if not regexes:
+        return None
+    if len(regexes) == 1:
+        search = regexes[0]
+        return lambda value: search(value if isinstance(value, str) else str(value)) is not None
+    return lambda value: any(search(value if isinstance(value, str) else str(value)) is not None for search in regexes)
+
+
+def _network_test(patterns: list):
+    """
+    One test of an address against all cidr patterns, None if there are none
+    """
+    networks = PrefixTable((pattern.value, None) for pattern in patterns if pattern.kind == "cidr")
+    return networks.contains if networks else None
+
+
+def patterns_matcher(field: str, patterns: list):
+    """
+    Closure testing whether any value of 'field' matches any of the patterns
+    """
+    kinds = {pattern.kind for pattern in patterns}
+    null = "null" in kinds
+    if "any" in kinds:
+        return lambda view: bool(view.raw[field]) or null
+    text = _text_test(patterns)
+    regex = _regex_test(patterns)
+    network = _network_test(patterns)
+    if text is not None and regex is None and network is None:
+        def match(view) -> bool:
+            values = view.lower[field]
+            if not values:
+                return null
+            for value in values:
+                if text(value):
+                    return True
+            return False
+    elif network is not None and text is None and regex is None:
+        def match(view) -> bool:
+            if not view.raw[field]:
+                return null
+            for address in view.addresses[field]:
+                if network(address):
+                    return True
+            return False
+    elif text is not None or regex is not None or network is not None:
+        def match(view) -> bool:
+            values = view.raw[field]
+            if not values:
+                return null
+            if regex is not None and any(regex(value) for value in values):
+                return True
+            if network is not None and any(network(address) for address in view.addresses[field]):
+                return True
+            return text is not None and any(text(value) for value in view.lower[field])
+    else:
+        def match(view) -> bool:
+            return null and not view.raw[field]
+    return match
+
+
+def compile_field(key: str, values, field_mapping: dict = None, nodes: NodeCache = None):
+    """
+    Closure of one 'field|modifiers: values' entry of a selection map, 'field_mapping' renames
+    the fields of the rule to those of the events
+    """
+    field, *modifiers = str(key).split("|")
+    values = values if isinstance(values, list) else [values]
+    if not field:
+        return _keyword_field(modifiers, values, nodes)
+    if field_mapping:
+        field = field_mapping.get(field, field)
+
+    def build():
+        if "all" in modifiers:
+            return _all_of([patterns_matcher(field, value_patterns(value, modifiers)) for value in values])
+        return patterns_matcher(field, [pattern for value in values for pattern in value_patterns(value, modifiers)])
+    # Not memoized: the values are already cached by the EventView, testing them costs no more than the lookup
+    return _shared(nodes, ("field", field, tuple(modifiers), frozenset(map(repr, values))), build, memoize=False)
+
+
+def _keyword_field(modifiers: list, values: list, nodes: NodeCache = None):
+    # A key without field, e.g. '|all': keywords, with 'all' every one of them in a value of the event
+    modifiers = keyword_modifiers(modifiers)
+
+    def build():
+        if "all" in modifiers:
+            return _all_of([_keywords_matcher(value_patterns(value, modifiers)) for value in values])
+        return _keywords_matcher([pattern for value in values for pattern in value_patterns(value, modifiers)])
+    return _shared(nodes, ("keywords", tuple(modifiers), frozenset(map(repr, values))), build)
+
+
+def _keywords_matcher(patterns: list):
+    """
+    Closure testing whether any value of the event matches any of the text patterns
+    """
+    if any(pattern.kind not in TEXT_KINDS for pattern in patterns):
+        raise ValueModifierError("Keywords only take text patterns, not '{}'".format(
+            next(pattern.kind for pattern in patterns if pattern.kind not in TEXT_KINDS)))
+    test = _text_test(patterns)
+    if test is None:
+        return _always
+
+    def match(view) -> bool:
+        for value in view.keywords():
+            if test(value):
+                return True
+        return False
+    return match
+
+
+def compile_keywords(keywords: list, nodes: NodeCache = None):
+    """
+    Closure of a keyword list: any value of the event contains any keyword
+    """
+    if nodes is not None:
+        return nodes.node(("keywords", frozenset(map(repr, keywords))), lambda: compile_keywords(keywords))
+    return _keywords_matcher([pattern for keyword in keywords for pattern in value_patterns(keyword, KEYWORD_MODIFIERS)])
+
+
+def compile_selection(selection, field_mapping: dict = None, nodes: NodeCache = None):
+    """
+    Closure of a search identifier: a map of fields, a list of maps or keywords, or one keyword
+    """
+    if isinstance(selection, dict):
+        return _combined(nodes, "and", [compile_field(key, values, field_mapping, nodes)
+                                        for key, values in selection.items()])
+    items = selection if isinstance(selection, list) else [selection]
+    maps = [compile_selection(item, field_mapping, nodes) for item in items if isinstance(item, dict)]
+    keywords = [item for item in items if not isinstance(item, dict)]
+    if keywords:
+        maps.append(compile_keywords(keywords, nodes))
+    return _combined(nodes, "or", maps)
+
+
+def _search_names(names, pattern: str) -> list:
+    if pattern.lower() == THEM:
+        # As in pySigma, identifiers starting with '_' are left out of 'them'
+        return [name for name in names if not name.startswith("_")]
+    return [name for name in names if pattern_matches(pattern, name)]
+
+
+def compile_expression(node, lookup, nodes: NodeCache = None):
+    """
+    Closure of a condition AST node, 'lookup(name)' is the closure of a search identifier
+    """
+    if isinstance(node, Identifier):
+        return lookup(node.name)
+    if isinstance(node, Quantified):
+        matchers = [lookup(name) for name in _search_names(lookup.names, node.pattern)]
+        if not matchers:
+            raise KeyError(node.pattern)
+        return _combined(nodes, "or" if node.quantifier == "1" else "and", matchers)
+    if isinstance(node, Not):
+        operand = compile_expression(node.operand, lookup, nodes)
+        key = ("not", nodes.identity(operand)) if nodes is not None else None
+        return _shared(nodes, key, lambda: lambda view: not operand(view))
+    if isinstance(node, And):
+        return _combined(nodes, "and", [compile_expression(operand, lookup, nodes) for operand in node.operands])
+    if isinstance(node, Or):
+        return _combined(nodes, "or", [compile_expression(operand, lookup, nodes) for operand in node.operands])
+    raise TypeError("Unexpected condition node {!r}".format(node))
+
+
+class _Lookup:
+    # Search identifier name -> closure, with the names for patterns
+    def __init__(self, matchers: dict, path: str):
+        self.matchers = matchers
+        self.names = list(matchers)
+        self.path = path
+
+    def __call__(self, name: str):
+        if name not in self.matchers:
+            raise RuleCompileError(self.path, "Condition refers to the unknown search identifier '{}'".format(name))
+        return self.matchers[name]
+
+
+class _SeenLookup(_Lookup):
+    # For 'near': an identifier is true once an event matched it
+    def __call__(self, name: str):
+        super().__call__(name)
+        return lambda seen: name in seen
+
+
+def compile_detection(path: str, detection, field_mapping: dict = None, nodes: NodeCache = None) -> tuple:
+    """
+    CompiledCondition of every condition of a detection section, sharing the nodes of 'nodes'
+    """
+    if not isinstance(detection, dict):
+        raise RuleCompileError(path, "Rule has no detection")
+    try:
+        conditions = parse_detection_conditions(detection)
+    except ConditionSyntaxError as error:
+        raise RuleCompileError(path, str(error))
+    if not conditions:
+        raise RuleCompileError(path, "Rule has no condition")
+    matchers = {}
+    for name, selection in detection.items():
+        if name in DETECTION_KEYWORDS:
+            continue
+        try:
+            matchers[name] = compile_selection(selection, field_mapping, nodes)
+        except ValueModifierError as error:
+            raise RuleCompileError(path, "{}: {}".format(name, error))
+    lookup = _Lookup(matchers, path)
+    atoms = {name: selection_atoms(selection, field_mapping) for name, selection in detection.items()
+             if name in matchers}
+    search_names = lambda pattern: _search_names(lookup.names, pattern)
+    compiled = []
+    for condition in conditions:
+        try:
+            search = compile_expression(condition.expression, lookup, nodes)
+            near = None
+            near_searches = {}
+            aggregation = condition.aggregation
+            if aggregation is not None and aggregation.function == "near":
+                near = compile_expression(aggregation.expression, _SeenLookup(matchers, path))
+                near_searches = {name: matchers[name] for name in referenced_names([aggregation.expression], matchers)}
+        except KeyError as error:
+            raise RuleCompileError(path, "No search identifier matches '{}'".format(error.args[0]))
+        compiled.append(CompiledCondition(condition.text, search, aggregation, near, near_searches,
+                                          expression_atoms(condition.expression, atoms, search_names)))
+    return tuple(compiled)
+
+
+def compile_rule(rule, field_mapping: dict = None, nodes: NodeCache = None) -> CompiledRule:
+    """
+    Compile a sigmalint.corpus.Rule, optionally with its fields renamed to those of the events
+    and its nodes shared with the other rules compiled with 'nodes'
+    """
+    metadata = {key: rule.get_part(key) for key in ("id", "title", "level", "logsource")}
+    return CompiledRule(rule.path, metadata,
+                        compile_detection(rule.path, rule.get_part("detection"), field_mapping, nodes))
@@ -0,0 +1,116 @@
+"""
+Event access for the compiled rules
+
+An EventView wraps one dict-shaped event for the duration of its match. Field values are
+looked up, flattened and lower-cased once per event and shared by all rules testing the field:
+view.raw[field], view.lower[field] and view.addresses[field] (the values that are IP addresses,
+parsed) are dicts filled on first access, view.memo holds the results of the selection and
+expression nodes (see compiler.NodeCache).
+"""
+
+from .networks import parse_address
+
+_MISSING = object()
+
+
+def _scalars(value) -> tuple:
+    # Non-null values of a field, lists flattened one level
+    if isinstance(value, (list, tuple)):
+        return tuple(item for item in value if item is not None)
+    return () if value is None else (value,)
+
+
+def _text(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value if isinstance(value, str) else str(value)
+
+
+def lookup(event: dict, field: str):
+    """
+    Value of a field, nested events are searched with 'a.b' for event["a"]["b"]
+    """
+    value = event.get(field, _MISSING)
+    if value is _MISSING and "." in field:
+        value = event
+        for key in field.split("."):
+            if not isinstance(value, dict) or key not in value:
+                return _MISSING
+            value = value[key]
+    return value
+
+
+class _RawValues(dict):
+    # field -> non-null values of the field, empty when it is missing or null
+    __slots__ = ("event",)
+
+    def __init__(self, event: dict):
+        super().__init__()
+        self.event = event
+
+    def __missing__(self, field: str) -> tuple:
+        value = lookup(self.event, field)
+        values = self[field] = () if value is _MISSING else _scalars(value)
+        return values
+
+
+class _LowerValues(dict):
+    # field -> the non-null values of the field as lower case text
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: _RawValues):
+        super().__init__()
+        self.raw = raw
+
+    def __missing__(self, field: str) -> tuple:
+        values = self[field] = tuple(_text(value).lower() for value in self.raw[field])
+        return values
+
+
+class _Addresses(dict):
+    # field -> the values of the field that are IP addresses, as ipaddress objects
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: _RawValues):
+        super().__init__()
+        self.raw = raw
+
+    def __missing__(self, field: str) -> tuple:
+        addresses = self[field] = tuple(address for address in map(parse_address, self.raw[field])
+                                        if address is not None)
+        return addresses
+
+
+class EventView:
+    """
+    Cached per-field views of one event: its values as is, as lower case text and as addresses
+    """
+
+    __slots__ = ("event", "raw", "lower", "addresses", "memo", "_keywords")
+
+    def __init__(self, event: dict):
+        self.event = event
+        self.raw = _RawValues(event)
+        self.lower = _LowerValues(self.raw)
+        self.addresses = _Addresses(self.raw)
+        # Number of a node -> its result for this event
+        self.memo = {}
+        self._keywords = None
+
+    def keywords(self) -> tuple:
+        """
+        Lower case text of all values of the event, for keyword searches
+        """
+        if self._keywords is None:
+            found = []
+            pending = [self.event]
+            while pending:
+                value = pending.pop()
+                if isinstance(value, dict):
+                    pending.extend(value.values())
+                elif isinstance(value, (list, tuple)):
+                    pending.extend(value)
+                elif value is not None:
+                    found.append(_text(value).lower())
+            self._keywords = tuple(found)
+        return self._keywords
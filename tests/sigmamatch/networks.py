@@ -0,0 +1,78 @@
+"""
+IP networks of '|cidr' values, matched with one lookup per address
+
+A PrefixTable holds networks, each with an owner: per IP version and prefix length in use, a
+dict of the network prefixes, the network address without its host bits. This is a binary
+trie collapsed to its populated levels: lookup() shifts the address to each of these prefix
+lengths and probes the dict, returning the owners of all networks containing the address,
+however many networks there are. Rules use a handful of prefix lengths (/8, /12, /16, ...),
+so a lookup is a handful of dict probes.
+
+Event values are parsed into addresses once per event and field, see EventView.addresses.
+"""
+
+import ipaddress
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+def parse_address(value):
+    """
+    The IPv4Address or IPv6Address of an event value, None if it is not an address
+    """
+    try:
+        return ipaddress.ip_address(value if isinstance(value, str) else str(value))
+    except ValueError:
+        return None
+
+
+class PrefixTable:
+    """
+    Networks and their owners, by IP version and prefix length
+    """
+
+    __slots__ = ("levels",)
+
+    def __init__(self, networks):
+        # networks: (ipaddress network, owner) pairs
+        found = {}
+        for network, owner in networks:
+            prefix = int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
+            lengths = found.setdefault(network.version, {})
+            lengths.setdefault(network.prefixlen, {}).setdefault(prefix, []).append(owner)
+        # version -> ((host bits, {prefix: owners}), ...), shortest prefixes first
+        self.levels = {}
+        for version, lengths in found.items():
+            bits = ADDRESS_BITS[version]
+            self.levels[version] = tuple((bits - length, {prefix: tuple(owners) for prefix, owners in prefixes.items()})
+                                         for length, prefixes in sorted(lengths.items()))
+
+    def __bool__(self) -> bool:
+        return bool(self.levels)
+
+    def lookup(self, address) -> list:
+        """
+        Owners of the networks containing the address
+        """
+        levels = self.levels.get(address.version)
+        if not levels:
+            return []
+        number = int(address)
+        found = []
+        for host_bits, prefixes in levels:
+            owners = prefixes.get(number >> host_bits)
+            if owners:
+                found.extend(owners)
+        return found
+
+    def contains(self, address) -> bool:
+        """
+        Whether a network contains the address
+        """
+        levels = self.levels.get(address.version)
+        if levels:
+            number = int(address)
+            for host_bits, prefixes in levels:
+                if number >> host_bits in prefixes:
+                    return True
+        return False
@@ -0,0 +1,367 @@
+"""
+Literal prefilter of the compiled rules
+
+Most selections test literal text: a value that equals, starts with, ends with or contains a
+string. Whatever the modifiers, a value matching such a pattern equals, ends with or contains its
+literal, so a rule can only match an event if the lower case value of some field does so for
+one of the literals the rule needs. The compiler derives these atoms, (field, kind, literal)
+triples of which one at least holds in the event whenever the rule matches, from the detection
+and the condition:
+
+    field           its literals or networks, unless a value is a regex, a wildcard in the
+                    middle or null
+    and, all of     the atoms of the operand with the longest shortest literal
+    or, 1 of, list  the atoms of all operands, if all of them have atoms
+    not             none
+
+A Prefilter gathers the atoms of a list of rules into one FieldIndex per field, the field None
+standing for the values searched by keywords, keys without field such as '|all' included:
+
+    exact                   a dict of the values, probed with the value of the event
+    endswith a path         a dict of the last path segments, 'rundll32.exe' for '\\rundll32.exe',
+                            probed with the text after the last '\\' or '/' of the value
+    other literals          an Aho-Corasick automaton the value is scanned with
+    cidr                    a PrefixTable of the networks, looked up with the address of the value
+
+Each value of these fields is looked up once per event, the rules without atoms and those with
+an atom found are evaluated, the others are skipped. Lists of fewer than PREFILTER_MIN_RULES
+rules are evaluated as is.
+
+The automata are built when a rule set is loaded and kept in .sigma-cache/automata.pickle,
+keyed by their literals, so that loading the same rules again unpickles them.
+"""
+
+import os
+from collections import deque
+
+from sigmalint.cache import CACHE_DIR, CACHE_FORMAT, _read_pickle, _write_pickle, cache_enabled, content_digest, files_digest
+from sigmalint.condition import And, Identifier, Not, Or, Quantified
+
+from .networks import PrefixTable
+from .values import KEYWORD_MODIFIERS, ValueModifierError, keyword_modifiers, value_patterns
+
+# Pattern kinds whose value is literal lower case text or a network -> kind of their atom
+ATOM_KINDS = {"exact": "exact", "endswith": "endswith", "startswith": "contains", "contains": "contains", "cidr": "cidr"}
+
+PATH_SEPARATORS = ("\\", "/")
+
+KEYWORDS = None
+
+# Below this many rules, scanning the fields costs more than evaluating the rules
+PREFILTER_MIN_RULES = 16
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton over lower case literals, scan() finds the indexes of those in a text
+    """
+
+    __slots__ = ("literals", "goto", "fail", "outputs")
+
+    def __init__(self, literals: list):
+        self.literals = tuple(literals)
+        goto = [{}]
+        outputs = [()]
+        for index, literal in enumerate(self.literals):
+            state = 0
+            for character in literal:
+                following = goto[state].get(character)
+                if following is None:
+                    following = goto[state][character] = len(goto)
+                    goto.append({})
+                    outputs.append(())
+                state = following
+            outputs[state] += (index,)
+        fail = [0] * len(goto)
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for character, following in goto[state].items():
+                pending.append(following)
+                fallback = fail[state]
+                while fallback and character not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[following] = goto[fallback].get(character, 0)
+                # Literals ending at the fallback state end here too
+                outputs[following] += outputs[fail[following]]
+        self.goto = goto
+        self.fail = fail
+        self.outputs = outputs
+
+    def __getstate__(self):
+        return self.literals, self.goto, self.fail, self.outputs
+
+    def __setstate__(self, state):
+        self.literals, self.goto, self.fail, self.outputs = state
+
+    def scan(self, text: str, found: set) -> None:
+        """
+        Add the indexes of the literals contained in text to found
+        """
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        state = 0
+        for character in text:
+            transitions = goto[state]
+            while character not in transitions and state:
+                state = fail[state]
+                transitions = goto[state]
+            state = transitions.get(character, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+
+
+def union_atoms(atom_sets):
+    """
+    Atoms of alternatives, None if one of them has none
+    """
+    atoms = set()
+    for item in atom_sets:
+        if item is None:
+            return None
+        atoms |= item
+    return frozenset(atoms)
+
+
+def _selectivity(atom) -> int:
+    # Characters of a literal, for a network its prefix bits at about 4 bits a character
+    _, kind, literal = atom
+    return literal.prefixlen // 4 if kind == "cidr" else len(literal)
+
+
+def _best(atom_sets):
+    # Atoms of one AND operand: the most selective, by its least selective atom, then by count
+    best = None
+    for item in atom_sets:
+        if item is None:
+            continue
+        if not item:
+            return item
+        rank = (min(map(_selectivity, item)), -len(item))
+        if best is None or rank > best[0]:
+            best = (rank, item)
+    return best[1] if best else None
+
+
+def _pattern_atoms(field, patterns: list):
+    atoms = set()
+    for pattern in patterns:
+        if pattern.kind not in ATOM_KINDS or pattern.value is None or pattern.value == "":
+            return None
+        atoms.add((field, ATOM_KINDS[pattern.kind], pattern.value))
+    return frozenset(atoms)
+
+
+def field_atoms(key: str, values, field_mapping: dict = None):
+    """
+    Atoms of one 'field|modifiers: values' entry, None if it matches values without a literal
+    """
+    field, *modifiers = str(key).split("|")
+    if not field:
+        # Keywords, as compiled by compiler._keyword_field()
+        field = KEYWORDS
+        modifiers = keyword_modifiers(modifiers)
+    elif field_mapping:
+        field = field_mapping.get(field, field)
+    values = values if isinstance(values, list) else [values]
+    try:
+        if "all" in modifiers:
+            return _best(_pattern_atoms(field, value_patterns(value, modifiers)) for value in values)
+        return _pattern_atoms(field, [pattern for value in values for pattern in value_patterns(value, modifiers)])
+    except ValueModifierError:
+        return None
+
+
+def selection_atoms(selection, field_mapping: dict = None):
+    """
+    Atoms of a search identifier
+    """
+    if isinstance(selection, dict):
+        return _best(field_atoms(key, values, field_mapping) for key, values in selection.items())
+    items = selection if isinstance(selection, list) else [selection]
+    atoms = [selection_atoms(item, field_mapping) for item in items if isinstance(item, dict)]
+    keywords = [item for item in items if not isinstance(item, dict)]
+    if keywords:
+        atoms.append(_pattern_atoms(KEYWORDS, [pattern for keyword in keywords
+                                               for pattern in value_patterns(keyword, KEYWORD_MODIFIERS)]))
+    return union_atoms(atoms)
+
+
+def expression_atoms(node, atoms: dict, search_names):
+    """
+    Atoms of a condition AST node, 'atoms' maps the search identifiers to theirs and
+    'search_names(pattern)' lists the identifiers a quantifier applies to
+    """
+    if isinstance(node, Identifier):
+        return atoms.get(node.name)
+    if isinstance(node, Quantified):
+        operands = [atoms.get(name) for name in search_names(node.pattern)]
+        return union_atoms(operands) if node.quantifier == "1" else _best(operands)
+    if isinstance(node, Not):
+        return None
+    if isinstance(node, And):
+        return _best(expression_atoms(operand, atoms, search_names) for operand in node.operands)
+    if isinstance(node, Or):
+        return union_atoms(expression_atoms(operand, atoms, search_names) for operand in node.operands)
+    return None
+
+
+def automata_version() -> str:
+    return files_digest([os.path.realpath(__file__)], "format={}".format(CACHE_FORMAT))
+
+
+class AutomatonCache:
+    """
+    SHA-256 of the literals of an automaton -> Automaton
+    """
+
+    def __init__(self, directory: str = CACHE_DIR):
+        self.path = os.path.join(directory, "automata.pickle")
+        self.version = automata_version()
+        stored = _read_pickle(self.path) if cache_enabled() else None
+        if stored and stored.get("version") == self.version:
+            self._entries = stored["entries"]
+        else:
+            self._entries = {}
+        self._used = set()
+        self._dirty = False
+
+    def automaton(self, literals: list) -> Automaton:
+        digest = content_digest("\0".join(literals))
+        automaton = self._entries.get(digest)
+        if automaton is None:
+            automaton = self._entries[digest] = Automaton(literals)
+            self._dirty = True
+        self._used.add(digest)
+        return automaton
+
+    def save(self) -> None:
+        # Drop the automata of rule sets that were not loaded this time
+        if not cache_enabled():
+            return
+        if not self._dirty and len(self._used) == len(self._entries):
+            return
+        self._entries = {digest: self._entries[digest] for digest in self._used}
+        _write_pickle(self.path, {"version": self.version, "entries": self._entries})
+        self._dirty = False
+
+
+def _path_suffix(literal: str):
+    # (separator, last segment) of a literal holding a path separator, None otherwise
+    position = max(literal.rfind(separator) for separator in PATH_SEPARATORS)
+    if position < 0:
+        return None
+    return literal[position], literal[position + 1:]
+
+
+class FieldIndex:
+    """
+    The atoms of one field: exact values and path suffixes in dicts, other literals in an automaton,
+    networks in a PrefixTable
+    """
+
+    __slots__ = ("field", "exact", "suffixes", "separators", "automaton", "owners", "networks")
+
+    def __init__(self, field, atoms: dict, automata: AutomatonCache = None):
+        # atoms: (kind, literal) -> positions of the pairs needing it
+        self.field = field
+        # value -> positions
+        self.exact = {}
+        # (separator, last segment) -> ((literal, positions), ...)
+        self.suffixes = {}
+        scanned = {}
+        networks = []
+        for (kind, literal), positions in atoms.items():
+            suffix = _path_suffix(literal) if kind == "endswith" else None
+            if kind == "cidr":
+                networks.append((literal, tuple(positions)))
+            elif kind == "exact":
+                self.exact[literal] = tuple(positions)
+            elif suffix is not None:
+                self.suffixes[suffix] = self.suffixes.get(suffix, ()) + ((literal, tuple(positions)),)
+            else:
+                scanned.setdefault(literal, []).extend(positions)
+        self.separators = tuple(sorted({separator for separator, _ in self.suffixes}))
+        build = automata.automaton if automata is not None else Automaton
+        self.automaton = build(list(scanned)) if scanned else None
+        # Positions of the pairs needing each literal of the automaton
+        self.owners = tuple(tuple(positions) for positions in scanned.values())
+        self.networks = PrefixTable(networks) if networks else None
+
+    def probe(self, view, selected: set) -> None:
+        """
+        Add the positions of the pairs with an atom the values of the field satisfy to selected
+        """
+        values = view.keywords() if self.field is KEYWORDS else view.lower[self.field]
+        if not values:
+            return
+        if self.networks is not None:
+            for address in view.addresses[self.field]:
+                for positions in self.networks.lookup(address):
+                    selected.update(positions)
+        exact = self.exact
+        suffixes = self.suffixes
+        automaton = self.automaton
+        found = set()
+        for value in values:
+            if exact:
+                positions = exact.get(value)
+                if positions:
+                    selected.update(positions)
+            for separator in self.separators:
+                entries = suffixes.get((separator, value.rpartition(separator)[2]))
+                if entries:
+                    for literal, positions in entries:
+                        if value.endswith(literal):
+                            selected.update(positions)
+            if automaton is not None:
+                automaton.scan(value, found)
+        for index in found:
+            selected.update(self.owners[index])
+
+
+class Prefilter:
+    """
+    Index of the atoms of (rule, search) pairs, per field
+    """
+
+    def __init__(self, pairs: list, automata: AutomatonCache = None):
+        self.pairs = list(pairs)
+        # Pairs evaluated for every event
+        self.always = []
+        self.fields = {}
+        self.probed = []
+        if len(self.pairs) < PREFILTER_MIN_RULES:
+            return
+        atoms = {}
+        for position, (rule, _) in enumerate(self.pairs):
+            if rule.atoms is None:
+                self.always.append(position)
+                continue
+            for field, kind, literal in rule.atoms:
+                atoms.setdefault(field, {}).setdefault((kind, literal), []).append(position)
+        self.fields = {field: FieldIndex(field, field_atoms, automata) for field, field_atoms in atoms.items()}
+        # Indexes probed for every event: keywords and the nested 'a.b' fields
+        self.probed = [index for field, index in self.fields.items() if field is KEYWORDS or "." in field]
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def select(self, view) -> list:
+        """
+        The pairs to evaluate for one event, in their order
+        """
+        if not self.fields:
+            return self.pairs
+        selected = set(self.always)
+        # Only the fields of the event, most indexed fields are not in a given event
+        fields = self.fields
+        for field in view.event:
+            index = fields.get(field)
+            if index is not None:
+                index.probe(view, selected)
+        for index in self.probed:
+            index.probe(view, selected)
+        pairs = self.pairs
+        return [pairs[position] for position in sorted(selected)]
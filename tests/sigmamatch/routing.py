@@ -0,0 +1,285 @@
+"""
+Logsource routing of events, compiled from tests/thor.yml
+
+thor.yml says which events a logsource stands for. A category is a set of event IDs of the
+source of another logsource, e.g. process_creation_1:
+
+    category: process_creation, product: windows
+    conditions: EventID: 1
+    rewrite: product: windows, service: sysmon    -> 'WinEventLog:Microsoft-Windows-Sysmon/Operational'
+
+while a service is a set of sources, e.g. windows-security: 'WinEventLog:Security'. A
+LogsourceRouter resolves this into Route(name, source, event_id, field_mapping) records,
+event_id None standing for any event of the source. Which entries apply to a rule follows the
+Sigma configurations: every key an entry names (category, product, service) must be in the
+logsource of the rule with the same value.
+
+RoutedRuleSet indexes the compiled rules by (source, event ID). The source of an event is
+'WinEventLog:' and its Channel, or the 'source' passed for the events of a file, which is also
+matched against the 'File:' patterns. An event is only evaluated against the rules of its route,
+events without source against the rules no entry applies to. The rules of routes with
+'fieldmappings' are compiled once more with their fields renamed, each route has its own
+literal prefilter (see prefilter.py). route_stats() counts the events, the rules evaluated for
+them and the hits per route.
+"""
+
+import fnmatch
+import os
+from collections import namedtuple
+
+import yaml
+
+from sigmalint.corpus import RuleCorpus
+from sigmalint.paths import RULE_DIRECTORIES, TESTS_DIR
+
+from .compiler import NodeCache, RuleCompileError, compile_rule
+from .prefilter import AutomatonCache, Prefilter
+from .ruleset import RuleSet
+
+THOR_CONFIG_PATH = os.path.join(TESTS_DIR, "thor.yml")
+
+LOGSOURCE_KEYS = ("category", "product", "service")
+
+# Event fields naming the source and the event ID of Windows events
+CHANNEL_FIELD = "Channel"
+EVENT_ID_FIELD = "EventID"
+WINDOWS_SOURCE_PREFIX = "WinEventLog:"
+
+Route = namedtuple("Route", ["name", "source", "event_id", "field_mapping"])
+
+_loaded = {}
+
+
+def _is_pattern(source: str) -> bool:
+    return any(character in source for character in "*?[")
+
+
+def normalize_event_id(value):
+    """
+    Event IDs compare as int, whether the event holds 4688 or "4688"
+    """
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+class LogsourceRouter:
+    """
+    The logsources of thor.yml, resolved to the sources and event IDs they cover
+    """
+
+    def __init__(self, logsources: dict):
+        self.logsources = dict(logsources)
+        for name, entry in self.logsources.items():
+            unknown = set(entry.get("conditions") or {}) - {EVENT_ID_FIELD}
+            if unknown:
+                raise ValueError("Logsource {} has conditions on {}, only {} is supported".format(
+                    name, ", ".join(sorted(unknown)), EVENT_ID_FIELD))
+        self._routes = {}
+
+    @classmethod
+    def compile(cls, data: dict):
+        return cls(data.get("logsources") or {})
+
+    @classmethod
+    def from_file(cls, path: str = THOR_CONFIG_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls.compile(yaml.safe_load(f))
+
+    @staticmethod
+    def _applies(entry: dict, logsource: dict) -> bool:
+        named = [key for key in LOGSOURCE_KEYS if entry.get(key) is not None]
+        return bool(named) and all(logsource.get(key) == entry[key] for key in named)
+
+    def _sources(self, logsource: dict) -> list:
+        # Sources of the entries listing sources that apply to a logsource
+        return [source for entry in self.logsources.values() if entry.get("sources") and self._applies(entry, logsource)
+                for source in entry["sources"]]
+
+    def routes(self, logsource) -> tuple:
+        """
+        Routes of the events a rule with this logsource applies to, empty if thor.yml has none
+        """
+        if not isinstance(logsource, dict):
+            return ()
+        key = tuple(logsource.get(name) for name in LOGSOURCE_KEYS)
+        routes = self._routes.get(key)
+        if routes is not None:
+            return routes
+        found = []
+        for name, entry in self.logsources.items():
+            if not self._applies(entry, logsource):
+                continue
+            mapping = entry.get("fieldmappings")
+            mapping = tuple(sorted(mapping.items())) if mapping else None
+            conditions = entry.get("conditions") or {}
+            event_ids = conditions.get(EVENT_ID_FIELD)
+            if event_ids is None:
+                event_ids = [None]
+            elif not isinstance(event_ids, list):
+                event_ids = [event_ids]
+            sources = self._sources(entry["rewrite"]) if entry.get("rewrite") else entry.get("sources") or []
+            found += [Route(name, source, normalize_event_id(event_id), mapping)
+                      for source in sources for event_id in event_ids]
+        routes = self._routes[key] = tuple(found)
+        return routes
+
+
+def load_router(path: str = THOR_CONFIG_PATH) -> LogsourceRouter:
+    router = _loaded.get(path)
+    if router is None:
+        router = _loaded[path] = LogsourceRouter.from_file(path)
+    return router
+
+
+def event_source(event: dict):
+    channel = event.get(CHANNEL_FIELD)
+    return WINDOWS_SOURCE_PREFIX + channel if isinstance(channel, str) else None
+
+
+class RouteStats:
+    """
+    Events of one route, its rules, those evaluated for the events and their hits
+    """
+
+    __slots__ = ("source", "event_id", "names", "rules", "events", "touched", "hits")
+
+    def __init__(self, source, event_id, names: tuple, rules: int):
+        self.source = source
+        self.event_id = event_id
+        self.names = names
+        self.rules = rules
+        self.events = 0
+        self.touched = 0
+        self.hits = 0
+
+    @property
+    def label(self) -> str:
+        if self.source is None:
+            return "(no source)"
+        return self.source if self.event_id is None else "{} EventID {}".format(self.source, self.event_id)
+
+    @property
+    def rules_per_event(self) -> float:
+        return self.touched / self.events if self.events else 0.0
+
+
+class RoutedRuleSet(RuleSet):
+    """
+    Compiled rules indexed by the routes of their logsource
+    """
+
+    def __init__(self, rules: list, errors: list, table: dict, unrouted: list, router: LogsourceRouter,
+                 automata: AutomatonCache = None, nodes: NodeCache = None):
+        self.router = router
+        # (source, event ID or None) -> [(route name, CompiledRule)]
+        self.table = table
+        self.unrouted = list(unrouted)
+        self.patterns = sorted({source for source, _ in table if _is_pattern(source)})
+        self._buckets = {}
+        self._stats = {}
+        self._current = None
+        self._automata = automata
+        super().__init__(rules, errors, automata, nodes)
+
+    def _build_prefilters(self, automata: AutomatonCache = None) -> None:
+        # Those of the routes in the table now, those merging File: patterns on first use
+        for source, event_id in list(self.table):
+            if not _is_pattern(source):
+                self._bucket(source, event_id)
+        self._bucket(None, None)
+
+    @classmethod
+    def from_rules(cls, rules, router: LogsourceRouter = None):
+        router = router or load_router()
+        compiled = []
+        errors = []
+        table = {}
+        unrouted = []
+        nodes = NodeCache()
+        for rule in rules:
+            routes = router.routes(rule.get_part("logsource"))
+            variants = {}
+            try:
+                default = compile_rule(rule, nodes=nodes)
+                for route in routes:
+                    variant = variants.get(route.field_mapping)
+                    if variant is None:
+                        variant = variants[route.field_mapping] = \
+                            compile_rule(rule, dict(route.field_mapping), nodes) if route.field_mapping else default
+                    table.setdefault((route.source, route.event_id), []).append((route.name, variant))
+            except RuleCompileError as error:
+                errors.append(error)
+                continue
+            compiled.append(default)
+            if not routes:
+                unrouted.append(default)
+        automata = AutomatonCache()
+        ruleset = cls(compiled, errors, table, unrouted, router, automata, nodes)
+        automata.save()
+        return ruleset
+
+    @classmethod
+    def load(cls, directories: list = None, only: list = None, router: LogsourceRouter = None):
+        return cls.from_rules(RuleCorpus.shared(directories or RULE_DIRECTORIES, only=only), router)
+
+    def _sources(self, source: str) -> list:
+        return [source] + [pattern for pattern in self.patterns
+                           if source.startswith("File:") and fnmatch.fnmatchcase(source, pattern)]
+
+    def _bucket(self, source, event_id):
+        """
+        Stats record and candidate rules of a route, merged once from the table
+        """
+        key = (source, event_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if source is None:
+                entries = [(None, rule) for rule in self.unrouted]
+            else:
+                entries = [entry for name in self._sources(source) for entry in
+                           self.table.get((name, event_id), []) + (self.table.get((name, None), []) if event_id is not None else [])]
+            rules = []
+            seen = set()
+            for _, rule in entries:
+                if id(rule) not in seen:
+                    seen.add(id(rule))
+                    rules.append(rule)
+            names = tuple(sorted({name for name, _ in entries if name}))
+            stats = self._stats[key] = RouteStats(source, event_id, names, len(rules))
+            bucket = self._buckets[key] = (stats, Prefilter([(rule, rule.search) for rule in rules if rule.searches],
+                                                                    self._automata),
+                                           [rule for rule in rules if rule.aggregating])
+        return bucket
+
+    def _route(self, view, source: str = None):
+        # Bucket of the route of an event
+        if source is None:
+            source = event_source(view.event)
+        event_id = normalize_event_id(view.event.get(EVENT_ID_FIELD)) if source is not None else None
+        return self._bucket(source, event_id)
+
+    def unfiltered(self, view, source: str = None) -> list:
+        return self._route(view, source)[1].pairs
+
+    def candidates(self, view, source: str = None) -> tuple:
+        stats, prefilter, aggregating = self._route(view, source)
+        simple = prefilter.select(view)
+        stats.events += 1
+        stats.touched += len(simple) + len(aggregating)
+        self._current = stats
+        return simple, aggregating
+
+    def match_events(self, events, source: str = None):
+        for hit in super().match_events(events, source):
+            self._current.hits += 1
+            yield hit
+
+    def route_stats(self) -> list:
+        """
+        RouteStats of the routes events took, most events first
+        """
+        return sorted((stats for stats in self._stats.values() if stats.events),
+                      key=lambda stats: (-stats.events, stats.label))
@@ -0,0 +1,192 @@
+"""
+A set of compiled rules matched against events
+
+RuleSet.load() compiles the rules of the rule directories once. match() returns the rules an
+event matches, match_events() also evaluates the conditions with an aggregation over a stream
+of events. The events passed to one match_events() call are one time window: 'timeframe' is
+not applied, the caller splits the stream.
+
+    count(field) by group   distinct values of 'field' per value of 'group', count() the events
+    min/max/avg/sum(field)  of the numeric values of 'field'
+    near a and b            the expression over the search identifiers matched so far
+"""
+
+from collections import namedtuple
+
+from sigmalint.corpus import RuleCorpus
+from sigmalint.paths import RULE_DIRECTORIES
+
+from .compiler import NodeCache, RuleCompileError, compile_rule
+from .event import EventView
+from .prefilter import AutomatonCache, Prefilter
+
+Hit = namedtuple("Hit", ["index", "rule"])
+
+_COMPARISONS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "=": lambda a, b: a == b,
+    "==": lambda a, b: a == b,
+}
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _AggregationState:
+    """
+    Running aggregate of one condition, per value of its 'by' field
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.aggregation = condition.aggregation
+        self.groups = {}
+        # Groups whose aggregate became true, each one is reported once
+        self.fired = set()
+        # Search identifiers seen, for 'near'
+        self.seen = set()
+
+    def _update_near(self, view) -> bool:
+        if self.fired:
+            return False
+        for name, search in self.condition.near_searches.items():
+            if name not in self.seen and search(view):
+                self.seen.add(name)
+        if self.condition.search(view):
+            self.groups[None] = True
+        if self.groups and self.condition.near(self.seen):
+            self.fired.add(None)
+            return True
+        return False
+
+    def update(self, view) -> bool:
+        """
+        Account for one event, True when the aggregate condition becomes true for its group
+        """
+        aggregation = self.aggregation
+        if aggregation.function == "near":
+            return self._update_near(view)
+        if not self.condition.search(view):
+            return False
+        group = view.raw[aggregation.group_by] if aggregation.group_by else ()
+        key = group[0] if group else None
+        if key in self.fired:
+            return False
+        state = self.groups.setdefault(key, [])
+        if aggregation.field:
+            state.extend(view.raw[aggregation.field])
+        else:
+            state.append(1)
+        if aggregation.function == "count":
+            value = len(set(map(str, state))) if aggregation.field else len(state)
+        else:
+            numbers = [number for number in map(_number, state) if number is not None]
+            if not numbers:
+                return False
+            value = {"min": min, "max": max, "sum": sum}.get(aggregation.function, lambda n: sum(n) / len(n))(numbers)
+        if _COMPARISONS[aggregation.operator](value, aggregation.value):
+            self.fired.add(key)
+            return True
+        return False
+
+
+class RuleSet:
+    """
+    Compiled rules and the rules that failed to compile
+    """
+
+    def __init__(self, rules: list, errors: list = (), automata: AutomatonCache = None, nodes: NodeCache = None):
+        self.rules = list(rules)
+        self.errors = list(errors)
+        # The condition nodes shared by the rules, if they were compiled together
+        self.nodes = nodes
+        # (rule, search closure) of the rules with a condition without aggregation
+        self._simple = [(rule, rule.search) for rule in self.rules if rule.searches]
+        self._build_prefilters(automata)
+        self._aggregating = [rule for rule in self.rules if rule.aggregating]
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    @classmethod
+    def from_rules(cls, rules):
+        """
+        Compile sigmalint.corpus.Rule objects, collecting the RuleCompileError of the others
+        """
+        compiled = []
+        errors = []
+        nodes = NodeCache()
+        for rule in rules:
+            try:
+                compiled.append(compile_rule(rule, nodes=nodes))
+            except RuleCompileError as error:
+                errors.append(error)
+        automata = AutomatonCache()
+        ruleset = cls(compiled, errors, automata, nodes)
+        automata.save()
+        return ruleset
+
+    @classmethod
+    def load(cls, directories: list = None, only: list = None):
+        """
+        Compile the rules of the rule directories, or only the given rule files
+        """
+        return cls.from_rules(RuleCorpus.shared(directories or RULE_DIRECTORIES, only=only))
+
+    def _build_prefilters(self, automata: AutomatonCache = None) -> None:
+        self._prefilter = Prefilter(self._simple, automata)
+
+    def candidates(self, view, source: str = None) -> tuple:
+        """
+        ((rule, search) pairs, aggregating rules) to evaluate for one event: the rules passing
+        the literal prefilter and all aggregating rules here
+        """
+        return self._prefilter.select(view), self._aggregating
+
+    def unfiltered(self, view, source: str = None) -> list:
+        """
+        (rule, search) pairs an event is matched against before the literal prefilter
+        """
+        return self._simple
+
+    def match(self, event: dict, source: str = None) -> list:
+        """
+        Rules with a condition without aggregation that the event matches
+        """
+        view = EventView(event)
+        simple, _ = self.candidates(view, source)
+        return [rule for rule, search in simple if search(view)]
+
+    def match_events(self, events, source: str = None):
+        """
+        Yield a Hit for every rule matched by an event, aggregations over all the events
+        """
+        states = {}
+        for index, event in enumerate(events):
+            view = EventView(event)
+            simple, aggregating = self.candidates(view, source)
+            for rule, search in simple:
+                if search(view):
+                    yield Hit(index, rule)
+            for rule in aggregating:
+                rule_states = states.get(rule)
+                if rule_states is None:
+                    rule_states = states[rule] = [_AggregationState(condition) for condition in rule.aggregating]
+                for state in rule_states:
+                    if state.update(view):
+                        yield Hit(index, rule)
+                        break
@@ -0,0 +1,255 @@
+"""
+Sigma values and value modifiers
+
+A value of a detection is parsed into parts, literal strings and the wildcards '*' and '?'
+(escaped as '\\*', '\\?' and '\\\\'), and the modifiers of its field are applied in the order
+they are written:
+
+    contains, startswith, endswith      add the wildcards around the value
+    base64, base64offset                encode the value, base64offset in its 3 alignments
+    utf16le/wide, utf16be, utf16        encode the value before base64 (utf16 with a byte order mark)
+    windash                             every '-' or '/' starting a command line flag in 5 variants
+    re (with i, m, s)                   the value is a regular expression
+    cidr                                the value is an IP network
+    all                                 the values of the field must all match, see compiler.py
+
+A key without field name, e.g. '|all', searches its values as keywords: each is contained in a
+value of the event unless other modifiers are given (keyword_modifiers()).
+
+Each modifier is a step of MODIFIER_STEPS expanding every alternative of the value. The expansion
+runs once per (value, modifier chain), rules sharing a value share its patterns, and duplicate
+alternatives are dropped after each step. value_patterns() returns the alternatives a value
+matches as Pattern(kind, value):
+
+    exact, contains, startswith, endswith   lower case literal text
+    wildcard                                compiled pattern matched on the lower case value
+    regex                                   compiled pattern, searched in the value as is
+    cidr                                    ipaddress network
+    any                                     any value that is not null
+    null                                    the field is missing or null
+
+Plain values match without regard to case, as in Sigma.
+"""
+
+import base64
+import functools
+import ipaddress
+import itertools
+import re
+from collections import namedtuple
+
+Pattern = namedtuple("Pattern", ["kind", "value"])
+
+Wildcard = namedtuple("Wildcard", ["symbol"])
+MULTI = Wildcard("*")
+SINGLE = Wildcard("?")
+
+ESCAPE = "\\"
+_SPECIAL = {"*": MULTI, "?": SINGLE}
+
+ENCODINGS = {"utf16le": "utf-16le", "wide": "utf-16le", "utf16be": "utf-16be", "utf16": "utf-16"}
+
+WINDASH_CHARACTERS = ("-", "/", "–", "—", "―")
+# Dashes replaced by 'windash', as in pySigma
+_WINDASH = re.compile(r"\B[-/]\b")
+
+REGEX_FLAGS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL}
+
+# Modifiers that do not transform the value
+FIELD_MODIFIERS = ("all",)
+
+# Modifiers of the values of a keyword list written as a map without field, e.g. '|all'
+KEYWORD_MODIFIERS = ["contains"]
+
+
+class ValueModifierError(ValueError):
+    """
+    A value that its modifiers cannot be applied to
+    """
+
+
+def parse_string(text: str) -> tuple:
+    """
+    Parts of a string value: literal strings and MULTI/SINGLE wildcards
+    """
+    parts = []
+    literal = []
+    index = 0
+    while index < len(text):
+        character = text[index]
+        following = text[index + 1] if index + 1 < len(text) else ""
+        if character == ESCAPE and (following in _SPECIAL or following == ESCAPE):
+            literal.append(following)
+            index += 2
+            continue
+        if character in _SPECIAL:
+            if literal:
+                parts.append("".join(literal))
+                literal = []
+            parts.append(_SPECIAL[character])
+        else:
+            literal.append(character)
+        index += 1
+    if literal:
+        parts.append("".join(literal))
+    return tuple(parts)
+
+
+def _literal(parts: tuple, modifier: str) -> str:
+    if any(isinstance(part, Wildcard) for part in parts):
+        raise ValueModifierError("'{}' cannot encode a value with wildcards".format(modifier))
+    return "".join(parts)
+
+
+def _as_bytes(value, modifier: str) -> bytes:
+    return value if isinstance(value, bytes) else _literal(value, modifier).encode("utf-8")
+
+
+def _base64_offsets(data: bytes) -> list:
+    # The 3 encodings of data at any position of a longer base64 text, as in pySigma
+    start_offsets = (0, 2, 3)
+    end_offsets = (None, -3, -2)
+    return [base64.b64encode(i * b" " + data)[start_offsets[i]:end_offsets[(len(data) + i) % 3]] for i in range(3)]
+
+
+def _windash(parts: tuple) -> list:
+    options = []
+    for part in parts:
+        if isinstance(part, Wildcard):
+            options.append([part])
+            continue
+        pieces = []
+        position = 0
+        for match in _WINDASH.finditer(part):
+            pieces += [[part[position:match.start()]], list(WINDASH_CHARACTERS)]
+            position = match.end()
+        pieces.append([part[position:]])
+        options.append(["".join(choice) for choice in itertools.product(*pieces)])
+    return [tuple(part for part in combination if part != "") for combination in itertools.product(*options)]
+
+
+def _wrap(parts: tuple, before: bool, after: bool) -> tuple:
+    if before and parts[:1] != (MULTI,):
+        parts = (MULTI,) + parts
+    if after and parts[-1:] != (MULTI,):
+        parts = parts + (MULTI,)
+    return parts
+
+
+def _wildcard_regex(parts: tuple):
+    text = "".join(".*" if part is MULTI else "." if part is SINGLE else re.escape(part.lower()) for part in parts)
+    return re.compile(text, re.DOTALL)
+
+
+def _wrap_step(item, modifier: str) -> list:
+    parts = (item.decode("latin-1"),) if isinstance(item, bytes) else item
+    return [_wrap(parts, modifier != "startswith", modifier != "endswith")]
+
+
+def _base64_step(item, modifier: str) -> list:
+    return [base64.b64encode(_as_bytes(item, modifier))]
+
+
+def _base64offset_step(item, modifier: str) -> list:
+    return _base64_offsets(_as_bytes(item, modifier))
+
+
+def _encoding_step(item, modifier: str) -> list:
+    return [item if isinstance(item, bytes) else _literal(item, modifier).encode(ENCODINGS[modifier])]
+
+
+def _windash_step(item, modifier: str) -> list:
+    return [item] if isinstance(item, bytes) else _windash(item)
+
+
+# Value modifier -> step(alternative, modifier) returning the alternatives it expands to
+MODIFIER_STEPS = {
+    "contains": _wrap_step,
+    "startswith": _wrap_step,
+    "endswith": _wrap_step,
+    "base64": _base64_step,
+    "base64offset": _base64offset_step,
+    "windash": _windash_step,
+}
+MODIFIER_STEPS.update((encoding, _encoding_step) for encoding in ENCODINGS)
+
+
+def string_pattern(parts: tuple) -> Pattern:
+    """
+    The cheapest pattern for a string value with wildcards
+    """
+    leading = parts[:1] == (MULTI,)
+    trailing = len(parts) > int(leading) and parts[-1:] == (MULTI,)
+    middle = parts[int(leading):len(parts) - int(trailing)]
+    if any(isinstance(part, Wildcard) for part in middle):
+        return Pattern("wildcard", _wildcard_regex(parts))
+    text = "".join(middle).lower()
+    if leading and trailing or leading and not text:
+        return Pattern("contains", text) if text else Pattern("any", None)
+    if leading:
+        return Pattern("endswith", text)
+    if trailing:
+        return Pattern("startswith", text)
+    return Pattern("exact", text)
+
+
+def keyword_modifiers(modifiers) -> list:
+    """
+    Modifiers of the values of a key without field: keywords, contained in a value of the event
+    unless other modifiers are given
+    """
+    return list(modifiers) if any(modifier not in FIELD_MODIFIERS for modifier in modifiers) else \
+        KEYWORD_MODIFIERS + list(modifiers)
+
+
+def value_patterns(value, modifiers) -> list:
+    """
+    Patterns matching one value of a field with these modifiers, any of them matches
+    """
+    if isinstance(value, bool):
+        value = str(value).lower()
+    elif value is not None and not isinstance(value, str):
+        value = str(value)
+    # The matchers and the prefilter atoms of a value are both derived from its patterns
+    return list(_value_patterns(value, tuple(modifiers)))
+
+
+@functools.lru_cache(maxsize=None)
+def _value_patterns(value, modifiers: tuple) -> tuple:
+    if value is None:
+        return (Pattern("null", None),)
+    if "re" in modifiers:
+        flags = 0
+        for modifier in modifiers:
+            if modifier not in ("re",) + FIELD_MODIFIERS and modifier not in REGEX_FLAGS:
+                raise ValueModifierError("'re' cannot be combined with '{}'".format(modifier))
+            flags |= REGEX_FLAGS.get(modifier, 0)
+        try:
+            return (Pattern("regex", re.compile(value, flags)),)
+        except re.error as error:
+            raise ValueModifierError("Invalid regular expression '{}': {}".format(value, error))
+    if "cidr" in modifiers:
+        try:
+            return (Pattern("cidr", ipaddress.ip_network(value, strict=False)),)
+        except ValueError as error:
+            raise ValueModifierError(str(error))
+
+    # Alternatives: parts tuples, or bytes once encoded, without duplicates after each step
+    alternatives = [parse_string(value)]
+    for modifier in modifiers:
+        if modifier in FIELD_MODIFIERS:
+            continue
+        step = MODIFIER_STEPS.get(modifier)
+        if step is None:
+            raise ValueModifierError("Unknown value modifier '{}'".format(modifier))
+        alternatives = list(dict.fromkeys(expanded for item in alternatives for expanded in step(item, modifier)))
+    return tuple(dict.fromkeys(string_pattern((item.decode("latin-1"),) if isinstance(item, bytes) else item)
+                               for item in alternatives))
+
+
+def expansion_cache_info() -> tuple:
+    """
+    (values expanded with their modifiers, expansions reused from the cache since)
+    """
+    info = _value_patterns.cache_info()
+    return info.currsize, info.hits
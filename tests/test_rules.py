@@ -4,6 +4,19 @@ Checks for noncompliance or common errors on all rules
 
 Run using the command
 # python test_rules.py
+
+To only check the rules added or modified since a git revision (e.g. in a pull request), all rules
+if the checks or their data changed too
+# python test_rules.py --changed-since origin/master
+The unchanged rules are then taken from the index in .sigma-cache/, which only a previous run
+leaves behind: without it (e.g. in a fresh clone) every rule is read and indexed first, which
+takes about as long as a full run. CI keeps .sigma-cache/ between runs for this reason.
+
+To parse and check the rule files in N worker processes (0: one per CPU)
+# python test_rules.py -j N
+
+To report the time, files visited and YAML parses of every check (optionally with --cprofile PATH or --tracemalloc)
+# python test_rules.py --profile
 """
 
 import os
@@ -11,19 +24,37 @@ import unittest
 import yaml
 import re
 import string
-from attackcti import attack_client
 from colorama import init
 from colorama import Fore
 import collections
-
-
-class TestRules(unittest.TestCase):
+import sys
+from sigmalint import CorpusTestCase, Finding
+from sigmalint.cache import content_digest
+from sigmalint.condition import KEYWORDS, ConditionSyntaxError, quantified, referenced_names
+from sigmalint.attack import load_attack_index
+from sigmalint.backtracking import REFERENCE_LENGTH, format_seconds, is_too_slow, rule_cost
+from sigmalint.engine import on_field, on_metadata, on_rule, on_selection
+from sigmalint.filenames import load_filename_convention
+from sigmalint.fingerprint import rule_fingerprint
+from sigmalint.options import parse_args
+from sigmalint.querycost import load_query_cost_model, rule_query_cost
+from sigmalint.rx import format_path, load_rule_schema, rule_documents
+
+
+class TestRules(CorpusTestCase):
 
     @classmethod
     def setUpClass(cls):
         print("Calling get_mitre_data()")
         # Get Current Data from MITRE ATT&CK®
         cls.MITRE_ALL = get_mitre_data()
+        # Cached results of the tag check are only valid for this ATT&CK data
+        cls.MITRE_VERSION = content_digest("\n".join(sorted(cls.MITRE_ALL)))
+        cls.RE_ESCAPE_ALLOW_LIST = create_escape_allow_list()
+        cls.FILENAME_CONVENTION = load_filename_convention()
+        cls.QUERY_COST_MODEL = load_query_cost_model()
+        cls.RX_SCHEMA = load_rule_schema()
+        super().setUpClass()
         print("Catched data - starting tests...")
 
     MITRE_TECHNIQUE_NAMES = [
@@ -36,21 +67,6 @@ class TestRules(unittest.TestCase):
     path_to_rules = ["rules", "rules-emerging-threats", "rules-placeholder", "rules-threat-hunting", "rules-compliance"]
 
     # Helper functions
-    def yield_next_rule_file_path(self, path_to_rules: list) -> str:
-        for path_ in path_to_rules:
-            for root, _, files in os.walk(path_):
-                for file in files:
-                    if file.endswith('.yml'):
-                        yield os.path.join(root, file)
-
-    def get_rule_part(self, file_path: str, part_name: str):
-        yaml_dicts = self.get_rule_yaml(file_path)
-        for yaml_part in yaml_dicts:
-            if part_name in yaml_part.keys():
-                return yaml_part[part_name]
-
-        return None
-
     def get_rule_yaml(self, file_path: str) -> dict:
         data = []
 
@@ -60,12 +76,17 @@ class TestRules(unittest.TestCase):
                 data.append(part)
 
         return data
-    
+
     # Tests
+    # Per-file checks are the check_* methods next to their test. They yield Finding(entry, message)
+    # records which run_file_check() caches per rule content, prints and collects into the faulty list.
+    # The on_* decorators feed a check single parts of the rule instead, all checks share one
+    # traversal per rule (see sigmalint/engine.py).
+
     # def test_confirm_extension_is_yml(self):
         # files_with_incorrect_extensions = []
 
-        # for file in self.yield_next_rule_file_path(self.path_to_rules):
+        # for file, rule in self.corpus.items():
         # file_name_and_extension = os.path.splitext(file)
         # if len(file_name_and_extension) == 2:
         # extension = file_name_and_extension[1]
@@ -77,312 +98,246 @@ class TestRules(unittest.TestCase):
 
     def test_legal_trademark_violations(self):
         # See Issue # https://github.com/SigmaHQ/sigma/issues/1028
-        files_with_legal_issues = []
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            with open(file, 'r', encoding='utf-8') as fh:
-                file_data = fh.read()
-                for tm in self.TRADE_MARKS:
-                    if tm in file_data:
-                        files_with_legal_issues.append(file)
+        files_with_legal_issues = self.run_file_check(self.check_legal_trademark_violations)
 
         self.assertEqual(files_with_legal_issues, [], Fore.RED +
                          "There are rule files which contains a trademark or reference that doesn't comply with the respective trademark requirements - please remove the trademark to avoid legal issues")
 
+    def check_legal_trademark_violations(self, file, rule):
+        for tm in self.TRADE_MARKS:
+            if tm in rule.text:
+                yield Finding(file, None)
+
     def test_optional_tags(self):
-        files_with_incorrect_tags = []
-        tags_pattern = re.compile(
-            r"cve\.\d+\.\d+|attack\.(t\d{4}\.\d{3}|[gts]\d{4})$|attack\.[a-z_]+|car\.\d{4}-\d{2}-\d{3}")
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            tags = self.get_rule_part(file_path=file, part_name="tags")
-            if tags:
-                for tag in tags:
-                    if tags_pattern.match(tag) == None:
-                        print(
-                            Fore.RED + "Rule {} has the invalid tag <{}>".format(file, tag))
-                        files_with_incorrect_tags.append(file)
+        files_with_incorrect_tags = self.run_file_check(self.check_optional_tags)
 
         self.assertEqual(files_with_incorrect_tags, [], Fore.RED +
                          "There are rules with incorrect/unknown MITRE Tags. (please inform us about new tags that are not yet supported in our tests) and check the correct tags here: https://attack.mitre.org/ ")
 
-    def test_confirm_correct_mitre_tags(self):
-        files_with_incorrect_mitre_tags = []
+    @on_metadata("tags")
+    def check_optional_tags(self, file, tags):
+        tags_pattern = re.compile(
+            r"cve\.\d+\.\d+|attack\.(t\d{4}\.\d{3}|[gts]\d{4})$|attack\.[a-z_]+|car\.\d{4}-\d{2}-\d{3}")
+        if tags:
+            for tag in tags:
+                if tags_pattern.match(tag) == None:
+                    yield Finding(file, Fore.RED + "Rule {} has the invalid tag <{}>".format(file, tag))
 
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            tags = self.get_rule_part(file_path=file, part_name="tags")
-            if tags:
-                for tag in tags:
-                    if tag not in self.MITRE_ALL and tag.startswith("attack."):
-                        print(
-                            Fore.RED + "Rule {} has the following incorrect tag {}".format(file, tag))
-                        files_with_incorrect_mitre_tags.append(file)
+    def test_confirm_correct_mitre_tags(self):
+        files_with_incorrect_mitre_tags = self.run_file_check(self.check_confirm_correct_mitre_tags)
 
         self.assertEqual(files_with_incorrect_mitre_tags, [], Fore.RED +
                          "There are rules with incorrect/unknown MITRE Tags. (please inform us about new tags that are not yet supported in our tests) and check the correct tags here: https://attack.mitre.org/ ")
 
+    # Cached results are only valid for this ATT&CK data
+    @on_metadata("tags", context="MITRE_VERSION")
+    def check_confirm_correct_mitre_tags(self, file, tags):
+        if tags:
+            for tag in tags:
+                if tag not in self.MITRE_ALL and tag.startswith("attack."):
+                    yield Finding(file, Fore.RED + "Rule {} has the following incorrect tag {}".format(file, tag))
+
     def test_duplicate_tags(self):
-        files_with_incorrect_mitre_tags = []
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            tags = self.get_rule_part(file_path=file, part_name="tags")
-            if tags:
-                known_tags = []
-                for tag in tags:
-                    if tag in known_tags:
-                        print(
-                            Fore.RED + "Rule {} has the duplicate tag {}".format(file, tag))
-                        files_with_incorrect_mitre_tags.append(file)
-                    else:
-                        known_tags.append(tag)
+        files_with_incorrect_mitre_tags = self.run_file_check(self.check_duplicate_tags)
 
         self.assertEqual(files_with_incorrect_mitre_tags, [], Fore.RED +
                          "There are rules with duplicate tags")
 
+    @on_metadata("tags")
+    def check_duplicate_tags(self, file, tags):
+        if tags:
+            known_tags = []
+            for tag in tags:
+                if tag in known_tags:
+                    yield Finding(file, Fore.RED + "Rule {} has the duplicate tag {}".format(file, tag))
+                else:
+                    known_tags.append(tag)
+
     def test_duplicate_references(self):
-        files_with_duplicate_references = []
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            references = self.get_rule_part(file_path=file, part_name="references")
-            if references:
-                known_references = []
-                for reference in references:
-                    if reference in known_references:
-                        print(
-                            Fore.RED + "Rule {} has the duplicate reference {}".format(file, reference))
-                        files_with_duplicate_references.append(file)
-                    else:
-                        known_references.append(reference)
+        files_with_duplicate_references = self.run_file_check(self.check_duplicate_references)
 
         self.assertEqual(files_with_duplicate_references, [], Fore.RED +
                          "There are rules with duplicate references")
 
-    def test_look_for_duplicate_filters(self):
-        def check_list_or_recurse_on_dict(item, depth: int, special: bool) -> None:
-            if type(item) == list:
-                check_if_list_contain_duplicates(item, depth, special)
-            elif type(item) == dict and depth <= MAX_DEPTH:
-                for keys, sub_item in item.items():
-                    if "|base64" in keys or "|re" in keys: # Covers both "base64" and "base64offset" modifiers, and "re" modifier
-                        check_list_or_recurse_on_dict(sub_item, depth + 1, True)
-                    else:
-                        check_list_or_recurse_on_dict(sub_item, depth + 1, special)
-
-        def check_if_list_contain_duplicates(item: list, depth: int, special: bool) -> None:
-            try:
-                # We use a list comprehension to convert all the element to lowercase. Since we don't care about casing in SIGMA except for the following modifiers
-                #   - "base64offset"
-                #   - "base64"
-                #   - "re"
-                if special:
-                    item_ = item
+    @on_metadata("references")
+    def check_duplicate_references(self, file, references):
+        if references:
+            known_references = []
+            for reference in references:
+                if reference in known_references:
+                    yield Finding(file, Fore.RED + "Rule {} has the duplicate reference {}".format(file, reference))
                 else:
-                    item_= [i.lower() for i in item]
-                if len(item_) != len(set(item_)):
-                    # We find the duplicates and then print them to the user
-                    duplicates = [i for i, count in collections.Counter(item_).items() if count > 1]
-                    print(Fore.RED + "Rule {} has duplicate filters {}".format(file, duplicates))
-                    files_with_duplicate_filters.append(file)
-            except:
-                # unhashable types like dictionaries
-                for sub_item in item:
-                    if type(sub_item) == dict and depth <= MAX_DEPTH:
-                        check_list_or_recurse_on_dict(sub_item, depth + 1, special)
+                    known_references.append(reference)
 
-        MAX_DEPTH = 3
-        files_with_duplicate_filters = []
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            check_list_or_recurse_on_dict(detection, 1, False)
+    def test_look_for_duplicate_filters(self):
+        files_with_duplicate_filters = self.run_file_check(self.check_look_for_duplicate_filters)
 
         self.assertEqual(files_with_duplicate_filters, [], Fore.RED +
                          "There are rules with duplicate filters")
 
+    @on_selection()
+    def check_look_for_duplicate_filters(self, file, name, value):
+        # Keyword lists, the values of the fields are checked by the field handler below
+        if type(value) == list:
+            return self.find_duplicate_filters(file, value, False)
+
+    @on_field(check="check_look_for_duplicate_filters")
+    def check_look_for_duplicate_field_filters(self, file, selection, field, value):
+        if type(value) == list:
+            # Covers both "base64" and "base64offset" modifiers, and "re" modifier
+            return self.find_duplicate_filters(file, value, "|base64" in field or "|re" in field)
+
+    def find_duplicate_filters(self, file, item: list, special: bool) -> list:
+        try:
+            # We use a list comprehension to convert all the element to lowercase. Since we don't care about casing in SIGMA except for the following modifiers
+            #   - "base64offset"
+            #   - "base64"
+            #   - "re"
+            if special:
+                item_ = item
+            else:
+                item_= [i.lower() for i in item]
+            if len(item_) != len(set(item_)):
+                # We find the duplicates and then print them to the user
+                duplicates = [i for i, count in collections.Counter(item_).items() if count > 1]
+                return [Finding(file, Fore.RED + "Rule {} has duplicate filters {}".format(file, duplicates))]
+        except:
+            # unhashable types like dictionaries, their fields get their own field events
+            pass
+        return []
+
     def test_field_name_with_space(self):
-        def key_iterator(fields, faulty):
-            for key, value in fields.items():
-                if " " in key:
-                    faulty.append(key)
-                    print(
-                        Fore.YELLOW + "Rule {} has a space in field name ({}).".format(file, key))
-                if type(value) == dict:
-                    key_iterator(value, faulty)
-
-        faulty_fieldnames = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            key_iterator(detection, faulty_fieldnames)
+        faulty_fieldnames = self.run_file_check(self.check_field_name_with_space)
 
         self.assertEqual(faulty_fieldnames, [], Fore.RED +
                          "There are rules with an unsupported field name. Spaces are not allowed. (Replace space with an underscore character '_' )")
 
-    def test_single_named_condition_with_x_of_them(self):
-        faulty_detections = []
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            yaml = self.get_rule_yaml(file_path=file)
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
+    @on_selection()
+    def check_field_name_with_space(self, file, name, value):
+        if " " in name:
+            yield Finding(name, Fore.YELLOW + "Rule {} has a space in field name ({}).".format(file, name))
 
-            has_them_in_condition = "them" in detection["condition"]
-            has_only_one_named_condition = len(detection) == 2
-            not_multipart_yaml_file = len(yaml) == 1
+    @on_field(check="check_field_name_with_space")
+    def check_field_name_with_space_in_field(self, file, selection, field, value):
+        if " " in field:
+            yield Finding(field, Fore.YELLOW + "Rule {} has a space in field name ({}).".format(file, field))
 
-            if has_them_in_condition and \
-                has_only_one_named_condition and \
-                    not_multipart_yaml_file:
-                faulty_detections.append(file)
+    def test_single_named_condition_with_x_of_them(self):
+        faulty_detections = self.run_file_check(self.check_single_named_condition_with_x_of_them)
 
         self.assertEqual(faulty_detections, [], Fore.RED +
                          "There are rules using '1/all of them' style conditions but only have one condition")
 
-    def test_all_of_them_condition(self):
-        faulty_detections = []
+    def check_single_named_condition_with_x_of_them(self, file, rule):
+        detection = rule.get_part("detection")
+        try:
+            conditions = rule.conditions
+        except ConditionSyntaxError:
+            return
+
+        has_them_in_condition = bool(quantified(conditions, pattern="them"))
+        has_only_one_named_condition = len(detection) == 2
+        not_multipart_yaml_file = not rule.is_multipart
 
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
+        if has_them_in_condition and \
+            has_only_one_named_condition and \
+                not_multipart_yaml_file:
+            yield Finding(file, None)
 
-            if "all of them" in detection["condition"]:
-                faulty_detections.append(file)
+    def test_all_of_them_condition(self):
+        faulty_detections = self.run_file_check(self.check_all_of_them_condition)
 
         self.assertEqual(faulty_detections, [], Fore.RED +
                          "There are rules using 'all of them'. Better use e.g. 'all of selection*' instead (and use the 'selection_' prefix as search-identifier).")
 
-    def test_duplicate_detections(self):
-        def compare_detections(detection1: dict, detection2: dict) -> bool:
-
-            # If they have different log sources. They can't be the same
-            # We first remove any definitions fields (if there are any) in the logsource to avoid typos
-            detection1["logsource"].pop("definition", None)
-            detection2["logsource"].pop("definition", None)
-
-            if detection1["logsource"] != detection2["logsource"]:
-                return False
-
-            # detections not the same count can't be the same
-            if len(detection1) != len(detection2):
-                return False
-
-            for named_condition in detection1:
-                # don't check timeframes
-                if named_condition == "timeframe":
-                    continue
-
-                # condition clause must be the same too
-                if named_condition == "condition":
-                    if detection1["condition"] != detection2["condition"]:
-                        return False
-                    else:
-                        continue
-
-                # Named condition must exist in both rule files
-                if named_condition not in detection2:
-                    return False
+    def check_all_of_them_condition(self, file, rule):
+        try:
+            conditions = rule.conditions
+        except ConditionSyntaxError:
+            return
 
-                # can not be the same  if len is not equal
-                if len(detection1[named_condition]) != len(detection2[named_condition]):
-                    return False
-
-                for condition in detection1[named_condition]:
-                    if type(condition) != str:
-                        return False
-
-                    if condition not in detection2[named_condition]:
-                        return False
-
-                    # We add this check in case of keyword rules. Where no field is used. The parser returns a list instead of a dict
-                    # If the 2 list are different that means they aren't the same
-                    if (type(detection2[named_condition]) == list) or (type(detection2[named_condition]) == list):
-                        condition_value1 = detection1[named_condition]
-                        condition_value2 = detection2[named_condition]
-                    else:
-                        condition_value1 = detection1[named_condition][condition]
-                        condition_value2 = detection2[named_condition][condition]
-
-                    if condition_value1 != condition_value2:
-                        return False
-
-            return True
+        if quantified(conditions, quantifier="all", pattern="them"):
+            yield Finding(file, None)
 
+    def test_duplicate_detections(self):
+        # Rules with the same canonical detection fingerprint (see sigmalint/fingerprint.py) share a bucket
         faulty_detections = []
-        files_and_their_detections = {}
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            logsource = self.get_rule_part(
-                file_path=file, part_name="logsource")
-            detection["logsource"] = {}
-            detection["logsource"].update(logsource)
-            yaml = self.get_rule_yaml(file_path=file)
-
-            is_multipart_yaml_file = len(yaml) != 1
-            if is_multipart_yaml_file:
+        files_by_fingerprint = {}
+        # With --changed-since the unchanged rules come from the index
+        for entry in self.unchanged_rules():
+            if entry.fingerprint is not None:
+                files_by_fingerprint.setdefault(entry.fingerprint, []).append(entry.path)
+
+        for file, rule in self.corpus.items():
+            fingerprint = rule_fingerprint(rule)
+            if fingerprint is None:
                 continue
-
-            for key in files_and_their_detections:
-                if compare_detections(detection, files_and_their_detections[key]):
-                    faulty_detections.append((key, file))
-
-            files_and_their_detections[file] = detection
+            same_detection = files_by_fingerprint.setdefault(fingerprint, [])
+            for key in same_detection:
+                faulty_detections.append((key, file))
+            same_detection.append(file)
 
         self.assertEqual(faulty_detections, [], Fore.YELLOW +
                          "There are rule files with exactly the same detection logic.")
 
     def test_source_eventlog(self):
-        faulty_detections = []
-
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            detection_str = str(detection).lower()
-            if "'source': 'eventlog'" in detection_str:
-                faulty_detections.append(file)
+        faulty_detections = self.run_file_check(self.check_source_eventlog)
 
         self.assertEqual(faulty_detections, [], Fore.YELLOW +
                          "There are detections with 'Source: Eventlog'. This does not add value to the detection.")
 
+    def check_source_eventlog(self, file, rule):
+        detection = rule.get_part("detection")
+        detection_str = str(detection).lower()
+        if "'source': 'eventlog'" in detection_str:
+            yield Finding(file, None)
+
     def test_event_id_instead_of_process_creation(self):
-        faulty_detections = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            with open(file, encoding='utf-8') as f:
-                for line in f:
-                    if re.search(r'.*EventID: (?:1|4688)\s*$', line) and file not in faulty_detections:
-                        detection = self.get_rule_part(file_path=file, part_name="detection")
-                        if detection:
-                            for search_identifier in detection:
-                                if isinstance(detection[search_identifier], dict):
-                                    for field in detection[search_identifier]:
-                                        if "Provider_Name" in field:
-                                            if isinstance(detection[search_identifier]["Provider_Name"], list):
-                                                for value in detection[search_identifier]["Provider_Name"]:
-                                                    if "Microsoft-Windows-Security-Auditing" in value or "Microsoft-Windows-Sysmon" in value:
-                                                        if file not in faulty_detections:
-                                                            faulty_detections.append(file)
-                                            else:
-                                                if "Microsoft-Windows-Security-Auditing" in detection[search_identifier]["Provider_Name"] or "Microsoft-Windows-Sysmon" in detection[search_identifier]["Provider_Name"]:
-                                                    if file not in faulty_detections:
-                                                            faulty_detections.append(file)
+        faulty_detections = self.run_file_check(self.check_event_id_instead_of_process_creation)
 
         self.assertEqual(faulty_detections, [], Fore.YELLOW +
                          "There are rules still using Sysmon 1 or Event ID 4688. Please migrate to the process_creation category.")
 
+    def check_event_id_instead_of_process_creation(self, file, rule):
+        # Most rules have no EventID at all, skip the line by line search for them
+        if "EventID: " not in rule.text:
+            return
+        for line in rule.lines:
+            if re.search(r'.*EventID: (?:1|4688)\s*$', line):
+                detection = rule.get_part("detection")
+                if detection:
+                    for search_identifier in detection:
+                        if isinstance(detection[search_identifier], dict):
+                            for field in detection[search_identifier]:
+                                if "Provider_Name" in field:
+                                    if isinstance(detection[search_identifier]["Provider_Name"], list):
+                                        for value in detection[search_identifier]["Provider_Name"]:
+                                            if "Microsoft-Windows-Security-Auditing" in value or "Microsoft-Windows-Sysmon" in value:
+                                                # A rule is only reported once
+                                                yield Finding(file, None)
+                                                return
+                                    else:
+                                        if "Microsoft-Windows-Security-Auditing" in detection[search_identifier]["Provider_Name"] or "Microsoft-Windows-Sysmon" in detection[search_identifier]["Provider_Name"]:
+                                            yield Finding(file, None)
+                                            return
+
     def test_missing_id(self):
         faulty_rules = []
         dict_id = {}
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            id = self.get_rule_part(file_path=file, part_name="id")
-            if not id:
-                print(Fore.YELLOW + "Rule {} has no field 'id'.".format(file))
-                faulty_rules.append(file)
-            elif len(id) != 36:
-                print(
-                    Fore.YELLOW + "Rule {} has a malformed 'id' (not 36 chars).".format(file))
-                faulty_rules.append(file)
-            elif id.lower() in dict_id.keys():
+        # With --changed-since the unchanged rules come from the index
+        for entry in self.unchanged_rules():
+            if isinstance(entry.id, str) and len(entry.id) == 36:
+                dict_id.setdefault(entry.id.lower(), entry.path)
+        for file, rule in self.corpus.items():
+            findings = self.findings_cache.findings(self.check_missing_id, rule)
+            if findings:
+                for finding in findings:
+                    print(finding.message)
+                    faulty_rules.append(finding.entry)
+                continue
+            # Uniqueness needs the whole corpus and is not cached per file
+            id = rule.get_part("id")
+            if id.lower() in dict_id.keys():
                 print(
                     Fore.YELLOW + "Rule {} has the same 'id' as {}. Ids have to be unique.".format(file, dict_id[id]))
                 faulty_rules.append(file)
@@ -392,8 +347,22 @@ class TestRules(unittest.TestCase):
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with missing or malformed 'id' fields. Generate an id (e.g. here: https://www.uuidgenerator.net/version4) and add it to the reported rule(s).")
 
+    def check_missing_id(self, file, rule):
+        id = rule.get_part("id")
+        if not id:
+            yield Finding(file, Fore.YELLOW + "Rule {} has no field 'id'.".format(file))
+        elif len(id) != 36:
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a malformed 'id' (not 36 chars).".format(file))
+
     def test_optional_related(self):
-        faulty_rules = []
+        faulty_rules = self.run_file_check(self.check_optional_related)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules with malformed optional 'related' fields. (check https://github.com/SigmaHQ/sigma/wiki/Specification)")
+
+    @on_metadata("related")
+    def check_optional_related(self, file, related_lst):
         valid_type = [
             "derived",
             "obsoletes",
@@ -401,124 +370,111 @@ class TestRules(unittest.TestCase):
             "renamed",
             "similar"
         ]
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            related_lst = self.get_rule_part(
-                file_path=file, part_name="related")
-            if related_lst:
-                # it exists but isn't a list
-                if not isinstance(related_lst, list):
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'related' field that isn't a list.".format(file))
-                    faulty_rules.append(file)
-                else:
-                    type_ok = True
-                    for ref in related_lst:
-                        try:
-                            id_str = ref['id']
-                            type_str = ref['type']
-                        except KeyError:
-                            print(Fore.YELLOW + "Rule {} has an invalid form of 'related/type' value.".format(file))
-                            faulty_rules.append(file)
-                            continue
-                        if not type_str in valid_type:
-                            type_ok = False
-                    # Only add one time if many bad type in the same file
-                    if type_ok == False:
-                        print(
-                            Fore.YELLOW + "Rule {} has a 'related/type' invalid value.".format(file))
-                        faulty_rules.append(file)
-
-        self.assertEqual(faulty_rules, [], Fore.RED +
-                         "There are rules with malformed optional 'related' fields. (check https://github.com/SigmaHQ/sigma/wiki/Specification)")
+        if related_lst:
+            # it exists but isn't a list
+            if not isinstance(related_lst, list):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'related' field that isn't a list.".format(file))
+            else:
+                type_ok = True
+                for ref in related_lst:
+                    try:
+                        id_str = ref['id']
+                        type_str = ref['type']
+                    except KeyError:
+                        yield Finding(file, Fore.YELLOW + "Rule {} has an invalid form of 'related/type' value.".format(file))
+                        continue
+                    if not type_str in valid_type:
+                        type_ok = False
+                # Only add one time if many bad type in the same file
+                if type_ok == False:
+                    yield Finding(file,
+                        Fore.YELLOW + "Rule {} has a 'related/type' invalid value.".format(file))
 
     def test_sysmon_rule_without_eventid(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            logsource = self.get_rule_part(
-                file_path=file, part_name="logsource")
-            if logsource:
-                service = logsource.get('service', '')
-                if service.lower() == 'sysmon':
-                    with open(file, encoding='utf-8') as f:
-                        found = False
-                        for line in f:
-                            # might be on a single line or in multiple lines
-                            if re.search(r'.*EventID:.*$', line):
-                                found = True
-                                break
-                        if not found:
-                            faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_sysmon_rule_without_eventid)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules using sysmon events but with no EventID specified")
 
+    def check_sysmon_rule_without_eventid(self, file, rule):
+        logsource = rule.get_part("logsource")
+        if logsource:
+            service = logsource.get('service', '')
+            if service.lower() == 'sysmon':
+                found = False
+                for line in rule.lines:
+                    # might be on a single line or in multiple lines
+                    if re.search(r'.*EventID:.*$', line):
+                        found = True
+                        break
+                if not found:
+                    yield Finding(file, None)
+
     def test_missing_date(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            datefield = self.get_rule_part(file_path=file, part_name="date")
-            if not datefield:
-                print(Fore.YELLOW + "Rule {} has no field 'date'.".format(file))
-                faulty_rules.append(file)
-            elif not isinstance(datefield, str):
-                print(
-                    Fore.YELLOW + "Rule {} has a malformed 'date' (should be YYYY/MM/DD).".format(file))
-                faulty_rules.append(file)
-            elif len(datefield) != 10:
-                print(
-                    Fore.YELLOW + "Rule {} has a malformed 'date' (not 10 chars, should be YYYY/MM/DD).".format(file))
-                faulty_rules.append(file)
-            elif datefield[4] != '/' or datefield[7] != '/':
-                print(
-                    Fore.YELLOW + "Rule {} has a malformed 'date' (should be YYYY/MM/DD).".format(file))
-                faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_missing_date)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with missing or malformed 'date' fields. (create one, e.g. date: 2019/01/14)")
 
+    def check_missing_date(self, file, rule):
+        datefield = rule.get_part("date")
+        if not datefield:
+            yield Finding(file, Fore.YELLOW + "Rule {} has no field 'date'.".format(file))
+        elif not isinstance(datefield, str):
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a malformed 'date' (should be YYYY/MM/DD).".format(file))
+        elif len(datefield) != 10:
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a malformed 'date' (not 10 chars, should be YYYY/MM/DD).".format(file))
+        elif datefield[4] != '/' or datefield[7] != '/':
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a malformed 'date' (should be YYYY/MM/DD).".format(file))
+
     def test_missing_description(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            descriptionfield = self.get_rule_part(
-                file_path=file, part_name="description")
-            if not descriptionfield:
-                print(Fore.YELLOW + "Rule {} has no field 'description'.".format(file))
-                faulty_rules.append(file)
-            elif not isinstance(descriptionfield, str):
-                print(
-                    Fore.YELLOW + "Rule {} has a 'description' field that isn't a string.".format(file))
-                faulty_rules.append(file)
-            elif len(descriptionfield) < 16:
-                print(
-                    Fore.YELLOW + "Rule {} has a really short description. Please elaborate.".format(file))
-                faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_missing_description)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with missing or malformed 'description' field. (create one, e.g. description: Detects the suspicious behaviour of process XY doing YZ)")
 
+    def check_missing_description(self, file, rule):
+        descriptionfield = rule.get_part("description")
+        if not descriptionfield:
+            yield Finding(file, Fore.YELLOW + "Rule {} has no field 'description'.".format(file))
+        elif not isinstance(descriptionfield, str):
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a 'description' field that isn't a string.".format(file))
+        elif len(descriptionfield) < 16:
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a really short description. Please elaborate.".format(file))
+
     def test_optional_date_modified(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            modifiedfield = self.get_rule_part(
-                file_path=file, part_name="modified")
-            if modifiedfield:
-                if not isinstance(modifiedfield, str):
-                    print(
-                        Fore.YELLOW + "Rule {} has a malformed 'modified' (should be YYYY/MM/DD).".format(file))
-                    faulty_rules.append(file)
-                elif len(modifiedfield) != 10:
-                    print(
-                        Fore.YELLOW + "Rule {} has a malformed 'modified' (not 10 chars, should be YYYY/MM/DD).".format(file))
-                    faulty_rules.append(file)
-                elif modifiedfield[4] != '/' or modifiedfield[7] != '/':
-                    print(
-                        Fore.YELLOW + "Rule {} has a malformed 'modified' (should be YYYY/MM/DD).".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_date_modified)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'modified' fields. (create one, e.g. date: 2019/01/14)")
 
+    @on_metadata("modified")
+    def check_optional_date_modified(self, file, modifiedfield):
+        if modifiedfield:
+            if not isinstance(modifiedfield, str):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a malformed 'modified' (should be YYYY/MM/DD).".format(file))
+            elif len(modifiedfield) != 10:
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a malformed 'modified' (not 10 chars, should be YYYY/MM/DD).".format(file))
+            elif modifiedfield[4] != '/' or modifiedfield[7] != '/':
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a malformed 'modified' (should be YYYY/MM/DD).".format(file))
+
     def test_optional_status(self):
-        faulty_rules = []
+        faulty_rules = self.run_file_check(self.check_optional_status)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules with malformed 'status' fields. (check https://github.com/SigmaHQ/sigma/wiki/Specification)")
+
+    @on_metadata("status")
+    def check_optional_status(self, file, status_str):
         valid_status = [
             "stable",
             "test",
@@ -526,23 +482,21 @@ class TestRules(unittest.TestCase):
             "deprecated",
             "unsupported"
         ]
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            status_str = self.get_rule_part(file_path=file, part_name="status")
-            if status_str:
-                if not status_str in valid_status:
-                    print(
-                        Fore.YELLOW + "Rule {} has a invalid 'status' (check wiki).".format(file))
-                    faulty_rules.append(file)
-                elif status_str == "unsupported":
-                    print(
-                        Fore.YELLOW + "Rule {} has the unsupported 'status', can not be in rules directory".format(file))
-                    faulty_rules.append(file)
+        if status_str:
+            if not status_str in valid_status:
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a invalid 'status' (check wiki).".format(file))
+            elif status_str == "unsupported":
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has the unsupported 'status', can not be in rules directory".format(file))
+
+    def test_level(self):
+        faulty_rules = self.run_file_check(self.check_level)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
-                         "There are rules with malformed 'status' fields. (check https://github.com/SigmaHQ/sigma/wiki/Specification)")
+                         "There are rules with missing or malformed 'level' fields. (check https://github.com/SigmaHQ/sigma/wiki/Specification)")
 
-    def test_level(self):
-        faulty_rules = []
+    def check_level(self, file, rule):
         valid_level = [
             "informational",
             "low",
@@ -550,382 +504,244 @@ class TestRules(unittest.TestCase):
             "high",
             "critical",
         ]
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            level_str = self.get_rule_part(file_path=file, part_name="level")
-            if not level_str:
-                print(Fore.YELLOW + "Rule {} has no field 'level'.".format(file))
-                faulty_rules.append(file)
-            elif not level_str in valid_level:
-                print(
-                    Fore.YELLOW + "Rule {} has a invalid 'level' (check wiki).".format(file))
-                faulty_rules.append(file)
-
-        self.assertEqual(faulty_rules, [], Fore.RED +
-                         "There are rules with missing or malformed 'level' fields. (check https://github.com/SigmaHQ/sigma/wiki/Specification)")
+        level_str = rule.get_part("level")
+        if not level_str:
+            yield Finding(file, Fore.YELLOW + "Rule {} has no field 'level'.".format(file))
+        elif not level_str in valid_level:
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a invalid 'level' (check wiki).".format(file))
 
     def test_optional_fields(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            fields_str = self.get_rule_part(file_path=file, part_name="fields")
-            if fields_str:
-                # it exists but isn't a list
-                if not isinstance(fields_str, list):
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'fields' field that isn't a list.".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_fields)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed optional 'fields' fields. (has to be a list of values even if it contains only a single value)")
 
+    @on_metadata("fields")
+    def check_optional_fields(self, file, fields_str):
+        if fields_str:
+            # it exists but isn't a list
+            if not isinstance(fields_str, list):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'fields' field that isn't a list.".format(file))
+
     def test_optional_falsepositives_listtype(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            falsepositives_str = self.get_rule_part(
-                file_path=file, part_name="falsepositives")
-            if falsepositives_str:
-                # it exists but isn't a list
-                if not isinstance(falsepositives_str, list):
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'falsepositives' field that isn't a list.".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_falsepositives_listtype)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed optional 'falsepositives' fields. (has to be a list of values even if it contains only a single value)")
 
+    @on_metadata("falsepositives")
+    def check_optional_falsepositives_listtype(self, file, falsepositives_str):
+        if falsepositives_str:
+            # it exists but isn't a list
+            if not isinstance(falsepositives_str, list):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'falsepositives' field that isn't a list.".format(file))
+
     def test_optional_falsepositives_capital(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            fps = self.get_rule_part(
-                file_path=file, part_name="falsepositives")
-            if fps:
-                for fp in fps:
-                    # first letter should be capital
-                    try:
-                        if fp[0].upper() != fp[0]:
-                            print(
-                                Fore.YELLOW + "Rule {} defines a falsepositive that does not start with a capital letter: '{}'.".format(file, fp))
-                            faulty_rules.append(file)
-                    except TypeError as err:
-                        print("TypeError Exception for rule {}".format(file))
-                        print("Error: {}".format(err))
-                        print("Maybe you created an empty falsepositive item?")
+        faulty_rules = self.run_file_check(self.check_optional_falsepositives_capital)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with false positives that don't start with a capital letter (e.g. 'unknown' should be 'Unknown')")
 
+    @on_metadata("falsepositives")
+    def check_optional_falsepositives_capital(self, file, fps):
+        if fps:
+            for fp in fps:
+                # first letter should be capital
+                try:
+                    if fp[0].upper() != fp[0]:
+                        yield Finding(file,
+                            Fore.YELLOW + "Rule {} defines a falsepositive that does not start with a capital letter: '{}'.".format(file, fp))
+                except TypeError as err:
+                    # Only printed, does not fail the test
+                    yield Finding(None, "TypeError Exception for rule {}".format(file))
+                    yield Finding(None, "Error: {}".format(err))
+                    yield Finding(None, "Maybe you created an empty falsepositive item?")
+
     def test_optional_falsepositives_blocked_content(self):
-        faulty_rules = []
-        banned_words = ["none", "pentest", "penetration test"]
-        common_typos = ["unkown", "ligitimate", "legitim ", "legitimeate"]
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            fps = self.get_rule_part(
-                file_path=file, part_name="falsepositives")
-            if fps:
-                for fp in fps:
-                    for typo in common_typos:
-                        if fp == "Unknow" or typo in fp.lower():
-                            print(
-                                Fore.YELLOW + "Rule {} defines a falsepositive with a common typo: '{}'.".format(file, typo))
-                            faulty_rules.append(file)
-                    for banned_word in banned_words:
-                        if banned_word in fp.lower():
-                            print(
-                                Fore.YELLOW + "Rule {} defines a falsepositive with an invalid reason: '{}'.".format(file, banned_word))
-                            faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_falsepositives_blocked_content)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with invalid false positive definitions (e.g. Pentest, None or common typos)")
 
+    @on_metadata("falsepositives")
+    def check_optional_falsepositives_blocked_content(self, file, fps):
+        banned_words = ["none", "pentest", "penetration test"]
+        common_typos = ["unkown", "ligitimate", "legitim ", "legitimeate"]
+        if fps:
+            for fp in fps:
+                for typo in common_typos:
+                    if fp == "Unknow" or typo in fp.lower():
+                        yield Finding(file,
+                            Fore.YELLOW + "Rule {} defines a falsepositive with a common typo: '{}'.".format(file, typo))
+                for banned_word in banned_words:
+                    if banned_word in fp.lower():
+                        yield Finding(file,
+                            Fore.YELLOW + "Rule {} defines a falsepositive with an invalid reason: '{}'.".format(file, banned_word))
+
     # Upgrade Detection Rule License  1.1
     def test_optional_author(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            author_str = self.get_rule_part(file_path=file, part_name="author")
-            if author_str:
-                # it exists but isn't a string
-                if not isinstance(author_str, str):
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'author' field that isn't a string.".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_author)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'author' fields. (has to be a string even if it contains many author)")
 
+    @on_metadata("author")
+    def check_optional_author(self, file, author_str):
+        if author_str:
+            # it exists but isn't a string
+            if not isinstance(author_str, str):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'author' field that isn't a string.".format(file))
+
     def test_optional_license(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            license_str = self.get_rule_part(
-                file_path=file, part_name="license")
-            if license_str:
-                if not isinstance(license_str, str):
-                    print(
-                        Fore.YELLOW + "Rule {} has a malformed 'license' (has to be a string).".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_license)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'license' fields. (has to be a string )")
 
+    @on_metadata("license")
+    def check_optional_license(self, file, license_str):
+        if license_str:
+            if not isinstance(license_str, str):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a malformed 'license' (has to be a string).".format(file))
+
     def test_optional_tlp(self):
-        faulty_rules = []
+        faulty_rules = self.run_file_check(self.check_optional_tlp)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules with malformed optional 'tlp' fields. (https://www.cisa.gov/tlp)")
+
+    @on_metadata("tlp")
+    def check_optional_tlp(self, file, tlp_str):
         valid_tlp = [
             "WHITE",
             "GREEN",
             "AMBER",
             "RED",
         ]
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            tlp_str = self.get_rule_part(file_path=file, part_name="tlp")
-            if tlp_str:
-                # it exists but isn't a string
-                if not isinstance(tlp_str, str):
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'tlp' field that isn't a string.".format(file))
-                    faulty_rules.append(file)
-                elif not tlp_str.upper() in valid_tlp:
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'tlp' field with not valid value.".format(file))
-                    faulty_rules.append(file)
-
-        self.assertEqual(faulty_rules, [], Fore.RED +
-                         "There are rules with malformed optional 'tlp' fields. (https://www.cisa.gov/tlp)")
+        if tlp_str:
+            # it exists but isn't a string
+            if not isinstance(tlp_str, str):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'tlp' field that isn't a string.".format(file))
+            elif not tlp_str.upper() in valid_tlp:
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'tlp' field with not valid value.".format(file))
 
     def test_optional_target(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            target = self.get_rule_part(file_path=file, part_name="target")
-            if target:
-                # it exists but isn't a list
-                if not isinstance(target, list):
-                    print(
-                        Fore.YELLOW + "Rule {} has a 'target' field that isn't a list.".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_optional_target)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'target' fields. (has to be a list of values even if it contains only a single value)")
 
+    @on_metadata("target")
+    def check_optional_target(self, file, target):
+        if target:
+            # it exists but isn't a list
+            if not isinstance(target, list):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a 'target' field that isn't a list.".format(file))
+
     def test_references(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            references = self.get_rule_part(
-                file_path=file, part_name="references")
-            # Reference field doesn't exist
-            # if not references:
-            # print(Fore.YELLOW + "Rule {} has no field 'references'.".format(file))
-            # faulty_rules.append(file)
-            if references:
-                # it exists but isn't a list
-                if not isinstance(references, list):
-                    print(
-                        Fore.YELLOW + "Rule {} has a references field that isn't a list.".format(file))
-                    faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_references)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'references' fields. (has to be a list of values even if it contains only a single value)")
 
+    @on_metadata("references")
+    def check_references(self, file, references):
+        if references:
+            # it exists but isn't a list
+            if not isinstance(references, list):
+                yield Finding(file,
+                    Fore.YELLOW + "Rule {} has a references field that isn't a list.".format(file))
+
     def test_references_in_description(self):
         # This test checks for the presence of a links and special keywords in the "description" field while there is no "references" field.
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            references = self.get_rule_part(
-                file_path=file, part_name="references")
-            # Reference field doesn't exist
-            if not references:
-                descriptionfield = self.get_rule_part(
-                    file_path=file, part_name="description")
-                if descriptionfield:
-                    for i in ["http://", "https://", "internal research"]: # Extends the list with other common references starters
-                        if i in descriptionfield.lower():
-                            print(Fore.RED + "Rule {} has a field that contains references to external links but no references set. Add a 'references' key and add URLs as list items.".format(file))
-                            faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_references_in_description)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'description' fields. (links and external references have to be in a seperate field named 'references'. see specification https://github.com/SigmaHQ/sigma-specification)")
 
+    def check_references_in_description(self, file, rule):
+        references = rule.get_part("references")
+        # Reference field doesn't exist
+        if not references:
+            descriptionfield = rule.get_part("description")
+            if descriptionfield:
+                for i in ["http://", "https://", "internal research"]: # Extends the list with other common references starters
+                    if i in descriptionfield.lower():
+                        yield Finding(file, Fore.RED + "Rule {} has a field that contains references to external links but no references set. Add a 'references' key and add URLs as list items.".format(file))
+
     def test_references_plural(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            reference = self.get_rule_part(
-                file_path=file, part_name="reference")
-            if reference:
-                # it exists but in singular form
-                faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_references_plural)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with malformed 'references' fields. (has to be 'references' in plural form, not singular)")
 
+    @on_metadata("reference")
+    def check_references_plural(self, file, reference):
+        if reference:
+            # it exists but in singular form
+            yield Finding(file, None)
+
     def test_file_names(self):
         faulty_rules = []
-        name_lst = []
-        filename_pattern = re.compile(r'[a-z0-9_]{10,80}\.yml')
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
+        # With --changed-since the unchanged rules come from the index
+        known_names = {entry.filename for entry in self.unchanged_rules()}
+        for file, rule in self.corpus.items():
             filename = os.path.basename(file)
-            if filename in name_lst:
+            if filename in known_names:
                 print(Fore.YELLOW + "Rule {} is a duplicate file name.".format(file))
                 faulty_rules.append(file)
-            elif filename[-4:] != ".yml":
-                print(Fore.YELLOW +
-                      "Rule {} has a invalid extension (.yml).".format(file))
-                faulty_rules.append(file)
-            elif len(filename) > 74:
-                print(Fore.YELLOW +
-                      "Rule {} has a file name too long >70.".format(file))
-                faulty_rules.append(file)
-            elif len(filename) < 14:
-                print(Fore.YELLOW +
-                      "Rule {} has a file name too short <10.".format(file))
-                faulty_rules.append(file)
-            elif filename_pattern.match(filename) == None or not '_' in filename:
-                print(
-                    Fore.YELLOW + "Rule {} has a file name that doesn't match our standard.".format(file))
-                faulty_rules.append(file)
             else:
-                # This test make sure that every rules has a filename that corresponds to
-                # It's specific logsource.
-                # Fix Issue #1381 (https://github.com/SigmaHQ/sigma/issues/1381)
-                logsource = self.get_rule_part(file_path=file, part_name="logsource")
-                if logsource:
-                    pattern_prefix = ""
-                    os_infix = ""
-                    os_bool = False
-                    for key,value in logsource.items():
-                        if key == "definition":
-                            pass
-                        else:
-                            if key == "product":
-                                # This is to get the OS for certain categories
-                                if value == "windows":
-                                    os_infix = "win_"
-                                elif value == "macos":
-                                    os_infix = "macos_"
-                                elif value == "linux":
-                                    os_infix = "lnx_"
-                                # For other stuff
-                                elif value == "aws":
-                                    pattern_prefix = "aws_"
-                                elif value == "azure":
-                                    pattern_prefix = "azure_"
-                                elif value == "gcp":
-                                    pattern_prefix = "gcp_"
-                                elif value == "gworkspace":
-                                    pattern_prefix = "gworkspace_"
-                                elif value == "m365":
-                                    pattern_prefix = "microsoft365_"
-                                elif value == "okta":
-                                    pattern_prefix = "okta_"
-                                elif value == "onelogin":
-                                    pattern_prefix = "onelogin_"
-                                elif value == "github":
-                                    pattern_prefix = "github_"
-                            elif key == "category":
-                                if value == "process_creation":
-                                    pattern_prefix = "proc_creation_"
-                                    os_bool = True
-                                elif value == "image_load":
-                                    pattern_prefix = "image_load_"
-                                elif value == "file_event":
-                                    pattern_prefix = "file_event_"
-                                    os_bool = True
-                                elif value == "registry_set":
-                                    pattern_prefix = "registry_set_"
-                                elif value == "registry_add":
-                                    pattern_prefix = "registry_add_"
-                                elif value == "registry_event":
-                                    pattern_prefix = "registry_event_"
-                                elif value == "registry_delete":
-                                    pattern_prefix = "registry_delete_"
-                                elif value == "registry_rename":
-                                    pattern_prefix = "registry_rename_"
-                                elif value == "process_access":
-                                    pattern_prefix = "proc_access_"
-                                    os_bool = True
-                                elif value == "driver_load":
-                                    pattern_prefix = "driver_load_"
-                                    os_bool = True
-                                elif value == "dns_query":
-                                    pattern_prefix = "dns_query_"
-                                    os_bool = True
-                                elif value == "ps_script":
-                                    pattern_prefix = "posh_ps_"
-                                elif value == "ps_module":
-                                    pattern_prefix = "posh_pm_"
-                                elif value == "ps_classic_start":
-                                    pattern_prefix = "posh_pc_"
-                                elif value == "pipe_created":
-                                    pattern_prefix = "pipe_created_"
-                                elif value == "network_connection":
-                                    pattern_prefix = "net_connection_"
-                                    os_bool = True
-                                elif value == "file_rename":
-                                    pattern_prefix = "file_rename_"
-                                    os_bool = True
-                                elif value == "file_delete":
-                                    pattern_prefix = "file_delete_"
-                                    os_bool = True
-                                elif value == "file_change":
-                                    pattern_prefix = "file_change_"
-                                    os_bool = True
-                                elif value == "file_access":
-                                    pattern_prefix = "file_access_"
-                                    os_bool = True
-                                elif value == "create_stream_hash":
-                                    pattern_prefix = "create_stream_hash_"
-                                elif value == "create_remote_thread":
-                                    pattern_prefix = "create_remote_thread_win_"
-                                elif value == "dns":
-                                    pattern_prefix = "net_dns_"
-                                elif value == "firewall":
-                                    pattern_prefix = "net_firewall_"
-                                elif value == "webserver":
-                                    pattern_prefix = "web_"
-                            elif key == "service":
-                                if value == "auditd":
-                                    pattern_prefix = "lnx_auditd_"
-                                elif value == "modsecurity":
-                                    pattern_prefix = "modsec_"
-                                elif value == "diagnosis-scripted":
-                                    pattern_prefix = "win_diagnosis_scripted_"
-                                elif value == "firewall-as":
-                                    pattern_prefix = "win_firewall_as_"
-                                elif value == "msexchange-management":
-                                    pattern_prefix = "win_exchange_"
-                                elif value == "security":
-                                    pattern_prefix = "win_security_"
-                                elif value == "system":
-                                    pattern_prefix = "win_system_"
-                                elif value == "taskscheduler":
-                                    pattern_prefix = "win_taskscheduler_"
-                                elif value == "terminalservices-localsessionmanager":
-                                    pattern_prefix = "win_terminalservices_"
-                                elif value == "windefend":
-                                    pattern_prefix = "win_defender_"
-                                elif value == "wmi":
-                                    pattern_prefix = "win_wmi_"
-                                elif value == "codeintegrity-operational":
-                                    pattern_prefix = "win_codeintegrity_"
-                                elif value == "bits-client":
-                                    pattern_prefix = "win_bits_client_"
-                                elif value == "applocker":
-                                    pattern_prefix = "win_applocker_"
-                                elif value == "dns-server-analytic":
-                                    pattern_prefix = "win_dns_analytic_"
-                                elif value == "bitlocker":
-                                    pattern_prefix = "win_bitlocker_"
-
-                    # This value is used to test if we should add the OS infix for certain categories
-                    if os_bool:
-                        pattern_prefix += os_infix
-                    if pattern_prefix != "":
-                        if not filename.startswith(pattern_prefix):
-                            print(
-                                Fore.YELLOW + "Rule {} has a file name that doesn't match our standard naming convention.".format(file))
-                            faulty_rules.append(file)
-            name_lst.append(filename)
+                for finding in self.findings_cache.findings(self.check_file_names, rule):
+                    print(finding.message)
+                    faulty_rules.append(finding.entry)
+            known_names.add(filename)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          r'There are rules with malformed file names (too short, too long, uppercase letters, a minus sign etc.). Please see the file names used in our repository and adjust your file names accordingly. The pattern for a valid file name is \'[a-z0-9_]{10,70}\.yml\' and it has to contain at least an underline character. It also has to follow the following naming convention https://github.com/SigmaHQ/sigma-specification/blob/main/sigmahq/Sigmahq_filename_rule.md')
 
+    def check_file_names(self, file, rule):
+        filename_pattern = re.compile(r'[a-z0-9_]{10,80}\.yml')
+        filename = os.path.basename(file)
+        if filename[-4:] != ".yml":
+            yield Finding(file, Fore.YELLOW +
+                  "Rule {} has a invalid extension (.yml).".format(file))
+        elif len(filename) > 74:
+            yield Finding(file, Fore.YELLOW +
+                  "Rule {} has a file name too long >70.".format(file))
+        elif len(filename) < 14:
+            yield Finding(file, Fore.YELLOW +
+                  "Rule {} has a file name too short <10.".format(file))
+        elif filename_pattern.match(filename) == None or not '_' in filename:
+            yield Finding(file,
+                Fore.YELLOW + "Rule {} has a file name that doesn't match our standard.".format(file))
+        else:
+            # This test make sure that every rules has a filename that corresponds to
+            # It's specific logsource, the prefixes are listed in filename-conventions.yml
+            # Fix Issue #1381 (https://github.com/SigmaHQ/sigma/issues/1381)
+            logsource = rule.get_part("logsource")
+            if logsource:
+                pattern_prefix = self.FILENAME_CONVENTION.prefix(logsource)
+                if pattern_prefix != "" and not filename.startswith(pattern_prefix):
+                    used_prefix = self.FILENAME_CONVENTION.known_prefix(filename)
+                    yield Finding(file,
+                        Fore.YELLOW + "Rule {} has a file name that doesn't match our standard naming convention (expected prefix '{}'{}).".format(
+                            file, pattern_prefix, ", found '{}'".format(used_prefix) if used_prefix else ""))
+
     def test_title(self):
-        faulty_rules = []
+        faulty_rules = self.run_file_check(self.check_title)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules with non-conform 'title' fields. Please check: https://github.com/SigmaHQ/sigma/wiki/Rule-Creation-Guide#title")
+
+    def check_title(self, file, rule):
         allowed_lowercase_words = [
             'the',
             'for',
@@ -948,68 +764,59 @@ class TestRules(unittest.TestCase):
             'over',
             'new',
         ]
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            title = self.get_rule_part(file_path=file, part_name="title")
-            if not title:
-                print(Fore.RED + "Rule {} has no field 'title'.".format(file))
-                faulty_rules.append(file)
-                continue
-            elif len(title) > 100:
-                print(Fore.YELLOW + "Rule {} has a title field with too many characters (>100)".format(file))
-                faulty_rules.append(file)
-            if title.startswith("Detects "):
-                print(Fore.RED + "Rule {} has a title that starts with 'Detects'".format(file))
-                faulty_rules.append(file)
-            if title.endswith("."):
-                print(Fore.RED + "Rule {} has a title that ends with '.'".format(file))
-                faulty_rules.append(file)
-            wrong_casing = []
-            for word in title.split(" "):
-                if word.islower() and not word.lower() in allowed_lowercase_words and not "." in word and not "/" in word and not word[0].isdigit():
-                    wrong_casing.append(word)
-            if len(wrong_casing) > 0:
-                print(Fore.RED + "Rule {} has a title that has not title capitalization. Words: '{}'".format(
-                    file, ", ".join(wrong_casing)))
-                faulty_rules.append(file)
-
-        self.assertEqual(faulty_rules, [], Fore.RED +
-                         "There are rules with non-conform 'title' fields. Please check: https://github.com/SigmaHQ/sigma/wiki/Rule-Creation-Guide#title")
+        title = rule.get_part("title")
+        if not title:
+            yield Finding(file, Fore.RED + "Rule {} has no field 'title'.".format(file))
+            return
+        elif len(title) > 100:
+            yield Finding(file, Fore.YELLOW + "Rule {} has a title field with too many characters (>100)".format(file))
+        if title.startswith("Detects "):
+            yield Finding(file, Fore.RED + "Rule {} has a title that starts with 'Detects'".format(file))
+        if title.endswith("."):
+            yield Finding(file, Fore.RED + "Rule {} has a title that ends with '.'".format(file))
+        wrong_casing = []
+        for word in title.split(" "):
+            if word.islower() and not word.lower() in allowed_lowercase_words and not "." in word and not "/" in word and not word[0].isdigit():
+                wrong_casing.append(word)
+        if len(wrong_casing) > 0:
+            yield Finding(file, Fore.RED + "Rule {} has a title that has not title capitalization. Words: '{}'".format(
+                file, ", ".join(wrong_casing)))
 
     def test_title_in_first_line(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            yaml = self.get_rule_yaml(file)
-
-            # skip multi-part yaml
-            if len(yaml) > 1:
-                continue
-
-            # this probably is not the best way to check whether
-            # title is the attribute given in the 1st line
-            # (also assumes dict keeps the order from the input file)
-            if list(yaml[0].keys())[0] != "title":
-                print(
-                    Fore.RED + "Rule {} does not have its 'title' attribute in the first line".format(file))
-                faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_title_in_first_line)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules without the 'title' attribute in their first line.")
 
+    def check_title_in_first_line(self, file, rule):
+        yaml = rule.yaml
+
+        # skip multi-part yaml
+        if len(yaml) > 1:
+            return
+
+        # this probably is not the best way to check whether
+        # title is the attribute given in the 1st line
+        # (also assumes dict keeps the order from the input file)
+        if list(yaml[0].keys())[0] != "title":
+            yield Finding(file,
+                Fore.RED + "Rule {} does not have its 'title' attribute in the first line".format(file))
+
     def test_duplicate_titles(self):
         # This test ensure that every rule has a unique title
         faulty_rules = []
+        # With --changed-since the unchanged rules come from the index
         titles_dict = {}
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            title = self.get_rule_part(file_path=file, part_name="title").lower().rstrip()
-            duplicate = False
-            for rule, title_ in titles_dict.items():
-                if title == title_:
-                    print(Fore.RED + "Rule {} has an already used title in {}.".format(file, rule))
-                    duplicate = True
-                    faulty_rules.append(file)
-                    continue
-            if not duplicate:
-                titles_dict[file] = title
+        for entry in self.unchanged_rules():
+            if entry.title:
+                titles_dict.setdefault(entry.title.lower().rstrip(), entry.path)
+        for file, rule in self.corpus.items():
+            title = rule.get_part("title").lower().rstrip()
+            if title in titles_dict:
+                print(Fore.RED + "Rule {} has an already used title in {}.".format(file, titles_dict[title]))
+                faulty_rules.append(file)
+            else:
+                titles_dict[title] = file
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules that share the same 'title'. Please check: https://github.com/SigmaHQ/sigma/wiki/Rule-Creation-Guide#title")
@@ -1022,9 +829,8 @@ class TestRules(unittest.TestCase):
     #         'service',
     #         'definition',
     #     ]
-    #     for file in self.yield_next_rule_file_path(self.path_to_rules):
-    #         logsource = self.get_rule_part(
-    #             file_path=file, part_name="logsource")
+    #     for file, rule in self.corpus.items():
+    #         logsource = rule.get_part("logsource")
     #         if not logsource:
     #             print(Fore.RED + "Rule {} has no 'logsource'.".format(file))
     #             faulty_rules.append(file)
@@ -1046,17 +852,13 @@ class TestRules(unittest.TestCase):
     #                      "There are rules with non-conform 'logsource' fields. Please check: https://github.com/SigmaHQ/sigma/wiki/Rule-Creation-Guide#log-source")
 
     def test_selection_list_one_value(self):
+        faulty_rules = self.run_file_check(self.check_selection_list_one_value)
 
-        def treat_list(file, values, valid_, selection_name):
-            # rule with only list of Keywords term
-            if len(values) == 1 and not isinstance(values[0], str):
-                print(
-                    Fore.RED + "Rule {} has the selection ({}) with a list of only 1 element in detection".format(file, key)
-                )
-                valid_ = False
-            elif isinstance(values[0], dict):
-                valid_ = treat_dict(file, values, valid_, selection_name)
-            return valid_
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                            "There are rules using list with only 1 element")
+
+    @on_selection()
+    def check_selection_list_one_value(self, file, key, values):
 
         def treat_dict(file, values, valid_, selection_name):
             if isinstance(values, list):
@@ -1064,115 +866,90 @@ class TestRules(unittest.TestCase):
                     for key_ in dict_.keys():
                         if isinstance(dict_[key_], list):
                             if len(dict_[key_]) == 1:
-                                print(
+                                findings.append(Finding(None,
                                     Fore.RED + "Rule {} has the selection ({}/{}) with a list of only 1 value in detection".format(file, selection_name, key_)
-                                    )
+                                    ))
                                 valid_ = False
             else:
                 dict_ = values
                 for key_ in dict_.keys():
                     if isinstance(dict_[key_], list):
                         if len(dict_[key_]) == 1:
-                            print(
+                            findings.append(Finding(None,
                                 Fore.RED + "Rule {} has the selection ({}/{}) with a list of only 1 value in detection".format(file, selection_name, key_)
-                                )
+                                ))
                             valid_ = False
             return valid_
 
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            if detection:
-
-                valid = True
-                for key in detection:
-                    values = detection[key]
-                    if isinstance(detection[key], list):
-                        valid = treat_list(file, values, valid, key)
+        findings = []
+        valid = True
+        if isinstance(values, list):
+            # rule with only list of Keywords term
+            if len(values) == 1 and not isinstance(values[0], str):
+                findings.append(Finding(None,
+                    Fore.RED + "Rule {} has the selection ({}) with a list of only 1 element in detection".format(file, key)
+                ))
+                valid = False
+            elif isinstance(values[0], dict):
+                valid = treat_dict(file, values, valid, key)
 
-                    if isinstance(detection[key], dict):
-                        valid = treat_dict(file, values, valid, key)
+        if isinstance(values, dict):
+            valid = treat_dict(file, values, valid, key)
 
-                    if not valid:
-                        faulty_rules.append(file)
+        if not valid:
+            findings.append(Finding(file, None))
 
-        self.assertEqual(faulty_rules, [], Fore.RED +
-                            "There are rules using list with only 1 element")
+        return findings
 
     def test_selection_start_or_and(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            if detection:
-
-                # This test is a best effort to avoid breaking SIGMAC parser. You could do more testing and try to fix this once and for all by modifiying the token regular expressions https://github.com/SigmaHQ/sigma/blob/b9ae5303f12cda8eb6b5b90a32fd7f11ad65645d/tools/sigma/parser/condition.py#L107-L127
-                for key in detection:
-                    if key[:3].lower() == "sel":
-                       continue
-                    elif key[:2].lower() == "or":
-                        print( Fore.RED + "Rule {} has a selection '{}' that starts with the string 'or'".format(file, key))
-                        faulty_rules.append(file)
-                    elif key[:3].lower() == "and":
-                        print( Fore.RED + "Rule {} has a selection '{}' that starts with the string 'and'".format(file, key))
-                        faulty_rules.append(file)
-                    elif key[:3].lower() == "not":
-                        print( Fore.RED + "Rule {} has a selection '{}' that starts with the string 'not'".format(file, key))
-                        faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_selection_start_or_and)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                             "There are rules with bad selection names. Can't start a selection name with an 'or*' or an 'and*' or a 'not*' ")
 
-    def test_unused_selection(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            condition = detection["condition"]
-            wildcard_selections = re.compile(r"\sof\s([\w\*]+)(?:$|\s|\))")
-
-            # skip rules containing aggregations
-            if type(condition) == list:
-                continue
-
-            for selection in detection:
-                if selection == "condition":
-                    continue
-                if selection == "timeframe":
-                    continue
+    @on_selection()
+    def check_selection_start_or_and(self, file, key, value):
+        # This test is a best effort to avoid breaking SIGMAC parser. You could do more testing and try to fix this once and for all by modifiying the token regular expressions https://github.com/SigmaHQ/sigma/blob/b9ae5303f12cda8eb6b5b90a32fd7f11ad65645d/tools/sigma/parser/condition.py#L107-L127
+        if key[:3].lower() == "sel":
+            return
+        elif key[:2].lower() == "or":
+            yield Finding(file, Fore.RED + "Rule {} has a selection '{}' that starts with the string 'or'".format(file, key))
+        elif key[:3].lower() == "and":
+            yield Finding(file, Fore.RED + "Rule {} has a selection '{}' that starts with the string 'and'".format(file, key))
+        elif key[:3].lower() == "not":
+            yield Finding(file, Fore.RED + "Rule {} has a selection '{}' that starts with the string 'not'".format(file, key))
 
-                # remove special keywords
-                condition_list = condition.replace("not ", '').replace("1 of ", '').replace("all of ", '').replace(' or ', ' ').replace(' and ', ' ').replace('(', '').replace(')', '').split(" ")
-                if selection in condition_list:
-                    continue
-
-                # find all wildcards in condition
-                found = False
-                for wildcard_selection in wildcard_selections.findall(condition):
-                    # wildcard matches selection
-                    if re.search(wildcard_selection.replace(r"*", r".*"), selection) is not None:
-                        found = True
-                        break
-                # selection was not found in condition
-                if not found:
-                    print(
-                        Fore.RED + "Rule {} has an unused selection '{}'".format(file, selection))
-                    faulty_rules.append(file)
+    def test_unused_selection(self):
+        faulty_rules = self.run_file_check(self.check_unused_selection)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules with unused selections")
 
+    def check_unused_selection(self, file, rule):
+        detection = rule.get_part("detection")
+        try:
+            conditions = rule.conditions
+        except ConditionSyntaxError:
+            return
+
+        selections = [selection for selection in detection if selection not in ("condition", "timeframe")]
+        used = referenced_names(conditions, selections)
+        for selection in selections:
+            # selection was not found in condition, by name or by a '1 of'/'all of' pattern
+            if selection not in used:
+                yield Finding(file,
+                    Fore.RED + "Rule {} has an unused selection '{}'".format(file, selection))
+
     # def test_field_name_typo(self):
     #     # add "OriginalFilename" after Aurora switched to SourceFilename
     #     # add "ProviderName" after special case powershell classic is resolved
     #     faulty_rules = []
-    #     for file in self.yield_next_rule_file_path(self.path_to_rules):
+    #     for file, rule in self.corpus.items():
     #         # typos is a list of tuples where each tuple contains ("The typo", "The correct version")
     #         typos = [("ServiceFilename", "ServiceFileName"), ("TargetFileName", "TargetFilename"), ("SourceFileName", "OriginalFileName"), ("Commandline", "CommandLine"), ("Targetobject", "TargetObject"), ("OriginalName", "OriginalFileName"), ("ImageFileName", "OriginalFileName"), ("details", "Details")]
     #         # Some fields exists in certain log sources in different forms than other log sources. We need to handle these as special cases
     #         # We check first the logsource to handle special cases
-    #         logsource = self.get_rule_part(file_path=file, part_name="logsource").values()
+    #         logsource = rule.get_part("logsource").values()
     #         # add more typos in specific logsources below
     #         if "windefend" in logsource:
     #             typos += [("New_Value", "NewValue"), ("Old_Value", "OldValue"), ('Source_Name', 'SourceName'), ("Newvalue", "NewValue"), ("Oldvalue", "OldValue"), ('Sourcename', 'SourceName')]
@@ -1183,7 +960,7 @@ class TestRules(unittest.TestCase):
     #         elif "file_access" in logsource:
     #             del(typos[typos.index(("TargetFileName", "TargetFilename"))]) # We remove the entry to "TargetFileName" to avoid confusion
     #             typos += [("TargetFileName", "FileName"), ("TargetFilename","FileName")]
-    #         detection = self.get_rule_part(file_path=file, part_name="detection")
+    #         detection = rule.get_part("detection")
     #         if detection:
     #             for search_identifier in detection:
     #                 if isinstance(detection[search_identifier], dict):
@@ -1196,102 +973,74 @@ class TestRules(unittest.TestCase):
     #     self.assertEqual(faulty_rules, [], Fore.RED + "There are rules with common typos in field names.")
 
     def test_unknown_value_modifier(self):
-        known_modifiers = ["contains", "startswith", "endswith", "all", "base64offset", "base64", "utf16le", "utf16be", "wide", "utf16", "windash", "re", "cidr"]
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(file_path=file, part_name="detection")
-            if detection:
-                for search_identifier in detection:
-                    if isinstance(detection[search_identifier], dict):
-                        for field in detection[search_identifier]:
-                            if "|" in field:
-                                for current_modifier in field.split('|')[1:]:
-                                    found = False
-                                    for target_modifier in known_modifiers:
-                                        if current_modifier == target_modifier:
-                                            found = True
-                                    if not found:
-                                        print(Fore.RED + "Rule {} uses an unknown field modifier ({}/{})".format(file, search_identifier, field))
-                                        faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_unknown_value_modifier)
 
         self.assertEqual(faulty_rules, [], Fore.RED + "There are rules with unknown value modifiers. Most often it is just a typo.")
 
+    @on_field()
+    def check_unknown_value_modifier(self, file, search_identifier, field, value):
+        known_modifiers = ["contains", "startswith", "endswith", "all", "base64offset", "base64", "utf16le", "utf16be", "wide", "utf16", "windash", "re", "cidr"]
+        if "|" in field:
+            for current_modifier in field.split('|')[1:]:
+                if current_modifier not in known_modifiers:
+                    yield Finding(file, Fore.RED + "Rule {} uses an unknown field modifier ({}/{})".format(file, search_identifier, field))
+
     def test_all_value_modifier_single_item(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            if detection:
-                for search_identifier in detection:
-                    if isinstance(detection[search_identifier], dict):
-                        for field in detection[search_identifier]:
-                            if "|all" in field and not isinstance(detection[search_identifier][field], list):
-                                print(Fore.RED + "Rule {} uses the 'all' modifier on a single item in selection ({}/{})".format(
-                                    file, search_identifier, field))
-                                faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_all_value_modifier_single_item)
 
         self.assertEqual(faulty_rules, [], Fore.RED + "There are rules with |all modifier only having one item. " +
                          "Single item values are not allowed to have an all modifier as some back-ends cannot support it. " +
                          "If you use it as a workaround to duplicate a field in a selection, use a new selection instead.")
 
-    def test_field_user_localization(self):
-        def checkUser(faulty_rules, dict):
-            for key, value in dict.items():
-                if "User" in key:
-                    if type(value) == str:
-                        if "AUTORI" in value or "AUTHORI" in value:
-                            print("Localized user name '{}'.".format(value))
-                            faulty_rules.append(file)
+    @on_field()
+    def check_all_value_modifier_single_item(self, file, search_identifier, field, value):
+        if "|all" in field and not isinstance(value, list):
+            yield Finding(file, Fore.RED + "Rule {} uses the 'all' modifier on a single item in selection ({}/{})".format(
+                file, search_identifier, field))
 
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            for sel_key, sel_value in detection.items():
-                if sel_key == "condition" or sel_key == "timeframe":
-                    continue
-                # single item selection
-                if type(sel_value) == dict:
-                    checkUser(faulty_rules, sel_value)
-                if type(sel_value) == list:
-                    # skip keyword selection
-                    if type(sel_value[0]) != dict:
-                        continue
-                    # multiple item selection
-                    for item in sel_value:
-                        checkUser(faulty_rules, item)
+    def test_field_user_localization(self):
+        faulty_rules = self.run_file_check(self.check_field_user_localization)
 
         self.assertEqual(faulty_rules, [], Fore.RED + "There are rules that match using localized user accounts. Better employ a generic version such as:\n" +
                          "User|contains: # covers many language settings\n" +
                          "    - 'AUTHORI'\n" +
                          "    - 'AUTORI'")
 
+    @on_field()
+    def check_field_user_localization(self, file, selection, key, value):
+        if "User" in key:
+            if type(value) == str:
+                if "AUTORI" in value or "AUTHORI" in value:
+                    yield Finding(file, "Localized user name '{}'.".format(value))
+
     def test_condition_operator_casesensitive(self):
-        faulty_rules = []
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            if detection:
-                valid = True
-                if isinstance(detection["condition"], str):
-                    param = detection["condition"].split(' ')
-                    for item in param:
-                        if item.lower() == 'or' and not item == 'or':
-                            valid = False
-                        elif item.lower() == 'and' and not item == 'and':
-                            valid = False
-                        elif item.lower() == 'not' and not item == 'not':
-                            valid = False
-                        elif item.lower() == 'of' and not item == 'of':
-                            valid = False
-                    if not valid:
-                        print(Fore.RED + "Rule {} has a invalid condition '{}' : 'or','and','not','of' are lowercase".format(
-                            file, detection["condition"]))
-                        faulty_rules.append(file)
+        faulty_rules = self.run_file_check(self.check_condition_operator_casesensitive)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
                          "There are rules using condition without lowercase operator")
 
+    def check_condition_operator_casesensitive(self, file, rule):
+        try:
+            conditions = rule.conditions
+        except ConditionSyntaxError:
+            return
+        for condition in conditions:
+            if any(token.kind in KEYWORDS and token.text != token.text.lower() for token in condition.tokens):
+                yield Finding(file, Fore.RED + "Rule {} has a invalid condition '{}' : 'or','and','not','of' are lowercase".format(
+                    file, condition.text))
+
+    def test_condition_syntax(self):
+        faulty_rules = self.run_file_check(self.check_condition_syntax)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules with a condition that does not parse")
+
+    def check_condition_syntax(self, file, rule):
+        try:
+            rule.conditions
+        except ConditionSyntaxError as error:
+            yield Finding(file, Fore.RED + "Rule {} has an invalid condition: {}".format(file, error))
+
     def test_broken_thor_logsource_config(self):
 
         faulty_config = False
@@ -1315,152 +1064,140 @@ class TestRules(unittest.TestCase):
         self.assertEqual(faulty_config, False, Fore.RED + "thor.yml configuration file located in 'tests/thor.yml' has a borken log source definition")
 
     def test_re_invalid_escapes(self):
-        faulty_rules = []
-        MAX_DEPTH = 3
-
-        def create_escape_allow_list():
-            """
-            Create a list of characters that are allowed to be escaped.
-            1. Based on string.punctuation chars that would already be escaped by re.escape()
-            2. Followed by special chars like '\n', '\t', '\[0-9]' etc.
-            3. Followed by Double- or Single Quote to escape string literals.
-            """
-            allowed_2_be_escaped = []
+        faulty_rules = self.run_file_check(self.check_re_invalid_escapes)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules using illegal re-escapes")
+
+    @on_field()
+    def check_re_invalid_escapes(self, file, selection, field, value):
+        """
+        Check the values of "|re" fields against bad escaped characters
+        """
+        if "|re" not in field or not (type(value) == str or type(value) == list):
+            return
+        escape_allow_list = self.RE_ESCAPE_ALLOW_LIST
+        found_bad_escapes = []
+        to_check = []
+        if type(value) == str:
+            to_check.append(value)
+        else:
+            to_check = value
+        for str_item in to_check:
+            l = tuple(str_item)
             index = 0
-            l = tuple(re.escape(string.punctuation))
             for c in l:
                 if c == "\\":
-                    allowed_2_be_escaped.append(l[index+1])
+                    # 'l[index-1] != "\\"' ---> Allows "\\\\"
+                    # Check if character after \ is not in escape_allow_list and also not already found
+                    if l[index-1] != "\\" and l[index+1] not in escape_allow_list and l[index+1] not in found_bad_escapes:
+                        # Only for debugging:
+                        # print(f"Illegal escape found {c}{l[index+1]}")
+                        found_bad_escapes.append(f"{l[index+1]}")
                 index += 1
 
-            re_specials = [
-                "A", "b", "B", "d", "D", "f", "n", "r", "s",
-                "S", "t", "v", "w", "W", "Z",
-                # Match Groups
-                "0", "1", "2", "3", "4", "5",
-                "6", "7", "8", "9",
-            ]
-            allowed_2_be_escaped.extend(re_specials)
-
-            allowed_2_be_escaped.extend([
-                '"',
-                '\'',
-            ])
-
-            return allowed_2_be_escaped
-
-        def check_list_or_recurse_on_dict(item, depth: int, special: bool) -> None:
-            """
-            Recursive walk through the detection to find "|re" occurance.
-            Jump to check_item_for_bad_escapes with lists or strings found.
-            """
-            if type(item) == list:
-                pass
-                # check_item_for_bad_escapes(item)
-            elif type(item) == dict and depth <= MAX_DEPTH:
-                for keys, sub_item in item.items():
-                    if "|re" in keys: # Covers both "base64" and "base64offset" modifiers
-                        if type(sub_item) == str or type(sub_item) == list:
-                            check_item_for_bad_escapes(sub_item)
-                        else:
-                            check_list_or_recurse_on_dict(sub_item, depth + 1, True)
-                    else:
-                        check_list_or_recurse_on_dict(sub_item, depth + 1, special)
-
-        def check_item_for_bad_escapes(item):
-            """
-            Check item against bad escaped characters
-            """
-            found_bad_escapes = []
-            to_check = []
-            if type(item) == str:
-                to_check.append(item)
+        if len(found_bad_escapes) > 0:
+            yield Finding(file, Fore.RED + "Rule {} has forbidden escapes in |re '{}'".format(file, ",".join(found_bad_escapes)))
+
+
+    def test_re_performance(self):
+        faulty_rules = self.run_file_check(self.check_re_performance)
+
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules with |re values that are invalid or can backtrack catastrophically. Run 'python -m sigmalint.backtracking' for the estimated cost of all suspicious values")
+
+    # Timed on this machine: the findings are not cached, a slow or noisy run must not outlive itself
+    @on_rule(cached=False)
+    def check_re_performance(self, file, rule):
+        """
+        Compile the values of "|re" fields and time the suspicious ones on adversarial input
+        """
+        _, reports = rule_cost(rule)
+        faulty = [(selection, field, report) for selection, field, report in reports if report.error or is_too_slow(report)]
+        for index, (selection, field, report) in enumerate(faulty):
+            if report.error:
+                message = Fore.RED + "Rule {} has an invalid regular expression in {}/{}: {}".format(
+                    file, selection, field, report.error)
             else:
-                to_check = item
-            for str_item in to_check:
-                l = tuple(str_item)
-                index = 0
-                for c in l:
-                    if c == "\\":
-                        # 'l[index-1] != "\\"' ---> Allows "\\\\"
-                        # Check if character after \ is not in escape_allow_list and also not already found
-                        if l[index-1] != "\\" and l[index+1] not in escape_allow_list and l[index+1] not in found_bad_escapes:
-                            # Only for debugging:
-                            # print(f"Illegal escape found {c}{l[index+1]}")
-                            found_bad_escapes.append(f"{l[index+1]}")
-                    index += 1
-
-            if len(found_bad_escapes) > 0:
-                print(Fore.RED + "Rule {} has forbidden escapes in |re '{}'".format(file, ",".join(found_bad_escapes)))
-                faulty_rules.append(file)
+                message = Fore.RED + "Rule {} has a |re value in {}/{} with {} backtracking ({}), estimated {} per {} characters: '{}'".format(
+                    file, selection, field, report.growth, ", ".join("{} {}".format(issue.kind, issue.detail) for issue in report.issues),
+                    format_seconds(report.estimate), REFERENCE_LENGTH, report.pattern)
+            yield Finding(file if index == 0 else None, message)
 
-        # Create escape_allow_list for this test
-        escape_allow_list = create_escape_allow_list()
+    def test_rx_schema(self):
+        faulty_rules = self.run_file_check(self.check_rx_schema)
 
-        # For each rule file, extract detection and dive into recursion
-        for file in self.yield_next_rule_file_path(self.path_to_rules):
-            detection = self.get_rule_part(
-                file_path=file, part_name="detection")
-            if detection:
-                check_list_or_recurse_on_dict(detection, 1, False)
+        self.assertEqual(faulty_rules, [], Fore.RED +
+                         "There are rules that do not match sigma-schema.rx.yml")
+
+    def check_rx_schema(self, file, rule):
+        for document in rule_documents(rule):
+            errors = self.RX_SCHEMA.validate(document)
+            for index, (path, message) in enumerate(errors):
+                yield Finding(file if index == 0 else None, Fore.YELLOW +
+                              "Rule {} does not match the schema at '{}': {}".format(file, format_path(path), message))
+
+    def test_query_cost(self):
+        faulty_rules = self.run_file_check(self.check_query_cost)
 
         self.assertEqual(faulty_rules, [], Fore.RED +
-                         "There are rules using illegal re-escapes")
+                         "There are rules over the query cost budgets of tests/query-cost.yml. Run 'python -m sigmalint.querycost' for the cost of all rules")
+
+    def check_query_cost(self, file, rule):
+        """
+        Score the backend query of the rule: leading wildcards, keywords, regular expressions, modifier fan-out and OR width
+        """
+        model = self.QUERY_COST_MODEL
+        cost = rule_query_cost(rule, model)
+        over = model.over_budget(rule.path, cost)
+        if over:
+            accepted = rule.path in model.accepted
+            yield Finding(None if accepted else file, (Fore.YELLOW if accepted else Fore.RED) +
+                          "Rule {} has a query cost over budget{}: {}".format(
+                              file, " (accepted)" if accepted else "",
+                              ", ".join("{} {} > {}".format(name, value, limit) for name, value, limit in over)))
+
+
+def create_escape_allow_list():
+    """
+    Create a list of characters that are allowed to be escaped.
+    1. Based on string.punctuation chars that would already be escaped by re.escape()
+    2. Followed by special chars like '\n', '\t', '\[0-9]' etc.
+    3. Followed by Double- or Single Quote to escape string literals.
+    """
+    allowed_2_be_escaped = []
+    index = 0
+    l = tuple(re.escape(string.punctuation))
+    for c in l:
+        if c == "\\":
+            allowed_2_be_escaped.append(l[index+1])
+        index += 1
+
+    re_specials = [
+        "A", "b", "B", "d", "D", "f", "n", "r", "s",
+        "S", "t", "v", "w", "W", "Z",
+        # Match Groups
+        "0", "1", "2", "3", "4", "5",
+        "6", "7", "8", "9",
+    ]
+    allowed_2_be_escaped.extend(re_specials)
+
+    allowed_2_be_escaped.extend([
+        '"',
+        '\'',
+    ])
+
+    return allowed_2_be_escaped
+
 
 def get_mitre_data():
     """
-    Use Tags from CTI subrepo to get consitant data
+    Use Tags from CTI subrepo to get consitant data, precompiled by sigmalint.attack
     """
-    cti_path = "cti/"
-    cti_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), cti_path)
-
-    # Get ATT&CK information
-    lift = attack_client(local_path=cti_path)
-    # Techniques
-    MITRE_TECHNIQUES = []
-    MITRE_TECHNIQUE_NAMES = []
-    MITRE_PHASE_NAMES = set()
-    MITRE_TOOLS = []
-    MITRE_GROUPS = []
-    # Techniques
-    enterprise_techniques = lift.get_enterprise_techniques()
-    for t in enterprise_techniques:
-        MITRE_TECHNIQUE_NAMES.append(
-            t['name'].lower().replace(' ', '_').replace('-', '_'))
-        for r in t.external_references:
-            if 'external_id' in r:
-                MITRE_TECHNIQUES.append(r['external_id'].lower())
-        if 'kill_chain_phases' in t:
-            for kc in t['kill_chain_phases']:
-                if 'phase_name' in kc:
-                    MITRE_PHASE_NAMES.add(kc['phase_name'].replace('-', '_'))
-    # Tools / Malware
-    enterprise_tools = lift.get_enterprise_tools()
-    for t in enterprise_tools:
-        for r in t.external_references:
-            if 'external_id' in r:
-                MITRE_TOOLS.append(r['external_id'].lower())
-    enterprise_malware = lift.get_enterprise_malware()
-    for m in enterprise_malware:
-        for r in m.external_references:
-            if 'external_id' in r:
-                MITRE_TOOLS.append(r['external_id'].lower())
-    # Groups
-    enterprise_groups = lift.get_enterprise_groups()
-    for g in enterprise_groups:
-        for r in g.external_references:
-            if 'external_id' in r:
-                MITRE_GROUPS.append(r['external_id'].lower())
-
-    # Debugging
-    print("MITRE ATT&CK LIST LENGTHS: %d %d %d %d %d" % (len(MITRE_TECHNIQUES), len(
-        MITRE_TECHNIQUE_NAMES), len(list(MITRE_PHASE_NAMES)), len(MITRE_GROUPS), len(MITRE_TOOLS)))
-
-    # Combine all IDs to a big tag list
-    return ["attack." + item for item in MITRE_TECHNIQUES + MITRE_TECHNIQUE_NAMES + list(MITRE_PHASE_NAMES) + MITRE_GROUPS + MITRE_TOOLS]
+    return load_attack_index().tags
 
 
 if __name__ == "__main__":
     init(autoreset=True)
     # Run the tests
-    unittest.main()
+    unittest.main(argv=parse_args(sys.argv))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Checks of the sigmalint machinery itself, on scratch repositories
+
+Run using the command
+# python test_sigmalint.py
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from sigmalint.changes import changed_lint_inputs, changed_rule_paths
+
+RULE_DIRECTORIES = ["rules"]
+
+
+class TestChangedSince(unittest.TestCase):
+    """
+    --changed-since lints the changed rules only while the checks themselves are unchanged
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="sigmalint-")
+        self.addCleanup(shutil.rmtree, self.root)
+        self.git("init", "-q")
+        self.write("rules/windows/a.yml", "title: a\n")
+        self.write("rules/windows/b.yml", "title: b\n")
+        self.write("tests/logsource.json", "{}\n")
+        self.write("tests/sigmalint/checks.py", "\n")
+        self.write("sigma-schema.rx.yml", "type: //any\n")
+        self.write("README.md", "Sigma\n")
+        self.git("add", ".")
+        self.git("-c", "user.name=test", "-c", "user.email=test@example.org", "commit", "-q", "-m", "base")
+
+    def git(self, *args):
+        subprocess.run(["git", "-C", self.root] + list(args), check=True)
+
+    def write(self, path: str, text: str):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_rules_only(self):
+        self.write("rules/windows/a.yml", "title: a2\n")
+        self.write("rules/windows/c.yml", "title: c\n")
+        self.write("README.md", "Sigma rules\n")
+        self.assertEqual(changed_lint_inputs("HEAD", self.root), [])
+        self.assertEqual(sorted(changed_rule_paths("HEAD", RULE_DIRECTORIES, self.root)),
+                         [os.path.join("rules", "windows", name) for name in ("a.yml", "c.yml")])
+
+    def test_checks_changed(self):
+        self.write("tests/sigmalint/checks.py", "# new check\n")
+        self.assertEqual(changed_lint_inputs("HEAD", self.root), ["tests/sigmalint/checks.py"])
+
+    def test_data_changed(self):
+        self.write("tests/logsource.json", "{\"a\": 1}\n")
+        self.write("sigma-schema.rx.yml", "type: //str\n")
+        self.assertEqual(changed_lint_inputs("HEAD", self.root), ["sigma-schema.rx.yml", "tests/logsource.json"])
+
+    def test_checks_added_or_removed(self):
+        self.write("tests/sigmalint/new.py", "\n")
+        self.write(".github/workflows/sigma-test.yml", "name: test\n")
+        os.remove(os.path.join(self.root, "tests", "logsource.json"))
+        self.assertEqual(changed_lint_inputs("HEAD", self.root),
+                         [".github/workflows/sigma-test.yml", "tests/logsource.json", "tests/sigmalint/new.py"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+"""
+Checks of the sigmamatch rule engine: value modifiers, the condition grammar, the literal
+prefilter, and the compiled rule set against the rules compiled and evaluated one by one
+
+Run using the command
+# python test_sigmamatch.py
+"""
+
+import base64
+import textwrap
+import unittest
+
+from sigmalint.corpus import Rule, RuleCorpus, parse_rule_text
+from sigmalint.paths import RULE_DIRECTORIES
+from sigmamatch.compiler import DETECTION_KEYWORDS, NodeCache, RuleCompileError, compile_rule
+from sigmamatch.event import EventView
+from sigmamatch.prefilter import PREFILTER_MIN_RULES
+from sigmamatch.ruleset import RuleSet
+from sigmamatch.values import ValueModifierError, keyword_modifiers, value_patterns
+
+# Events of the corpus checked against every rule, the others only against their own rule
+CORPUS_SAMPLE_STRIDE = 8
+
+
+def make_rule(text: str, name: str = "test") -> Rule:
+    text = textwrap.dedent(text)
+    path = "rules/test/{}.yml".format(name)
+    return Rule(path, path, text, parse_rule_text(text))
+
+
+def detection_rule(detection: str, name: str = "test") -> Rule:
+    return make_rule("title: {}\ndetection:\n{}".format(name, textwrap.indent(textwrap.dedent(detection), "    ")), name)
+
+
+def compile_ruleset(rules: list) -> RuleSet:
+    # The rules compiled together as by RuleSet.from_rules, without the automata cache on disk
+    nodes = NodeCache()
+    return RuleSet([compile_rule(rule, nodes=nodes) for rule in rules], nodes=nodes)
+
+
+def naive_matches(compiled: list, event: dict) -> list:
+    view = EventView(event)
+    return [rule.path for rule in compiled if rule.searches and rule.search(view)]
+
+
+class TestModifiers(unittest.TestCase):
+
+    def assertMatches(self, detection: str, event: dict, expected: bool = True):
+        matched = compile_rule(detection_rule(detection)).search(EventView(event))
+        self.assertEqual(matched, expected, "{} {} {}".format(
+            textwrap.dedent(detection).strip(), "should match" if expected else "should not match", event))
+
+    def test_plain_values(self):
+        detection = """
+            selection:
+                Image: 'C:\\Windows\\System32\\cmd.exe'
+                User: 'adm?n*'
+            condition: selection
+        """
+        self.assertMatches(detection, {"Image": "c:\\windows\\system32\\CMD.EXE", "User": "ADMIN_1"})
+        self.assertMatches(detection, {"Image": "c:\\windows\\system32\\cmd.exe2", "User": "admin"}, False)
+        self.assertMatches(detection, {"Image": "c:\\windows\\system32\\cmd.exe", "User": "admn"}, False)
+
+    def test_numbers_and_lists(self):
+        detection = """
+            selection:
+                EventID:
+                    - 4688
+                    - 1
+            condition: selection
+        """
+        self.assertMatches(detection, {"EventID": 4688})
+        self.assertMatches(detection, {"EventID": "1"})
+        self.assertMatches(detection, {"EventID": [7, 1]})
+        self.assertMatches(detection, {"EventID": 46880}, False)
+
+    def test_contains_startswith_endswith(self):
+        detection = """
+            selection:
+                CommandLine|contains: 'invoke-'
+                ParentImage|startswith: 'C:\\Program Files'
+                Image|endswith: '\\powershell.exe'
+            condition: selection
+        """
+        event = {"CommandLine": "x Invoke-Expression", "ParentImage": "c:\\program files\\a.exe",
+                 "Image": "C:\\Windows\\PowerShell.exe"}
+        self.assertMatches(detection, event)
+        self.assertMatches(detection, dict(event, Image="C:\\Windows\\powershell.exe.bak"), False)
+        self.assertMatches(detection, dict(event, ParentImage="d:\\c:\\program files"), False)
+
+    def test_windash(self):
+        detection = """
+            selection:
+                CommandLine|windash|contains: ' -enc '
+            condition: selection
+        """
+        for dash in ("-", "/", "–", "—", "―"):
+            self.assertMatches(detection, {"CommandLine": "powershell {}enc AAAA".format(dash)})
+        self.assertMatches(detection, {"CommandLine": "powershell +enc AAAA"}, False)
+        # Only a dash starting a flag is replaced
+        self.assertMatches("""
+            selection:
+                CommandLine|windash|contains: 'a-b'
+            condition: selection
+        """, {"CommandLine": "a/b"}, False)
+
+    def test_base64(self):
+        detection = """
+            selection:
+                CommandLine|base64: 'whoami'
+            condition: selection
+        """
+        self.assertMatches(detection, {"CommandLine": base64.b64encode(b"whoami").decode()})
+        self.assertMatches(detection, {"CommandLine": "x" + base64.b64encode(b"whoami").decode()}, False)
+
+    def test_base64offset(self):
+        detection = """
+            selection:
+                CommandLine|base64offset|contains: 'http://'
+            condition: selection
+        """
+        for prefix in (b"", b"a", b"ab", b"abc"):
+            encoded = base64.b64encode(prefix + b"http://example.org").decode()
+            self.assertMatches(detection, {"CommandLine": "powershell -e " + encoded})
+        self.assertMatches(detection, {"CommandLine": base64.b64encode(b"https://example.org").decode()}, False)
+
+    def test_wide_and_utf16(self):
+        for modifier, encoding in (("wide", "utf-16le"), ("utf16le", "utf-16le"), ("utf16be", "utf-16be"),
+                                   ("utf16", "utf-16")):
+            detection = """
+                selection:
+                    CommandLine|{}|base64offset|contains: 'ping'
+                condition: selection
+            """.format(modifier)
+            # The encoded value at any offset of a longer text, utf16 with its byte order mark
+            for prefix in (b"", b"x", b"xy"):
+                encoded = base64.b64encode(prefix + "ping".encode(encoding)).decode()
+                self.assertMatches(detection, {"CommandLine": "-enc " + encoded})
+            self.assertMatches(detection, {"CommandLine": base64.b64encode(b"ping").decode()}, False)
+
+    def test_cidr(self):
+        detection = """
+            selection:
+                DestinationIp|cidr:
+                    - '10.0.0.0/8'
+                    - '192.168.1.0/24'
+                    - '2001:db8::/32'
+            condition: selection
+        """
+        for address in ("10.1.2.3", "192.168.1.255", "2001:db8::1"):
+            self.assertMatches(detection, {"DestinationIp": address})
+        for address in ("11.0.0.1", "192.168.2.1", "2001:db9::1", "not an address", ""):
+            self.assertMatches(detection, {"DestinationIp": address}, False)
+        self.assertMatches(detection, {"DestinationIp": ["8.8.8.8", "10.0.0.1"]})
+
+    def test_regex(self):
+        self.assertMatches("""
+            selection:
+                CommandLine|re: '^cmd\\.exe /c [a-z]+$'
+            condition: selection
+        """, {"CommandLine": "CMD.exe /c dir"}, False)
+        detection = """
+            selection:
+                CommandLine|re|i: '^cmd\\.exe /c [a-z]+$'
+            condition: selection
+        """
+        self.assertMatches(detection, {"CommandLine": "CMD.exe /c DIR"})
+        self.assertMatches(detection, {"CommandLine": "cmd.exe /c dir 1"}, False)
+        # Searched, not matched from the start
+        self.assertMatches("""
+            selection:
+                CommandLine|re: 'c[0-9]d'
+            condition: selection
+        """, {"CommandLine": "abc1d"})
+
+    def test_all(self):
+        detection = """
+            selection:
+                CommandLine|contains|all:
+                    - 'vssadmin'
+                    - 'delete'
+                    - 'shadows'
+            condition: selection
+        """
+        self.assertMatches(detection, {"CommandLine": "vssadmin.exe Delete Shadows /all"})
+        self.assertMatches(detection, {"CommandLine": "vssadmin.exe list shadows"}, False)
+
+    def test_null(self):
+        detection = """
+            selection:
+                OriginalFileName: null
+            condition: selection
+        """
+        self.assertMatches(detection, {})
+        self.assertMatches(detection, {"OriginalFileName": None})
+        self.assertMatches(detection, {"OriginalFileName": "a.exe"}, False)
+        self.assertMatches(detection, {"OriginalFileName": ""}, False)
+        empty = """
+            selection:
+                OriginalFileName: ''
+            condition: selection
+        """
+        self.assertMatches(empty, {"OriginalFileName": ""})
+        self.assertMatches(empty, {}, False)
+
+    def test_keywords(self):
+        detection = """
+            keywords:
+                - 'mimikatz'
+                - 'sekurlsa::*password'
+            condition: keywords
+        """
+        self.assertMatches(detection, {"CommandLine": "run MIMIKATZ.exe"})
+        self.assertMatches(detection, {"Details": {"Text": ["x", "sekurlsa::logonpasswords"]}})
+        self.assertMatches(detection, {"CommandLine": "sekurlsa::logon"}, False)
+
+    def test_keywords_all(self):
+        detection = """
+            keywords:
+                '|all':
+                    - ':179'
+                    - 'IP-TCP-3-BADAUTH'
+            condition: keywords
+        """
+        self.assertMatches(detection, {"Message": "%TCP-6-BADAUTH: 10.0.0.1:179 IP-TCP-3-BADAUTH"})
+        self.assertMatches(detection, {"Port": ":179", "Details": {"Code": "ip-tcp-3-badauth"}})
+        self.assertMatches(detection, {"Message": "10.0.0.1:179"}, False)
+        self.assertMatches("""
+            keywords:
+                '|all|endswith': 'x.so'
+            condition: keywords
+        """, {"Message": "x.so loaded"}, False)
+
+    def test_nested_fields(self):
+        detection = """
+            selection:
+                Target.Process|endswith: '\\lsass.exe'
+            condition: selection
+        """
+        self.assertMatches(detection, {"Target": {"Process": "C:\\Windows\\lsass.exe"}})
+        self.assertMatches(detection, {"Target.Process": "C:\\Windows\\lsass.exe"})
+        self.assertMatches(detection, {"Target": "C:\\Windows\\lsass.exe"}, False)
+
+    def test_unknown_modifier(self):
+        with self.assertRaises(RuleCompileError):
+            compile_rule(detection_rule("""
+                selection:
+                    CommandLine|rot13: 'x'
+                condition: selection
+            """))
+
+
+class TestConditions(unittest.TestCase):
+
+    DETECTION = """
+        sel_a:
+            A: 'a'
+        sel_b:
+            B: 'b'
+        sel-c:
+            C: 'c'
+        _filter:
+            F: 'f'
+        condition: {}
+    """
+
+    def assertCondition(self, condition: str, event: dict, expected: bool = True):
+        matched = compile_rule(detection_rule(self.DETECTION.format(condition))).search(EventView(event))
+        self.assertEqual(matched, expected, "'{}' {} {}".format(
+            condition, "should match" if expected else "should not match", event))
+
+    def test_boolean_operators(self):
+        self.assertCondition("sel_a and sel_b", {"A": "a", "B": "b"})
+        self.assertCondition("sel_a and sel_b", {"A": "a"}, False)
+        self.assertCondition("sel_a or sel_b", {"B": "b"})
+        self.assertCondition("sel_a and not sel_b", {"A": "a", "B": "b"}, False)
+        self.assertCondition("sel_a AND NOT sel_b", {"A": "a"})
+
+    def test_precedence(self):
+        # 'not' before 'and' before 'or'
+        self.assertCondition("sel_a or sel_b and sel-c", {"A": "a"})
+        self.assertCondition("(sel_a or sel_b) and sel-c", {"A": "a"}, False)
+        self.assertCondition("not sel_a and sel_b", {"B": "b"})
+        self.assertCondition("not (sel_a and sel_b)", {"A": "a", "B": "b"}, False)
+
+    def test_identifiers_with_dash(self):
+        self.assertCondition("sel-c and sel_a", {"A": "a", "C": "c"})
+        self.assertCondition("1 of sel-*", {"C": "c"})
+
+    def test_quantifiers(self):
+        self.assertCondition("1 of sel_*", {"B": "b"})
+        self.assertCondition("all of sel_*", {"B": "b"}, False)
+        self.assertCondition("all of sel_*", {"A": "a", "B": "b"})
+        self.assertCondition("all of sel_* and not _filter", {"A": "a", "B": "b", "F": "f"}, False)
+
+    def test_them_without_underscore_identifiers(self):
+        event = {"A": "a", "B": "b", "C": "c"}
+        self.assertCondition("all of them", event)
+        self.assertCondition("1 of them", {"F": "f"}, False)
+        self.assertCondition("1 of them", {"C": "c"})
+
+    def test_any_of_is_invalid(self):
+        with self.assertRaises(RuleCompileError):
+            compile_rule(detection_rule(self.DETECTION.format("any of sel_*")))
+
+    def test_unknown_identifier(self):
+        with self.assertRaises(RuleCompileError):
+            compile_rule(detection_rule(self.DETECTION.format("sel_a and sel_d")))
+
+
+class TestPrefilter(unittest.TestCase):
+    """
+    RuleSet.match with its literal prefilter finds what every rule evaluated on its own finds
+    """
+
+    def assertSound(self, detections: list, events: list, expected: list):
+        # Enough rules on other fields that the prefilter is built
+        rules = [detection_rule(detection, "rule_{}".format(number)) for number, detection in enumerate(detections)]
+        rules += [detection_rule("""
+            selection:
+                Filler{0}|contains: 'filler {0}'
+            condition: selection
+        """.format(number), "filler_{}".format(number)) for number in range(PREFILTER_MIN_RULES)]
+        ruleset = compile_ruleset(rules)
+        self.assertTrue(ruleset._prefilter.fields, "The prefilter is not built")
+        compiled = [compile_rule(rule) for rule in rules]
+        for event, names in zip(events, expected):
+            matched = sorted(rule.path for rule in ruleset.match(event))
+            self.assertEqual(matched, sorted(naive_matches(compiled, event)), "Prefilter dropped a hit of {}".format(event))
+            self.assertEqual(matched, sorted("rules/test/rule_{}.yml".format(number) for number in names), event)
+
+    def test_path_suffix(self):
+        detections = ["""
+            selection:
+                Image|endswith: '\\rundll32.exe'
+            condition: selection
+        """, """
+            selection:
+                Image|endswith:
+                    - '\\System32\\cmd.exe'
+                    - '/bin/sh'
+            condition: selection
+        """, """
+            selection:
+                Image|endswith: '\\'
+            condition: selection
+        """, """
+            selection:
+                Image|endswith: 'dll32.exe'
+            condition: selection
+        """]
+        events = [
+            {"Image": "C:\\Windows\\System32\\RUNDLL32.EXE"},
+            {"Image": "c:\\windows\\system32\\cmd.exe"},
+            {"Image": "c:\\windows\\syswow64\\cmd.exe"},
+            {"Image": "/usr/bin/sh"},
+            {"Image": "c:\\temp\\"},
+            {"Image": "c:/windows/rundll32.exe"},
+            {"Image": ["c:\\a.exe", "d:\\x\\rundll32.exe"]},
+        ]
+        self.assertSound(detections, events, [[0, 3], [1], [], [1], [2], [3], [0, 3]])
+
+    def test_nested_fields(self):
+        detections = ["""
+            selection:
+                Target.Image|contains: 'lsass'
+            condition: selection
+        """, """
+            selection:
+                Target.Image|endswith: '\\lsass.exe'
+                Source.Pid: 4
+            condition: selection
+        """]
+        events = [
+            {"Target": {"Image": "C:\\Windows\\lsass.exe"}},
+            {"Target": {"Image": "C:\\Windows\\lsass.exe"}, "Source": {"Pid": 4}},
+            {"Target.Image": "C:\\Windows\\lsass.exe"},
+            {"Target": {"Image": "C:\\Windows\\explorer.exe"}},
+            {"Image": "C:\\Windows\\lsass.exe"},
+        ]
+        self.assertSound(detections, events, [[0], [0, 1], [0], [], []])
+
+    def test_keywords(self):
+        detections = ["""
+            keywords:
+                - 'mimikatz'
+                - 'kerberos::golden'
+            condition: keywords
+        """, """
+            keywords:
+                - 4688
+            condition: keywords
+        """, """
+            keywords:
+                '|all':
+                    - ':179'
+                    - 'IP-TCP-3-BADAUTH'
+            condition: keywords
+        """, """
+            keywords:
+                - 'failed password'
+            selection:
+                Service: 'sshd'
+            condition: keywords and selection
+        """]
+        events = [
+            {"CommandLine": "Invoke-Mimikatz"},
+            {"Nested": {"List": ["x", "KERBEROS::GOLDEN /user"]}},
+            {"EventID": 4688},
+            {"Message": "%TCP-6-BADAUTH: 10.0.0.1:179 IP-TCP-3-BADAUTH"},
+            {"Port": ":179", "Details": {"Code": "ip-tcp-3-badauth"}},
+            {"Message": "10.0.0.1:179"},
+            {"Service": "sshd", "Message": "Failed password for root"},
+            {"Service": "cron", "Message": "Failed password for root"},
+            {"Message": "nothing to see"},
+        ]
+        self.assertSound(detections, events, [[0], [0], [1], [2], [2], [], [3], [], []])
+
+    def test_cidr_owners(self):
+        detections = ["""
+            selection:
+                DestinationIp|cidr: '10.0.0.0/8'
+            condition: selection
+        """, """
+            selection:
+                DestinationIp|cidr:
+                    - '10.1.0.0/16'
+                    - 'fe80::/10'
+            condition: selection
+        """, """
+            selection:
+                DestinationIp|cidr: '10.0.0.0/8'
+                DestinationPort: 445
+            condition: selection
+        """, """
+            selection_ip:
+                DestinationIp|cidr: '192.168.0.0/16'
+            selection_host:
+                DestinationHostname|contains: 'internal'
+            condition: 1 of selection_*
+        """]
+        events = [
+            {"DestinationIp": "10.1.2.3"},
+            {"DestinationIp": "10.2.0.1", "DestinationPort": 445},
+            {"DestinationIp": "FE80::1"},
+            {"DestinationIp": "192.168.5.5"},
+            {"DestinationHostname": "db.internal.example"},
+            {"DestinationIp": "11.0.0.1", "DestinationPort": 445},
+        ]
+        self.assertSound(detections, events, [[0, 1], [0, 2], [1], [3], [3], []])
+
+    def test_rules_without_atoms(self):
+        detections = ["""
+            selection:
+                Image|endswith: '\\cmd.exe'
+            filter:
+                CommandLine|contains: '/c echo'
+            condition: not filter
+        """, """
+            selection:
+                CommandLine|re: 'a.+b'
+            condition: selection
+        """, """
+            selection:
+                Image|contains|all:
+                    - 'temp'
+                    - 'x'
+            condition: selection
+        """]
+        events = [
+            {"CommandLine": "a to b"},
+            {"CommandLine": "cmd /c echo a1b", "Image": "c:\\temp\\x.exe"},
+        ]
+        self.assertSound(detections, events, [[0, 1], [1, 2]])
+
+
+def _sample_value(pattern):
+    # An event value matching a literal pattern, None for the other kinds
+    if pattern.kind == "exact":
+        return pattern.value
+    if pattern.kind == "startswith":
+        return pattern.value + " tail"
+    if pattern.kind == "endswith":
+        return "c:\\head\\" + pattern.value
+    if pattern.kind == "contains":
+        return "head " + pattern.value + " tail"
+    if pattern.kind == "cidr":
+        network = pattern.value
+        return str(network.network_address + (1 if network.num_addresses > 1 else 0))
+    return None
+
+
+def _put(event: dict, field: str, value) -> None:
+    # 'a.b' fields are nested as the events of most sources are
+    *parents, name = field.split(".")
+    for parent in parents:
+        event = event.setdefault(parent, {})
+        if not isinstance(event, dict):
+            return
+    event.setdefault(name, value)
+
+
+def selection_event(selection):
+    """
+    An event satisfying the literal of the first value of every field of a search identifier,
+    None if it has none
+    """
+    if isinstance(selection, list):
+        maps = [item for item in selection if isinstance(item, dict)]
+        if maps:
+            return selection_event(maps[0])
+        for keyword in selection:
+            for pattern in value_patterns(keyword, ["contains"]):
+                value = _sample_value(pattern)
+                if value is not None:
+                    return {"Message": value}
+        return None
+    if not isinstance(selection, dict):
+        return None
+    event = {}
+    for key, values in selection.items():
+        field, *modifiers = str(key).split("|")
+        values = values if isinstance(values, list) else [values]
+        if not field:
+            # Keywords: one value holding all of them, as '|all' needs
+            try:
+                samples = [_sample_value(value_patterns(value, keyword_modifiers(modifiers))[0]) for value in values]
+            except ValueModifierError:
+                continue
+            if samples and None not in samples:
+                _put(event, "Message", " ".join(samples))
+            continue
+        try:
+            patterns = value_patterns(values[0], modifiers) if values else []
+        except ValueModifierError:
+            continue
+        for pattern in patterns:
+            value = _sample_value(pattern)
+            if value is not None:
+                _put(event, field, value)
+                break
+    return event or None
+
+
+class TestCorpus(unittest.TestCase):
+    """
+    The rules of the repository compiled into one RuleSet match the events built from their
+    literals as the rules compiled and evaluated one by one do
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rules = []
+        cls.compiled = []
+        for rule in RuleCorpus.shared(RULE_DIRECTORIES):
+            try:
+                cls.compiled.append(compile_rule(rule))
+            except RuleCompileError:
+                continue
+            cls.rules.append(rule)
+        cls.ruleset = compile_ruleset(cls.rules)
+        # (event, path of the rule it was built from)
+        cls.events = []
+        for rule in cls.rules:
+            for name, selection in rule.get_part("detection").items():
+                if name in DETECTION_KEYWORDS:
+                    continue
+                event = selection_event(selection)
+                if event is not None:
+                    cls.events.append((event, rule.path))
+
+    def test_compiled_together(self):
+        self.assertEqual(len(self.ruleset), len(self.compiled))
+        self.assertTrue(self.ruleset._prefilter.fields, "The prefilter is not built")
+        self.assertGreater(len(self.events), len(self.rules))
+
+    def test_own_rule_hits(self):
+        # Every event against the rule it was built from, which the prefilter must not drop
+        compiled = {rule.path: rule for rule in self.compiled}
+        faulty = []
+        for event, path in self.events:
+            rule = compiled[path]
+            if rule.searches and rule.search(EventView(event)):
+                if path not in [matched.path for matched in self.ruleset.match(event)]:
+                    faulty.append((path, event))
+        self.assertEqual(faulty, [], "RuleSet.match dropped hits of these rules")
+
+    def test_all_rules_sample(self):
+        faulty = []
+        for event, _ in self.events[::CORPUS_SAMPLE_STRIDE]:
+            expected = naive_matches(self.compiled, event)
+            matched = [rule.path for rule in self.ruleset.match(event)]
+            if sorted(matched) != sorted(expected):
+                faulty.append((event, sorted(set(matched) ^ set(expected))))
+        self.assertEqual(faulty, [], "RuleSet.match differs from the rules evaluated one by one")
+
+
+if __name__ == "__main__":
+    unittest.main()